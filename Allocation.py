@@ -0,0 +1,264 @@
+import heapq
+import math
+from SpatialIndex import SpatialIndex
+
+INF = math.inf
+
+# Transportation problem per resource type: move as much of each resource from
+# senders to receivers as possible at the lowest total route cost.
+#   supplies  {sender index: quantity}
+#   demands   {receiver index: quantity}
+#   edges     [(sender index, receiver index, cost)], unreachable pairs left out
+# Solvers take those three and return {(sender index, receiver index): quantity}.
+
+def octile_costs(pairs):
+    costs = []
+    for (sx, sy), (rx, ry) in pairs:
+        dx = abs(sx - rx)
+        dy = abs(sy - ry)
+        costs.append(dx + dy + (math.sqrt(2) - 2) * min(dx, dy))
+    return costs
+
+def min_cost_flow(supplies, demands, edges, stats=None):
+    # Min-cost max-flow by successive shortest paths, grown one node at a time
+    # from the scarcer side to a super node behind the other side, as in JV for
+    # the assignment problem: each Dijkstra runs on reduced costs, stops once the
+    # super node is settled, and only moves the potentials of settled nodes, so
+    # a search only explores the neighbourhood it needs instead of the whole
+    # graph. Every scarce node also has an "unmet" edge straight to the super
+    # node that costs more than any real path, so every unit ships and a later
+    # search can still push an earlier node's units out to "unmet" when that
+    # lets more flow through overall. stats, if given, is a dict whose
+    # "searches", "settled" and "peak_heap" entries are added to / raised.
+    forward = sum(supplies.values()) <= sum(demands.values())
+    scarce, plenty = (supplies, demands) if forward else (demands, supplies)
+    scarce_nodes = sorted(scarce)
+    plenty_nodes = sorted(plenty)
+    node_a = {a: k for k, a in enumerate(scarce_nodes)}
+    node_b = {b: len(scarce_nodes) + k for k, b in enumerate(plenty_nodes)}
+    sink = len(scarce_nodes) + len(plenty_nodes)
+    size = sink + 1
+
+    adjacency = [[] for _ in range(size)]
+    to, cap, cost = [], [], []
+
+    def add_edge(u, v, capacity, weight):
+        adjacency[u].append(len(to))
+        to.append(v)
+        cap.append(capacity)
+        cost.append(weight)
+        adjacency[v].append(len(to))
+        to.append(u)
+        cap.append(0)
+        cost.append(-weight)
+
+    flow_edges = {}
+    for i, j, weight in edges:
+        if i in supplies and j in demands:
+            a, b = (i, j) if forward else (j, i)
+            flow_edges[(i, j)] = len(to)
+            add_edge(node_a[a], node_b[b], min(supplies[i], demands[j]), weight)
+    for b in plenty_nodes:
+        add_edge(node_b[b], sink, plenty[b], 0.0)
+    unmet = 1.0 + sum(weight for _, _, weight in edges)
+    for a in scarce_nodes:
+        add_edge(node_a[a], sink, scarce[a], unmet)
+
+    potential = [0.0] * size
+    dist = [0.0] * size
+    via = [-1] * size
+    # Search stamps: v is settled when done[v] == search and dist[v] is only
+    # current when seen[v] == search. Float rounding can leave reduced costs a
+    # hair below zero, so settled nodes are never relaxed again.
+    seen = [0] * size
+    done = [0] * size
+    search = 0
+    settled_total = 0
+    peak = 0
+    for a in scarce_nodes:
+        source = node_a[a]
+        excess = scarce[a]
+        while excess > 0:
+            search += 1
+            dist[source] = 0.0
+            seen[source] = search
+            open_set = [(0.0, source)]
+            settled = []
+            reached = INF
+            while open_set:
+                d, u = heapq.heappop(open_set)
+                if done[u] == search:
+                    continue
+                done[u] = search
+                settled.append(u)
+                if u == sink:
+                    reached = d
+                    break
+                pu = potential[u]
+                for e in adjacency[u]:
+                    if cap[e]:
+                        v = to[e]
+                        if done[v] == search:
+                            continue
+                        nd = d + cost[e] + pu - potential[v]
+                        if seen[v] != search or nd < dist[v]:
+                            dist[v] = nd
+                            seen[v] = search
+                            via[v] = e
+                            heapq.heappush(open_set, (nd, v))
+                if len(open_set) > peak:
+                    peak = len(open_set)
+            settled_total += len(settled)
+            if reached == INF:
+                break
+            for v in settled:
+                potential[v] += dist[v] - reached
+            amount = excess
+            v = sink
+            while v != source:
+                e = via[v]
+                amount = min(amount, cap[e])
+                v = to[e ^ 1]
+            v = sink
+            while v != source:
+                e = via[v]
+                cap[e] -= amount
+                cap[e ^ 1] += amount
+                v = to[e ^ 1]
+            excess -= amount
+
+    if stats is not None:
+        stats["searches"] = stats.get("searches", 0) + search
+        stats["settled"] = stats.get("settled", 0) + settled_total
+        stats["peak_heap"] = max(stats.get("peak_heap", 0), peak)
+    flows = {}
+    for pair, e in flow_edges.items():
+        if cap[e ^ 1]:
+            flows[pair] = cap[e ^ 1]
+    return flows
+
+def greedy(supplies, demands, edges):
+    # Cheapest edge first. Far from optimal on crowded maps, but linear in the
+    # number of edges after the sort; used for instances too big for min_cost_flow.
+    supplies = dict(supplies)
+    demands = dict(demands)
+    flows = {}
+    for weight, i, j in sorted((weight, i, j) for i, j, weight in edges):
+        amount = min(supplies.get(i, 0), demands.get(j, 0))
+        if amount > 0:
+            flows[(i, j)] = flows.get((i, j), 0) + amount
+            supplies[i] -= amount
+            demands[j] -= amount
+    return flows
+
+SOLVERS = {"flow": min_cost_flow, "greedy": greedy}
+
+def _index(points, extent):
+    # About two points per bucket.
+    index = SpatialIndex(max(1, int(extent / math.sqrt(max(1, len(points) / 2)))))
+    for key, (x, y) in points.items():
+        index.add(key, x, y)
+    return index
+
+def candidate_pairs(sender_points, receiver_points, k, max_distance=None):
+    # The k nearest senders of every receiver and the k nearest receivers of
+    # every sender, so each side keeps some outlets after pruning. With
+    # max_distance, only pairs at most that far apart (octile) are kept; a
+    # k of None keeps all of them.
+    pairs = set()
+    if not sender_points or not receiver_points:
+        return pairs
+    extent = max(max(max(p) for p in sender_points.values()), max(max(p) for p in receiver_points.values())) + 1
+    for points, others, flip in ((receiver_points, sender_points, True), (sender_points, receiver_points, False)):
+        index = _index(others, extent)
+        for key, (x, y) in points.items():
+            if max_distance is None:
+                found = index.nearest(x, y, k)
+            else:
+                found = index.within(x, y, max_distance)[:k]
+            for _, other in found:
+                pairs.add((other, key) if flip else (key, other))
+        if max_distance is not None and k is None:
+            # Radius queries are symmetric; one side finds every pair.
+            break
+    return pairs
+
+class Allocation:
+    # Solves the transportation problem for every resource type over senders
+    # and receivers (objects with name, x, y and resources / needs dicts).
+    #   costs       callable([(sender xy, receiver xy)]) -> [cost]; math.inf marks
+    #               an unreachable pair. Defaults to octile distance.
+    #   method      "flow", "greedy", "auto" (flow unless the instance has more
+    #               than greedy_above candidate edges) or a solver callable.
+    #   exact_below senders x receivers below which every pair is a candidate;
+    #               above it each side keeps only its candidates nearest neighbours.
+    #   max_distance  pairs further apart than this (octile, a lower bound on
+    #               the route) are never candidates and never priced.
+    # stats accumulates candidate edge and min_cost_flow search counts.
+    def __init__(self, costs=None, method="auto", candidates=16, exact_below=20000, greedy_above=2000000, max_distance=None):
+        if not callable(method) and method not in SOLVERS and method != "auto":
+            raise ValueError(f"Unknown allocation method: {method}")
+        self.costs = costs or octile_costs
+        self.method = method
+        self.candidates = candidates
+        self.exact_below = exact_below
+        self.greedy_above = greedy_above
+        self.max_distance = max_distance
+        self.stats = {"edges": 0, "searches": 0, "settled": 0, "peak_heap": 0}
+
+    def _solver(self, edges):
+        if callable(self.method):
+            return self.method
+        if self.method == "auto":
+            return greedy if len(edges) > self.greedy_above else min_cost_flow
+        return SOLVERS[self.method]
+
+    def _edges(self, senders, receivers, supplies, demands):
+        sender_points = {i: (senders[i].x, senders[i].y) for i in supplies}
+        receiver_points = {j: (receivers[j].x, receivers[j].y) for j in demands}
+        exact = len(supplies) * len(demands) <= self.exact_below
+        if exact and self.max_distance is None:
+            pairs = [(i, j) for i in supplies for j in demands]
+        else:
+            pairs = sorted(candidate_pairs(sender_points, receiver_points, None if exact else self.candidates, self.max_distance))
+        costs = self.costs([(sender_points[i], receiver_points[j]) for i, j in pairs])
+        return [(i, j, c) for (i, j), c in zip(pairs, costs) if c != INF]
+
+    def solve(self, senders, receivers, resource):
+        # {(sender index, receiver index): quantity} for one resource type.
+        supplies = {i: s.resources.get(resource, 0) for i, s in enumerate(senders) if s.resources.get(resource, 0) > 0}
+        demands = {j: r.needs.get(resource, 0) for j, r in enumerate(receivers) if r.needs.get(resource, 0) > 0}
+        flows = {}
+        # Pruned candidate sets can leave supply and demand that only far-apart
+        # pairs could meet; re-solve between the leftovers until nothing moves.
+        while supplies and demands:
+            edges = self._edges(senders, receivers, supplies, demands)
+            self.stats["edges"] += len(edges)
+            solver = self._solver(edges)
+            step = solver(supplies, demands, edges, self.stats) if solver is min_cost_flow else solver(supplies, demands, edges)
+            if not step:
+                break
+            for (i, j), amount in step.items():
+                flows[(i, j)] = flows.get((i, j), 0) + amount
+                supplies[i] -= amount
+                demands[j] -= amount
+            supplies = {i: q for i, q in supplies.items() if q > 0}
+            demands = {j: q for j, q in demands.items() if q > 0}
+        return flows
+
+    def allocate(self, senders, receivers):
+        # Returns [(sender, receiver, {resource: quantity})] and takes the
+        # matched quantities off sender.resources and receiver.needs; needs that
+        # could not be met stay in receiver.needs.
+        resources = sorted({resource for r in receivers for resource in r.needs})
+        matches = []
+        for resource in resources:
+            flows = self.solve(senders, receivers, resource)
+            for (i, j), amount in sorted(flows.items(), key=lambda item: (item[0][1], item[0][0])):
+                sender, receiver = senders[i], receivers[j]
+                matches.append((sender, receiver, {resource: amount}))
+                sender.resources[resource] -= amount
+                receiver.needs[resource] -= amount
+                if receiver.needs[resource] == 0:
+                    del receiver.needs[resource]
+        return matches
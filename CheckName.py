@@ -1,29 +1,8 @@
-import json
 import argparse
-
-def load_names(file_path):
-    with open(file_path, 'r') as file:
-        return json.load(file)
-
-def save_names(file_path, data):
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=4)
+from DataStore import get_store
 
 def check_and_update_name(file_path, name, entity_type, action):
-    data = load_names(file_path)
-
-    if action == "add":
-        if name in data[entity_type]:
-            return f"The name '{name}' has already been taken."
-        data[entity_type].append(name)
-    elif action == "remove":
-        if name in data[entity_type]:
-            data[entity_type].remove(name)
-        else:
-            return f"The name '{name}' does not exist."
-
-    save_names(file_path, data)
-    return f"The name '{name}' has been {action}ed successfully."
+    return get_store(names_file=file_path).check_and_update_name(name, entity_type, action)
 
 if __name__ == "__main__":
     names_file = 'names.json'
@@ -34,4 +13,4 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
     result = check_and_update_name(names_file, args.name, args.type, args.action)
-    print(result)
\ No newline at end of file
+    print(result)
@@ -0,0 +1,267 @@
+import math
+from array import array
+from Obstacles import REGION_BUCKET
+
+INF = math.inf
+# Travel minutes for one straight step on terrain of cost 1; a diagonal step
+# is sqrt(2) of that.
+MINUTES_PER_CELL = 1.0
+SQRT2 = math.sqrt(2)
+
+def parse_region(data):
+    # {"rects": [...], "cost": multiplier or None (closed), "start", "end"} ->
+    # the stored form (closed as INF, window bounds as epoch seconds or None).
+    # Raises ValueError with a message for the client.
+    cost = data.get('cost')
+    if cost is None:
+        cost = INF
+    elif isinstance(cost, bool) or not isinstance(cost, (int, float)) or not 0 < cost < INF:
+        raise ValueError("cost must be a positive number, or null for a closure")
+    start, end = data.get('start'), data.get('end')
+    for value in (start, end):
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError("start and end must be epoch seconds")
+    if start is not None and end is not None and end <= start:
+        raise ValueError("end must be after start")
+    rects = [tuple(int(v) for v in rect) for rect in data['rects']]
+    return {"rects": rects, "cost": float(cost), "start": start, "end": end}
+
+def region_json(region):
+    return {"rects": [list(rect) for rect in region['rects']], "cost": None if region['cost'] == INF else region['cost'],
+            "start": region['start'], "end": region['end']}
+
+def _timed(region):
+    return region['start'] is not None or region['end'] is not None
+
+def _active(region, t):
+    return (region['start'] is None or region['start'] <= t) and (region['end'] is None or t < region['end'])
+
+class CostField:
+    # Travel cost multipliers for the cells of an n x n map, from named regions
+    # of rectangles in named layers (e.g. "terrain", "congestion", "closures").
+    # A cell's cost is the product over layers of the largest cost among the
+    # layer's regions covering it (1 where none does), times the raster layers
+    # (n * n multipliers, e.g. from the map file). A region with a start/end
+    # window only counts during [start, end), and a closure (cost INF) makes its
+    # cells impassable while it counts.
+    #
+    # Costs without a window are kept rasterised in `base`, laid out like the
+    # GridPathFinding grid (index (x + 1) * (n + 2) + y + 1, border INF), and
+    # changing a region only recomputes the cells it covers. at(t) adds the
+    # windows open at t. base is None while every cell costs 1.
+    def __init__(self, n, regions=None, rasters=None):
+        self.n = n
+        self.width = n + 2
+        self.regions = {}
+        self.buckets = {}
+        self.base = None
+        self.raster = None
+        # min_cost() by the windows it counted, until a region changes.
+        self.min_costs = {}
+        for raster in (rasters or {}).values():
+            self._multiply_raster(raster)
+        self.raster_min = 1.0
+        if self.raster is not None:
+            self.base = self.raster[:]
+            self.raster_min = min(self.raster)
+        for layer, named in (regions or {}).items():
+            for name, region in named.items():
+                self.set_region(layer, name, parse_region(region))
+
+    def index(self, x, y):
+        return (x + 1) * self.width + y + 1
+
+    def _ones(self):
+        costs = array('f', [1.0]) * (self.width * self.width)
+        w = self.width
+        border = array('f', [INF]) * w
+        costs[0:w] = border
+        costs[w * (w - 1):] = border
+        for x in range(1, w - 1):
+            costs[x * w] = costs[x * w + w - 1] = INF
+        return costs
+
+    def _multiply_raster(self, raster):
+        n = self.n
+        if len(raster) != n * n:
+            raise ValueError(f"Raster cost layer must hold {n * n} values")
+        if self.raster is None:
+            self.raster = self._ones()
+        for x in range(n):
+            start = self.index(x, 0)
+            row = self.raster[start:start + n]
+            self.raster[start:start + n] = array('f', [a * b for a, b in zip(row, raster[x * n:(x + 1) * n])])
+
+    def _buckets(self, rect):
+        x0, y0, x1, y1 = rect
+        for bx in range(x0 // REGION_BUCKET, x1 // REGION_BUCKET + 1):
+            for by in range(y0 // REGION_BUCKET, y1 // REGION_BUCKET + 1):
+                yield (bx, by)
+
+    def _clip(self, rect):
+        n = self.n
+        x0, y0, x1, y1 = max(rect[0], 0), max(rect[1], 0), min(rect[2], n - 1), min(rect[3], n - 1)
+        return (x0, y0, x1, y1) if x0 <= x1 and y0 <= y1 else None
+
+    def set_region(self, layer, name, region):
+        # Replaces any region of the same layer and name.
+        old = self.remove_region(layer, name, refresh=False)
+        key = (layer, name)
+        self.regions[key] = region
+        self.min_costs.clear()
+        for rect in region['rects']:
+            for bucket in self._buckets(rect):
+                self.buckets.setdefault(bucket, {}).setdefault(key, []).append(rect)
+        changed = (old['rects'] if old and not _timed(old) else []) + (region['rects'] if not _timed(region) else [])
+        self._refresh(changed)
+
+    def remove_region(self, layer, name, refresh=True):
+        # Returns the removed region (None if there was none).
+        key = (layer, name)
+        region = self.regions.pop(key, None)
+        if region is None:
+            return None
+        self.min_costs.clear()
+        for rect in region['rects']:
+            for bucket in self._buckets(rect):
+                keys = self.buckets.get(bucket)
+                if keys is not None and keys.pop(key, None) is not None and not keys:
+                    del self.buckets[bucket]
+        if refresh and not _timed(region):
+            self._refresh(region['rects'])
+        return region
+
+    def _overlapping(self, rect, t=None):
+        # Regions with a rectangle intersecting rect that count at time t
+        # (including those without a window), or with t None only the ones
+        # without a window.
+        x0, y0, x1, y1 = rect
+        found = {}
+        for bucket in self._buckets(rect):
+            for key, rects in self.buckets.get(bucket, {}).items():
+                region = self.regions[key]
+                if key in found or not (_active(region, t) if t is not None else not _timed(region)):
+                    continue
+                if any(r[0] <= x1 and x0 <= r[2] and r[1] <= y1 and y0 <= r[3] for r in rects):
+                    found[key] = region
+        return found
+
+    def _combine(self, regions, x, y):
+        # Product over layers of the largest cost among regions covering (x, y).
+        by_layer = {}
+        for (layer, _), region in regions.items():
+            if region['cost'] > by_layer.get(layer, 0.0) and \
+                    any(r[0] <= x <= r[2] and r[1] <= y <= r[3] for r in region['rects']):
+                by_layer[layer] = region['cost']
+        cost = 1.0
+        for value in by_layer.values():
+            cost *= value
+        return cost
+
+    def _paint(self, costs, rects, t=None):
+        # Recomputes costs over rects. A rectangle that no region overlaps, or
+        # that lies inside one rectangle of the only region overlapping it, is
+        # filled a column at a time.
+        raster = self.raster
+        for rect in rects:
+            rect = self._clip(rect)
+            if rect is None:
+                continue
+            x0, y0, x1, y1 = rect
+            regions = self._overlapping(rect, t)
+            length = y1 - y0 + 1
+            uniform = not regions or len(regions) == 1 and any(
+                r[0] <= x0 and x1 <= r[2] and r[1] <= y0 and y1 <= r[3] for r in next(iter(regions.values()))['rects'])
+            if uniform:
+                value = next(iter(regions.values()))['cost'] if regions else 1.0
+                run = array('f', [value]) * length
+                for x in range(x0, x1 + 1):
+                    start = self.index(x, y0)
+                    costs[start:start + length] = run if raster is None else \
+                        array('f', [value * c for c in raster[start:start + length]])
+                continue
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    idx = self.index(x, y)
+                    costs[idx] = self._combine(regions, x, y) * (raster[idx] if raster is not None else 1.0)
+        return costs
+
+    def _refresh(self, rects):
+        if not rects:
+            return
+        if self.base is None:
+            if all(_timed(region) for region in self.regions.values()):
+                return
+            self.base = self._ones()
+        self._paint(self.base, rects)
+        if self.raster is None and not any(not _timed(region) for region in self.regions.values()):
+            # Back to uniform; searches can take the unweighted path again.
+            self.base = None
+
+    def windows(self, t):
+        # Keys of the windowed regions that count at time t.
+        return sorted(key for key, region in self.regions.items() if _timed(region) and _active(region, t))
+
+    def at(self, t):
+        # (costs, min_cost) at time t: a private copy of the cost array with the
+        # windows open at t applied, or (None, 1.0) when every cell costs 1.
+        # min_cost is a lower bound on every cell's cost, for the A* heuristic.
+        windows = self.windows(t)
+        if self.base is None and not windows:
+            return None, 1.0
+        costs = self.base[:] if self.base is not None else self._ones()
+        if windows:
+            self._paint(costs, [rect for key in windows for rect in self.regions[key]['rects']], t)
+        return costs, self.min_cost(t)
+
+    def min_cost(self, t=None):
+        # Product over layers of min(1, cheapest region cost in the layer),
+        # times the cheapest raster value: no cell can cost less. With t None
+        # every window counts.
+        key = tuple(self.windows(t)) if t is not None else None
+        cost = self.min_costs.get(key)
+        if cost is not None:
+            return cost
+        lowest = {}
+        for (layer, _), region in self.regions.items():
+            if not _timed(region) or t is None or _active(region, t):
+                lowest[layer] = min(lowest.get(layer, 1.0), region['cost'])
+        cost = self.raster_min
+        for value in lowest.values():
+            cost *= value
+        self.min_costs[key] = cost
+        return cost
+
+    def cell_cost(self, x, y, t):
+        # One cell's cost at time t, without building the array.
+        if not (0 <= x < self.n and 0 <= y < self.n):
+            return INF
+        cost = self._combine(self._overlapping((x, y, x, y), t), x, y)
+        return cost * self.raster[self.index(x, y)] if self.raster is not None else cost
+
+    def path_minutes(self, path, t):
+        # Travel time along path (a list of cells) starting at time t.
+        return path_minutes(path, lambda x, y: self.cell_cost(x, y, t))
+
+    def to_json(self):
+        regions = {}
+        for (layer, name), region in self.regions.items():
+            regions.setdefault(layer, {})[name] = region_json(region)
+        return regions
+
+def path_minutes(path, cost=None):
+    # Sum over the path's steps of step length x the mean cost of its two
+    # cells, in minutes; cost(x, y) defaults to 1 everywhere.
+    total = 0.0
+    previous = None
+    for x, y in path:
+        current = cost(x, y) if cost else 1.0
+        if previous is not None:
+            px, py, previous_cost = previous
+            total += (SQRT2 if px != x and py != y else 1.0) * (previous_cost + current) * 0.5
+        previous = (x, y, current)
+    return total * MINUTES_PER_CELL
+
+def array_cost(costs, width):
+    # cost(x, y) reading an array in the padded grid layout.
+    return lambda x, y: costs[(x + 1) * width + y + 1]
@@ -0,0 +1,481 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from CostLayers import CostField, parse_region, region_json
+from Journal import Journal, Compactor, atomic_write
+from Locking import FileLock, Versions, VersionConflict
+from MapFile import MapFile, write_map
+from Metrics import metrics
+from Obstacles import ObstacleLayer
+
+LOCATIONS_FILE = 'locations.json'
+RESOURCES_FILE = 'resources.json'
+NAMES_FILE = 'names.json'
+PEOPLE_FILE = 'people_data.json'
+JOURNAL_FILE = 'datastore.journal'
+SNAPSHOT_FILE = 'datastore.snapshot.json'
+
+def load_json(file_path, default):
+    if os.path.exists(file_path):
+        with metrics.timer('json_load_seconds', file=os.path.basename(file_path)), open(file_path, 'r') as file:
+            return json.load(file)
+    return default
+
+def save_json(file_path, data):
+    with metrics.timer('json_save_seconds', file=os.path.basename(file_path)), open(file_path, 'w') as file:
+        json.dump(data, file, indent=4)
+
+class DataStore:
+    # Mutations are applied in memory and appended to the journal; the JSON files
+    # are only rewritten by snapshot(), which the background compactor runs once
+    # the journal grows past snapshot_every records.
+    #
+    # There is one writer at a time: every write holds self.lock (threads) and
+    # self.file_lock (worker processes), since each appends to the one journal in
+    # sequence order. Both are held only while applying and appending; the fsync
+    # happens after both are released so concurrent writers share it. Before each write, records appended by other
+    # processes are replayed, so several workers can share one data directory.
+    # Every sender/receiver (and the obstacle set) carries a version that is
+    # bumped by each journaled change to it.
+    def __init__(self, locations_file=LOCATIONS_FILE, resources_file=RESOURCES_FILE, names_file=NAMES_FILE,
+                 fsync_batch=1, fsync_interval=None, snapshot_every=1000, background=True):
+        self.locations_file = locations_file
+        self.resources_file = resources_file
+        self.names_file = names_file
+        # Binary copy of the obstacle grid, rewritten with every snapshot.
+        self.map_file = os.path.splitext(locations_file)[0] + '.map'
+        data_dir = os.path.dirname(locations_file)
+        self.snapshot_file = os.path.join(data_dir, SNAPSHOT_FILE)
+        self.lock = threading.RLock()
+        self.file_lock = FileLock(os.path.join(data_dir, JOURNAL_FILE + '.lock'))
+        self.pending = []
+        self.write_depth = 0
+        self.listeners = []
+
+        with self.file_lock:
+            self._load_snapshot()
+            self.journal = Journal(os.path.join(data_dir, JOURNAL_FILE), fsync_batch, fsync_interval, self.applied_seq)
+            self._catch_up()
+
+        self.compactor = Compactor(self, snapshot_every) if background else None
+
+    def _load_snapshot(self):
+        self.locations = load_json(self.locations_file, {"n": 500, "obstacles": [], "senders": [], "receivers": []})
+        self.resources = load_json(self.resources_file, {"senders": [], "receivers": []})
+        self.names = load_json(self.names_file, {"senders": [], "receivers": []})
+        meta = load_json(self.snapshot_file, {"seq": 0, "versions": {}})
+        self.applied_seq = meta['seq']
+        self.versions = Versions(meta.get('versions'))
+        self._build_indexes()
+
+    def _build_indexes(self):
+        # name -> entry over the JSON lists (the entries themselves, not copies),
+        # so lookups and upserts by name stay O(1) as the lists grow.
+        self.name_set = {t: set(self.names[t]) for t in ('senders', 'receivers')}
+        self.location_index = {t: {e['name']: e for e in self.locations[t]} for t in ('senders', 'receivers')}
+        self.resource_index = {t: {e['name']: e for e in self.resources[t]} for t in ('senders', 'receivers')}
+        # Obstacles live only in the layer; snapshot() writes them back out.
+        self.obstacles = ObstacleLayer(self.locations.pop('obstacles', []), self.locations.pop('obstacle_regions', {}))
+        # Likewise the cost regions, over the map file's raster cost layers.
+        self.costs = self._load_costs(self.locations.pop('cost_regions', {}))
+
+    def _load_costs(self, regions):
+        map_file = self._open_map()
+        try:
+            rasters = {}
+            if map_file and map_file.n == self.locations['n']:
+                rasters = {name: map_file.layer(name) for name in map_file.cost_layers()}
+            return CostField(self.locations['n'], regions, rasters)
+        finally:
+            if map_file:
+                map_file.close()
+
+    def _catch_up(self):
+        records, restarted = self.journal.read_new()
+        if restarted and load_json(self.snapshot_file, {"seq": 0})['seq'] > self.applied_seq:
+            # Another process compacted past records we have not seen yet.
+            self._load_snapshot()
+            self._notify('reload', ())
+        for record in records:
+            if record['seq'] > self.applied_seq:
+                self._apply(record['op'], record['args'])
+                self.applied_seq = record['seq']
+
+    def refresh(self):
+        if self.journal.changed():
+            with self.lock, self.file_lock:
+                self._catch_up()
+
+    @contextmanager
+    def _writing(self):
+        waited = time.perf_counter()
+        with self.lock:
+            if self.write_depth:
+                self.write_depth += 1
+                try:
+                    yield
+                finally:
+                    self.write_depth -= 1
+                return
+            seq = None
+            with self.file_lock:
+                started = time.perf_counter()
+                metrics.observe('store_lock_wait_seconds', started - waited)
+                self._catch_up()
+                self.write_depth = 1
+                try:
+                    yield
+                finally:
+                    self.write_depth = 0
+                    if self.pending:
+                        metrics.inc('store_journal_records_total', len(self.pending))
+                        seq = self.applied_seq = self.journal.append_many(self.pending)
+                        self.pending = []
+                    metrics.observe('store_write_seconds', time.perf_counter() - started)
+        if seq:
+            with metrics.timer('store_fsync_seconds'):
+                self.journal.commit(seq)
+
+    def _record(self, op, *args):
+        self._apply(op, args)
+        self.pending.append((op, args))
+
+    def _apply(self, op, args):
+        metrics.inc('store_ops_total', op=op)
+        getattr(self, '_apply_' + op)(*args)
+        self.versions.bump(entity_key(op, args))
+        self._notify(op, args)
+
+    def subscribe(self, listener):
+        # listener(op, args) is called under the store lock after every applied
+        # journal operation, including ones replayed from other processes, and
+        # with ('reload', ()) when the state was reloaded from a snapshot.
+        with self.lock:
+            self.listeners.append(listener)
+
+    def _notify(self, op, args):
+        for listener in self.listeners:
+            listener(op, args)
+
+    def snapshot(self):
+        with metrics.timer('store_snapshot_seconds'), self.lock, self.file_lock:
+            self._catch_up()
+            seq = self.applied_seq
+            cells, regions = self.obstacles.to_json()
+            locations = {'n': self.locations['n'], 'obstacles': cells, 'obstacle_regions': regions,
+                         'cost_regions': self.costs.to_json(), **self.locations}
+            atomic_write(self.locations_file, json.dumps(locations, indent=4))
+            self._write_map()
+            atomic_write(self.resources_file, json.dumps(self.resources, indent=4))
+            atomic_write(self.names_file, json.dumps(self.names, indent=4))
+            atomic_write(self.snapshot_file, json.dumps({"seq": seq, "versions": self.versions.versions}))
+            self.journal.truncate(seq)
+
+    def _write_map(self):
+        # Cost layers already in the map are carried over; only the obstacles
+        # are the store's.
+        n = self.locations['n']
+        previous = self._open_map()
+        try:
+            layers = {name: previous.layer(name) for name in previous.cost_layers()} if previous and previous.n == n else {}
+            write_map(self.map_file, n, self.obstacles, layers, self.versions.get('obstacles/'), self.locations_file)
+        finally:
+            if previous:
+                previous.close()
+
+    def _open_map(self):
+        try:
+            return MapFile(self.map_file)
+        except (OSError, ValueError):
+            return None
+
+    def current_map(self):
+        # The map written by the last snapshot as an open MapFile, if no
+        # obstacle has changed since; otherwise None and callers use
+        # self.obstacles. The caller closes it.
+        with self.lock:
+            map_file = self._open_map()
+            if map_file and (map_file.n != self.locations['n']
+                             or not map_file.is_current(self.versions.get('obstacles/'), self.locations_file)):
+                map_file.close()
+                map_file = None
+            return map_file
+
+    def close(self):
+        if self.compactor:
+            self.compactor.stop()
+        self.journal.close()
+
+    # Journal operations. Each one is idempotent so that replaying a journal tail
+    # over a snapshot that already contains part of it is harmless.
+
+    def _apply_add_name(self, entity_type, name):
+        if name not in self.name_set[entity_type]:
+            self.names[entity_type].append(name)
+            self.name_set[entity_type].add(name)
+
+    def _apply_remove_name(self, entity_type, name):
+        if name in self.name_set[entity_type]:
+            self.names[entity_type].remove(name)
+            self.name_set[entity_type].discard(name)
+
+    def _set_resources(self, entity_type, field, name, value):
+        entry = self.resource_index[entity_type].get(name)
+        if entry is not None:
+            entry[field] = value
+            return
+        entry = {'name': name, field: value}
+        self.resources[entity_type].append(entry)
+        self.resource_index[entity_type][name] = entry
+
+    def _apply_set_sender_resources(self, name, resources):
+        self._set_resources('senders', 'resources', name, resources)
+
+    def _apply_set_receiver_needs(self, name, needs):
+        self._set_resources('receivers', 'needs', name, needs)
+
+    def _apply_add_location(self, entity_type, entity):
+        entry = self.location_index[entity_type].get(entity['name'])
+        if entry is not None:
+            entry['x'] = entity['x']
+            entry['y'] = entity['y']
+            return
+        entry = {'name': entity['name'], 'x': entity['x'], 'y': entity['y']}
+        self.locations[entity_type].append(entry)
+        self.location_index[entity_type][entry['name']] = entry
+
+    def _apply_remove_location(self, entity_type, name):
+        if self.location_index[entity_type].pop(name, None) is not None:
+            self.locations[entity_type] = [e for e in self.locations[entity_type] if e['name'] != name]
+        if self.resource_index[entity_type].pop(name, None) is not None:
+            self.resources[entity_type] = [e for e in self.resources[entity_type] if e['name'] != name]
+
+    def _apply_move_location(self, entity_type, name, x, y):
+        entry = self.location_index[entity_type].get(name)
+        if entry is not None:
+            entry['x'] = x
+            entry['y'] = y
+
+    def _apply_add_obstacle(self, obstacle):
+        self.obstacles.add(obstacle)
+
+    def _apply_remove_obstacle(self, obstacle):
+        self.obstacles.discard(obstacle)
+
+    def _apply_add_obstacle_region(self, name, rects):
+        self.obstacles.add_region(name, rects)
+
+    def _apply_remove_obstacle_region(self, name, rects):
+        # rects are the removed region's, recorded for listeners.
+        self.obstacles.remove_region(name)
+
+    def _apply_set_cost_region(self, layer, name, region):
+        self.costs.set_region(layer, name, parse_region(region))
+
+    def _apply_remove_cost_region(self, layer, name):
+        self.costs.remove_region(layer, name)
+
+    # Names
+
+    def check_and_update_name(self, name, entity_type, action):
+        with self._writing():
+            if action == "add":
+                if name in self.name_set[entity_type]:
+                    return f"The name '{name}' has already been taken."
+                self._record('add_name', entity_type, name)
+            elif action == "remove":
+                if name in self.name_set[entity_type]:
+                    self._record('remove_name', entity_type, name)
+                else:
+                    return f"The name '{name}' does not exist."
+        return f"The name '{name}' has been {action}ed successfully."
+
+    # Resources
+
+    def update_resources(self, sender_resources, receiver_needs):
+        errors = []
+        with self._writing():
+            known_senders = self.resource_index['senders']
+            known_receivers = self.resource_index['receivers']
+
+            for sender in sender_resources:
+                if sender['name'] in known_senders or sender['name'] in self.name_set['senders']:
+                    self._record('set_sender_resources', sender['name'], sender['resources'])
+                else:
+                    errors.append(f"Sender {sender['name']} does not exist in names database.")
+
+            for receiver in receiver_needs:
+                if receiver['name'] in known_receivers or receiver['name'] in self.name_set['receivers']:
+                    self._record('set_receiver_needs', receiver['name'], receiver['needs'])
+                else:
+                    errors.append(f"Receiver {receiver['name']} does not exist in names database.")
+        return errors
+
+    def set_resource(self, entity_type, name, resource, amount, expected_version=None):
+        # Set one resource (senders) or need (receivers) without touching the
+        # others; expected_version makes it a compare-and-set on the entity.
+        with self._writing():
+            return self._set_resource(entity_type, name, resource, amount, expected_version)
+
+    def _set_resource(self, entity_type, name, resource, amount, expected_version=None):
+        key = f"{entity_type}/{name}"
+        if name not in self.name_set[entity_type]:
+            raise KeyError(name)
+        self.versions.check(key, expected_version)
+        field = 'resources' if entity_type == 'senders' else 'needs'
+        entry = self.resource_index[entity_type].get(name)
+        current = entry[field] if entry else {}
+        op = 'set_sender_resources' if entity_type == 'senders' else 'set_receiver_needs'
+        self._record(op, name, {**current, resource: amount})
+        return self.versions.get(key)
+
+    def set_resources(self, items):
+        # Bulk set_resource: items are (entity_type, name, resource, amount,
+        # expected_version) tuples, applied as one journal append and one fsync.
+        # Returns one result per item, the new version or the exception that
+        # item raised; a failing item does not stop the others.
+        results = []
+        with self._writing():
+            for entity_type, name, resource, amount, expected_version in items:
+                try:
+                    results.append(self._set_resource(entity_type, name, resource, amount, expected_version))
+                except (KeyError, VersionConflict) as e:
+                    results.append(e)
+        return results
+
+    def consume_resources(self, items):
+        # Subtract allocated quantities: items are (entity_type, name, resource,
+        # quantity) tuples. Amounts are read at write time and floored at zero,
+        # so changes made while a plan was running are kept. Unknown entities
+        # are skipped.
+        with self._writing():
+            totals = {}
+            for entity_type, name, resource, quantity in items:
+                totals.setdefault((entity_type, name), {})
+                totals[(entity_type, name)][resource] = totals[(entity_type, name)].get(resource, 0) + quantity
+            for (entity_type, name), used in totals.items():
+                entry = self.resource_index[entity_type].get(name)
+                if entry is None:
+                    continue
+                field = 'resources' if entity_type == 'senders' else 'needs'
+                remaining = {resource: max(0, amount - used.get(resource, 0)) for resource, amount in entry[field].items()}
+                op = 'set_sender_resources' if entity_type == 'senders' else 'set_receiver_needs'
+                self._record(op, name, remaining)
+
+    # Locations
+
+    def update_locations(self, added_senders, removed_senders, added_receivers, removed_receivers, added_obstacles, removed_obstacles, updated_senders, updated_receivers):
+        # Every added name is checked before anything is recorded, so a taken
+        # name rejects the whole update.
+        with self._writing():
+            for entity_type, added in (('senders', added_senders), ('receivers', added_receivers)):
+                names = set()
+                for entity in added:
+                    if entity['name'] in self.name_set[entity_type] or entity['name'] in names:
+                        return f"The name '{entity['name']}' has already been taken."
+                    names.add(entity['name'])
+            for entity_type, added, removed in (('senders', added_senders, removed_senders), ('receivers', added_receivers, removed_receivers)):
+                for entity in added:
+                    self._record('add_name', entity_type, entity['name'])
+                    self._record('add_location', entity_type, entity)
+                for entity in removed:
+                    self._record('remove_name', entity_type, entity['name'])
+                    self._record('remove_location', entity_type, entity['name'])
+
+            for obstacle in added_obstacles:
+                self._record('add_obstacle', obstacle)
+            for obstacle in removed_obstacles:
+                self._record('remove_obstacle', obstacle)
+
+            for updated_sender in updated_senders:
+                self._record('move_location', 'senders', updated_sender['name'], updated_sender['x'], updated_sender['y'])
+            for updated_receiver in updated_receivers:
+                self._record('move_location', 'receivers', updated_receiver['name'], updated_receiver['x'], updated_receiver['y'])
+        return None
+
+    def add_obstacle_regions(self, regions):
+        # regions is {name: [[x0, y0, x1, y1], ...]} (see Obstacles.polygon_rects);
+        # a region replaces any existing one of the same name. One journal append.
+        with self._writing():
+            for name, rects in regions.items():
+                if name in self.obstacles.regions:
+                    self._record('remove_obstacle_region', name, self.obstacles.regions[name])
+                self._record('add_obstacle_region', name, [list(rect) for rect in rects])
+
+    def remove_obstacle_regions(self, names):
+        # Returns the names that matched no region.
+        missing = []
+        with self._writing():
+            for name in names:
+                if name in self.obstacles.regions:
+                    self._record('remove_obstacle_region', name, self.obstacles.regions[name])
+                else:
+                    missing.append(name)
+        return missing
+
+    def set_cost_regions(self, items):
+        # items are (layer, name, region) with region as CostLayers.parse_region
+        # takes it; a region replaces any of the same layer and name. Only the
+        # cells the changed regions cover are recomputed. One journal append.
+        with self._writing():
+            for layer, name, region in items:
+                self._record('set_cost_region', layer, name, region_json(parse_region(region)))
+
+    def remove_cost_regions(self, keys):
+        # keys are (layer, name) pairs; returns the ones that matched no region.
+        missing = []
+        with self._writing():
+            for layer, name in keys:
+                if (layer, name) in self.costs.regions:
+                    self._record('remove_cost_region', layer, name)
+                else:
+                    missing.append([layer, name])
+        return missing
+
+    def add_users(self, users):
+        # Bulk sign-up: users are (entity_type, {"name", "x", "y"}) pairs, applied
+        # as one journal append and one fsync. Returns one error message (or
+        # None) per user; a taken name does not stop the others.
+        results = []
+        with self._writing():
+            for entity_type, entity in users:
+                if entity['name'] in self.name_set[entity_type]:
+                    results.append(f"The name '{entity['name']}' has already been taken.")
+                    continue
+                self._record('add_name', entity_type, entity['name'])
+                self._record('add_location', entity_type, entity)
+                results.append(None)
+        return results
+
+    # Views
+
+    def location(self, entity_type, name):
+        self.refresh()
+        with self.lock:
+            e = self.location_index[entity_type].get(name)
+            return (e['x'], e['y']) if e else None
+
+def entity_key(op, args):
+    if op in ('add_obstacle', 'remove_obstacle', 'add_obstacle_region', 'remove_obstacle_region'):
+        return 'obstacles/'
+    if op in ('set_cost_region', 'remove_cost_region'):
+        return 'costs/'
+    if op == 'set_sender_resources':
+        return f"senders/{args[0]}"
+    if op == 'set_receiver_needs':
+        return f"receivers/{args[0]}"
+    if op == 'add_location':
+        return f"{args[0]}/{args[1]['name']}"
+    return f"{args[0]}/{args[1]}"
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(locations_file=LOCATIONS_FILE, resources_file=RESOURCES_FILE, names_file=NAMES_FILE, **options):
+    key = (os.path.abspath(locations_file), os.path.abspath(resources_file), os.path.abspath(names_file))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = DataStore(locations_file, resources_file, names_file, **options)
+        return _stores[key]
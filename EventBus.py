@@ -0,0 +1,62 @@
+import json
+import threading
+
+class EventBus:
+    # In-process fan-out for server-sent events. Every event is serialised once
+    # into a ring buffer holding the last `capacity` events; a subscriber only
+    # keeps the id of the last event it has seen and reads anything newer from
+    # the shared buffer, so publishing costs the same for one subscriber or a
+    # thousand. Ids are consecutive, so event i lives in slot i % capacity.
+    def __init__(self, capacity=4096):
+        self.condition = threading.Condition()
+        self.capacity = capacity
+        self.ring = [None] * capacity
+        self.last_id = 0
+
+    def publish(self, topic, data, users=None):
+        # users limits delivery to subscribers streaming for one of those users.
+        with self.condition:
+            self.last_id += 1
+            frame = f"id: {self.last_id}\nevent: {topic}\ndata: {json.dumps(data)}\n\n"
+            self.ring[self.last_id % self.capacity] = (self.last_id, topic, users, frame)
+            self.condition.notify_all()
+            return self.last_id
+
+    def read(self, after, timeout=None):
+        # Events with id > after, waiting up to timeout for one to arrive.
+        # Returns (events, last id); events is None when some of them have
+        # already been overwritten (or after is from before a restart) and the
+        # subscriber has to refetch full state.
+        with self.condition:
+            if self.last_id == after:
+                self.condition.wait(timeout)
+            last_id = self.last_id
+            if after > last_id or last_id - after > self.capacity:
+                return None, last_id
+            return [self.ring[i % self.capacity] for i in range(after + 1, last_id + 1)], last_id
+
+    def stream(self, topics, user=None, after=None, idle=1.0, keepalive=15.0, on_idle=None):
+        # SSE frames for the given topics. Starts after the given event id (a
+        # reconnecting client's Last-Event-ID) or at the current end of the
+        # buffer. on_idle runs whenever nothing arrived for `idle` seconds.
+        if after is None:
+            after = self.last_id
+        yield "retry: 3000\n\n"
+        waited = 0.0
+        while True:
+            events, last_id = self.read(after, idle)
+            if events is None:
+                yield f"id: {last_id}\nevent: reset\ndata: {{}}\n\n"
+            elif not events:
+                if on_idle:
+                    on_idle()
+                waited += idle
+                if waited >= keepalive:
+                    waited = 0.0
+                    yield ": keepalive\n\n"
+            else:
+                waited = 0.0
+                for _, topic, users, frame in events:
+                    if topic in topics and (users is None or user in users):
+                        yield frame
+            after = last_id
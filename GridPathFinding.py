@@ -0,0 +1,335 @@
+import heapq
+import math
+from array import array
+
+SQRT2 = math.sqrt(2)
+F_SCALE = 1e9
+
+class GridPathFinding:
+    # Same 8-connected grid and a_star(start, goal) API as PathFinding, but the
+    # map is a flat bytearray (1 = blocked) with a one-cell blocked border, so
+    # neighbours are index offsets and need no bounds checks. Per-search state
+    # lives in flat arrays that are "cleared" by bumping a search id instead of
+    # being reallocated.
+    #
+    # costs (see set_costs) weights the moves by per-cell cost multipliers.
+    def __init__(self, n, obstacles, costs=None, min_cost=1.0):
+        self.n = n
+        self.width = n + 2
+        size = self.width * self.width
+        self.grid = bytearray(size)
+        self._block_border()
+        if hasattr(obstacles, 'paint'):
+            # An ObstacleLayer fills its rectangles a row at a time.
+            obstacles.paint(self)
+        else:
+            for obstacle in obstacles:
+                x, y = obstacle[0], obstacle[1]
+                if 0 <= x < n and 0 <= y < n:
+                    self.grid[self.index(x, y)] = 1
+        w = self.width
+        self.moves = [(-w - 1, SQRT2), (-w, 1.0), (-w + 1, SQRT2), (-1, 1.0),
+                      (1, 1.0), (w - 1, SQRT2), (w, 1.0), (w + 1, SQRT2)]
+        self.costs = None
+        self.min_cost = 1.0
+        self.set_costs(costs, min_cost)
+        self.g_score = None
+        self.parent = None
+        self.stamp = None
+        self.search_id = 0
+        self.expanded = 0
+        self.peak_open = 0
+        # Totals since the last take_stats(), for instrumentation.
+        self.searches = 0
+        self.total_expanded = 0
+        self.max_open = 0
+
+    def _block_border(self):
+        w = self.width
+        self.grid[0:w] = b'\x01' * w
+        self.grid[w * (w - 1):] = b'\x01' * w
+        self.grid[0::w] = b'\x01' * w
+        self.grid[w - 1::w] = b'\x01' * w
+
+    def index(self, x, y):
+        return (x + 1) * self.width + y + 1
+
+    def cell(self, idx):
+        x, y = divmod(idx, self.width)
+        return (x - 1, y - 1)
+
+    def passable(self, node):
+        x, y = node
+        return 0 <= x < self.n and 0 <= y < self.n and not self.grid[self.index(x, y)]
+
+    def set_blocked(self, node, blocked=True):
+        self.grid[self.index(node[0], node[1])] = 1 if blocked else 0
+
+    def set_costs(self, costs, min_cost=1.0):
+        # costs is None (every move costs its length) or an array of cell cost
+        # multipliers laid out like the grid, e.g. from CostLayers.CostField.at().
+        # A move then costs its length times the mean of its two cells' costs,
+        # and cells costing inf are closed. min_cost must not exceed any cell's
+        # cost; it scales the heuristic so that it stays admissible.
+        if costs is not None and len(costs) != len(self.grid):
+            raise ValueError(f"Cost array must hold {len(self.grid)} values")
+        self.costs = costs
+        self.min_cost = min_cost
+
+    def _new_search(self):
+        if self.stamp is None:
+            size = len(self.grid)
+            self.g_score = array('d', [0.0]) * size
+            self.parent = array('i', [-1]) * size
+            self.stamp = array('I', [0]) * size
+        self.search_id += 1
+        if self.search_id > 0xFFFFFFFF:
+            self.stamp = array('I', [0]) * len(self.grid)
+            self.search_id = 1
+        self.expanded = 0
+        return self.search_id
+
+    def _finish(self, expanded, peak):
+        self.expanded = expanded
+        self.peak_open = peak
+        self.add_stats(1, expanded, peak)
+
+    def add_stats(self, searches, expanded, peak):
+        self.searches += searches
+        self.total_expanded += expanded
+        if peak > self.max_open:
+            self.max_open = peak
+
+    def take_stats(self):
+        # (searches, nodes expanded, largest open set) since the last call.
+        stats = (self.searches, self.total_expanded, self.max_open)
+        self.searches = self.total_expanded = self.max_open = 0
+        return stats
+
+    def _path(self, idx):
+        path = []
+        parent = self.parent
+        while idx != -1:
+            path.append(self.cell(idx))
+            idx = parent[idx]
+        return path[::-1]
+
+    def a_star(self, start, goal):
+        if not self.passable(start) or not self.passable(goal):
+            return []
+        if self.costs is not None:
+            return self._weighted_a_star(start, goal)
+        source = self.index(*start)
+        target = self.index(*goal)
+        sid = self._new_search()
+        grid, g_score, parent, stamp, moves, w = self.grid, self.g_score, self.parent, self.stamp, self.moves, self.width
+        gx, gy = divmod(target, w)
+        diagonal = SQRT2 - 2
+
+        stamp[source] = sid
+        g_score[source] = 0.0
+        parent[source] = -1
+        open_set = [(0, 0.0, source)]
+        expanded = 0
+        peak = 1
+
+        while open_set:
+            _, neg_g, current = heapq.heappop(open_set)
+            current_g = -neg_g
+            if current_g > g_score[current]:
+                continue
+            if current == target:
+                self._finish(expanded, peak)
+                return self._path(current)
+            expanded += 1
+
+            for offset, weight in moves:
+                neighbor = current + offset
+                if grid[neighbor]:
+                    continue
+                tentative_g_score = current_g + weight
+                if stamp[neighbor] != sid or tentative_g_score < g_score[neighbor]:
+                    stamp[neighbor] = sid
+                    g_score[neighbor] = tentative_g_score
+                    parent[neighbor] = current
+                    nx, ny = divmod(neighbor, w)
+                    dx = abs(nx - gx)
+                    dy = abs(ny - gy)
+                    h = dx + dy + diagonal * (dx if dx < dy else dy)
+                    # f is quantised so that rounding noise in sums of sqrt(2) does not
+                    # break ties; prefer deeper nodes among equal f.
+                    heapq.heappush(open_set, (int((tentative_g_score + h) * F_SCALE), -tentative_g_score, neighbor))
+            if len(open_set) > peak:
+                peak = len(open_set)
+
+        self._finish(expanded, peak)
+        return []
+
+    def _weighted_a_star(self, start, goal):
+        # a_star over the cost multipliers. The octile heuristic is scaled by
+        # min_cost, a lower bound on every move's cost per unit length.
+        source = self.index(*start)
+        target = self.index(*goal)
+        costs = self.costs
+        if costs[source] == math.inf or costs[target] == math.inf:
+            return []
+        sid = self._new_search()
+        grid, g_score, parent, stamp, moves, w = self.grid, self.g_score, self.parent, self.stamp, self.moves, self.width
+        gx, gy = divmod(target, w)
+        diagonal = SQRT2 - 2
+        scale = self.min_cost
+        inf = math.inf
+
+        stamp[source] = sid
+        g_score[source] = 0.0
+        parent[source] = -1
+        open_set = [(0, 0.0, source)]
+        expanded = 0
+        peak = 1
+
+        while open_set:
+            _, neg_g, current = heapq.heappop(open_set)
+            current_g = -neg_g
+            if current_g > g_score[current]:
+                continue
+            if current == target:
+                self._finish(expanded, peak)
+                return self._path(current)
+            expanded += 1
+            current_cost = costs[current] * 0.5
+
+            for offset, weight in moves:
+                neighbor = current + offset
+                if grid[neighbor]:
+                    continue
+                cost = costs[neighbor]
+                if cost == inf:
+                    continue
+                tentative_g_score = current_g + weight * (current_cost + cost * 0.5)
+                if stamp[neighbor] != sid or tentative_g_score < g_score[neighbor]:
+                    stamp[neighbor] = sid
+                    g_score[neighbor] = tentative_g_score
+                    parent[neighbor] = current
+                    nx, ny = divmod(neighbor, w)
+                    dx = abs(nx - gx)
+                    dy = abs(ny - gy)
+                    h = (dx + dy + diagonal * (dx if dx < dy else dy)) * scale
+                    heapq.heappush(open_set, (int((tentative_g_score + h) * F_SCALE), -tentative_g_score, neighbor))
+            if len(open_set) > peak:
+                peak = len(open_set)
+
+        self._finish(expanded, peak)
+        return []
+
+    def multi_target(self, start, goals, lengths=False):
+        # One Dijkstra sweep from start that stops once every reachable goal is
+        # settled. Returns {goal: path}; unreachable goals map to []. With
+        # lengths, returns {goal: path cost} instead (math.inf if unreachable)
+        # and no path is built.
+        paths = {goal: math.inf if lengths else [] for goal in goals}
+        remaining = {self.index(*goal): goal for goal in goals if self.passable(goal)}
+        if not self.passable(start) or not remaining:
+            return paths
+        if self.costs is not None:
+            return self._weighted_multi_target(start, paths, remaining, lengths)
+        source = self.index(*start)
+        sid = self._new_search()
+        grid, g_score, parent, stamp, moves = self.grid, self.g_score, self.parent, self.stamp, self.moves
+
+        stamp[source] = sid
+        g_score[source] = 0.0
+        parent[source] = -1
+        open_set = [(0.0, source)]
+        expanded = 0
+        peak = 1
+
+        while open_set and remaining:
+            current_g, current = heapq.heappop(open_set)
+            if current_g > g_score[current]:
+                continue
+            goal = remaining.pop(current, None)
+            if goal is not None:
+                paths[goal] = current_g if lengths else self._path(current)
+            expanded += 1
+
+            for offset, weight in moves:
+                neighbor = current + offset
+                if grid[neighbor]:
+                    continue
+                tentative_g_score = current_g + weight
+                if stamp[neighbor] != sid or tentative_g_score < g_score[neighbor]:
+                    stamp[neighbor] = sid
+                    g_score[neighbor] = tentative_g_score
+                    parent[neighbor] = current
+                    heapq.heappush(open_set, (tentative_g_score, neighbor))
+            if len(open_set) > peak:
+                peak = len(open_set)
+
+        self._finish(expanded, peak)
+        return paths
+
+    def _weighted_multi_target(self, start, paths, remaining, lengths):
+        source = self.index(*start)
+        costs = self.costs
+        if costs[source] == math.inf:
+            return paths
+        sid = self._new_search()
+        grid, g_score, parent, stamp, moves = self.grid, self.g_score, self.parent, self.stamp, self.moves
+        inf = math.inf
+
+        stamp[source] = sid
+        g_score[source] = 0.0
+        parent[source] = -1
+        open_set = [(0.0, source)]
+        expanded = 0
+        peak = 1
+
+        while open_set and remaining:
+            current_g, current = heapq.heappop(open_set)
+            if current_g > g_score[current]:
+                continue
+            goal = remaining.pop(current, None)
+            if goal is not None:
+                paths[goal] = current_g if lengths else self._path(current)
+            expanded += 1
+            current_cost = costs[current] * 0.5
+
+            for offset, weight in moves:
+                neighbor = current + offset
+                if grid[neighbor]:
+                    continue
+                cost = costs[neighbor]
+                if cost == inf:
+                    continue
+                tentative_g_score = current_g + weight * (current_cost + cost * 0.5)
+                if stamp[neighbor] != sid or tentative_g_score < g_score[neighbor]:
+                    stamp[neighbor] = sid
+                    g_score[neighbor] = tentative_g_score
+                    parent[neighbor] = current
+                    heapq.heappush(open_set, (tentative_g_score, neighbor))
+            if len(open_set) > peak:
+                peak = len(open_set)
+
+        self._finish(expanded, peak)
+        return paths
+
+    def multi_target_many(self, searches, progress=None, lengths=False):
+        # multi_target for each (start, goals) in searches, in order.
+        # progress(done, total) is called after each search.
+        results = []
+        for start, goals in searches:
+            results.append(self.multi_target(start, goals, lengths))
+            if progress:
+                progress(len(results), len(searches))
+        return results
+
+def path_cost(path, costs=None, width=None):
+    # Path length, or with costs (an array in the grid layout of a map
+    # width - 2 cells across) the weighted cost the searches minimise.
+    cost = 0.0
+    for (x1, y1), (x2, y2) in zip(path, path[1:]):
+        step = SQRT2 if x1 != x2 and y1 != y2 else 1.0
+        if costs is not None:
+            step *= (costs[(x1 + 1) * width + y1 + 1] + costs[(x2 + 1) * width + y2 + 1]) * 0.5
+        cost += step
+    return cost
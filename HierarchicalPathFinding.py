@@ -0,0 +1,365 @@
+import heapq
+import math
+import threading
+from array import array
+from GridPathFinding import GridPathFinding, SQRT2
+
+INF = math.inf
+
+def octile(ax, ay, bx, by):
+    dx = abs(ax - bx)
+    dy = abs(ay - by)
+    return dx + dy + (SQRT2 - 2) * min(dx, dy)
+
+class HierarchicalPathFinding:
+    # HPA* over a GridPathFinding grid. The map is cut into cluster_size squares;
+    # free runs along each shared cluster border get one or two portal cell pairs
+    # (inter-cluster edges). Distances between the portals of a cluster
+    # (intra-cluster edges) are computed the first time a search touches the
+    # cluster, and are plain octile distances for clusters with no obstacles.
+    # Long queries search the portal graph and only refine the chosen segments
+    # with searches bounded to one cluster. Obstacle edits rebuild the borders of
+    # the touched clusters and drop the intra-cluster edges of them and their
+    # neighbours.
+    # weight > 1 inflates the heuristic of the portal-graph search; it trades a
+    # little route length for far fewer expansions on long queries.
+    #
+    # costs and min_cost weight the moves as in GridPathFinding.set_costs;
+    # closed cells are never portals. A path_finding passed in is shared (with
+    # its costs), e.g. by IncrementalRouter, which reports the cells it changes
+    # through cells_changed().
+    def __init__(self, n, obstacles, cluster_size=64, weight=1.0, path_finding=None, costs=None, min_cost=1.0):
+        self.path_finding = path_finding or GridPathFinding(n, obstacles, costs, min_cost)
+        self.n = n
+        self.size = cluster_size
+        self.weight = weight
+        self.clusters = (n + cluster_size - 1) // cluster_size
+        self.entrances = {}
+        self.inter = {}
+        self.intra = {}
+        self.lock = threading.Lock()
+        self.expanded = 0
+        self._rebuild()
+
+    def _rebuild(self):
+        self.entrances.clear()
+        self.inter.clear()
+        self.intra.clear()
+        for cx in range(self.clusters):
+            for cy in range(self.clusters):
+                self._build_borders((cx, cy), only_forward=True)
+
+    # Clusters and borders
+
+    def cluster_of(self, x, y):
+        return (x // self.size, y // self.size)
+
+    def bounds(self, cluster):
+        cx, cy = cluster
+        return (cx * self.size, cy * self.size, min(self.n, (cx + 1) * self.size), min(self.n, (cy + 1) * self.size))
+
+    def _border_cells(self, a, b):
+        # Pairs of facing cells along the border between clusters a and b (b below or right of a).
+        x0, y0, x1, y1 = self.bounds(a)
+        if b[0] > a[0]:
+            return [((x1 - 1, y), (x1, y)) for y in range(y0, y1)]
+        return [((x, y1 - 1), (x, y1)) for x in range(x0, x1)]
+
+    def _build_border(self, a, b):
+        pf = self.path_finding
+        grid, costs = pf.grid, pf.costs
+        for u, v in self.entrances.pop((a, b), []):
+            self.inter[u].pop(v, None)
+            self.inter[v].pop(u, None)
+        pairs = []
+        run = []
+        for cell_a, cell_b in self._border_cells(a, b) + [(None, None)]:
+            if cell_a is not None:
+                u, v = pf.index(*cell_a), pf.index(*cell_b)
+                if not grid[u] and not grid[v] and (costs is None or costs[u] != INF and costs[v] != INF):
+                    run.append((u, v))
+                    continue
+            if run:
+                if len(run) < 6:
+                    pairs.append(run[len(run) // 2])
+                else:
+                    pairs.append(run[0])
+                    pairs.append(run[-1])
+                run = []
+        for u, v in pairs:
+            cost = 1.0 if costs is None else (costs[u] + costs[v]) * 0.5
+            self.inter.setdefault(u, {})[v] = cost
+            self.inter.setdefault(v, {})[u] = cost
+        if pairs:
+            self.entrances[(a, b)] = pairs
+
+    def _neighbour_clusters(self, cluster):
+        cx, cy = cluster
+        for nx, ny in ((cx - 1, cy), (cx + 1, cy), (cx, cy - 1), (cx, cy + 1)):
+            if 0 <= nx < self.clusters and 0 <= ny < self.clusters:
+                yield (nx, ny)
+
+    def _build_borders(self, cluster, only_forward=False):
+        cx, cy = cluster
+        if cx + 1 < self.clusters:
+            self._build_border(cluster, (cx + 1, cy))
+        if cy + 1 < self.clusters:
+            self._build_border(cluster, (cx, cy + 1))
+        if not only_forward:
+            if cx > 0:
+                self._build_border((cx - 1, cy), cluster)
+            if cy > 0:
+                self._build_border((cx, cy - 1), cluster)
+
+    def portals(self, cluster):
+        result = set()
+        cx, cy = cluster
+        for key in (((cx - 1, cy), cluster), ((cx, cy - 1), cluster)):
+            for _, v in self.entrances.get(key, ()):
+                result.add(v)
+        for key in ((cluster, (cx + 1, cy)), (cluster, (cx, cy + 1))):
+            for u, _ in self.entrances.get(key, ()):
+                result.add(u)
+        return result
+
+    def _uniform_cost(self, cluster):
+        # The cost every cell of the cluster shares, or None if the cluster has
+        # obstacles, closed cells or cells of differing cost.
+        pf = self.path_finding
+        x0, y0, x1, y1 = self.bounds(cluster)
+        value = 1.0
+        for x in range(x0, x1):
+            start, end = pf.index(x, y0), pf.index(x, y1 - 1) + 1
+            if any(pf.grid[start:end]):
+                return None
+            if pf.costs is not None:
+                row = pf.costs[start:end]
+                low = min(row)
+                if low != max(row) or low == INF or (x > x0 and low != value):
+                    return None
+                value = low
+        return value
+
+    def _intra(self, cluster):
+        edges = self.intra.get(cluster)
+        if edges is not None:
+            return edges
+        pf = self.path_finding
+        portals = sorted(self.portals(cluster))
+        edges = {u: {} for u in portals}
+        uniform = self._uniform_cost(cluster)
+        if uniform is not None:
+            cells = {u: pf.cell(u) for u in portals}
+            for i, u in enumerate(portals):
+                for v in portals[i + 1:]:
+                    cost = octile(*cells[u], *cells[v]) * uniform
+                    edges[u][v] = cost
+                    edges[v][u] = cost
+        else:
+            for i, u in enumerate(portals):
+                dist, _ = self._local(u, set(portals[i + 1:]))
+                for v, cost in dist.items():
+                    edges[u][v] = cost
+                    edges[v][u] = cost
+        self.intra[cluster] = edges
+        return edges
+
+    # Searches bounded to one cluster
+
+    def _cluster_grid(self, cluster):
+        # Copy of the cluster (and of its costs, None without costs) with a
+        # blocked one-cell frame, so local searches need no bounds checks.
+        pf = self.path_finding
+        x0, y0, x1, y1 = self.bounds(cluster)
+        cw = y1 - y0 + 2
+        size = (x1 - x0 + 2) * cw
+        local = bytearray(b'\x01') * size
+        local_costs = array('f', [INF]) * size if pf.costs is not None else None
+        for x in range(x0, x1):
+            start = (x - x0 + 1) * cw + 1
+            source = pf.index(x, y0)
+            local[start:start + y1 - y0] = pf.grid[source:source + y1 - y0]
+            if local_costs is not None:
+                local_costs[start:start + y1 - y0] = pf.costs[source:source + y1 - y0]
+        return local, local_costs, cw, (x0, y0)
+
+    def _local(self, source, targets, goal=None):
+        # Dijkstra (or A* towards goal) from source, restricted to one cluster.
+        # Indices in and out are global grid indices. Returns ({target: cost}, parents).
+        pf = self.path_finding
+        cluster = self.cluster_of(*pf.cell(source))
+        local, local_costs, cw, (x0, y0) = self._cluster_grid(cluster)
+        w = pf.width
+        scale = pf.min_cost
+
+        def to_local(idx):
+            x, y = divmod(idx, w)
+            return (x - x0) * cw + (y - y0)
+
+        def to_global(idx):
+            x, y = divmod(idx, cw)
+            return (x + x0) * w + (y + y0)
+
+        moves = [(-cw - 1, SQRT2), (-cw, 1.0), (-cw + 1, SQRT2), (-1, 1.0),
+                 (1, 1.0), (cw - 1, SQRT2), (cw, 1.0), (cw + 1, SQRT2)]
+        remaining = {to_local(t): t for t in targets}
+        found = {}
+        g = [INF] * len(local)
+        parents = [-1] * len(local)
+        start = to_local(source)
+        g[start] = 0.0
+        if goal is not None:
+            gx, gy = divmod(to_local(goal), cw)
+        open_set = [(0.0, 0.0, start)]
+        while open_set and remaining:
+            _, current_g, current = heapq.heappop(open_set)
+            if current_g > g[current]:
+                continue
+            target = remaining.pop(current, None)
+            if target is not None:
+                found[target] = current_g
+            if local_costs is not None:
+                current_cost = local_costs[current] * 0.5
+            for offset, weight in moves:
+                neighbor = current + offset
+                if local[neighbor]:
+                    continue
+                if local_costs is not None:
+                    cost = local_costs[neighbor]
+                    if cost == INF:
+                        continue
+                    weight *= current_cost + cost * 0.5
+                tentative = current_g + weight
+                if tentative < g[neighbor]:
+                    g[neighbor] = tentative
+                    parents[neighbor] = current
+                    f = tentative
+                    if goal is not None:
+                        nx, ny = divmod(neighbor, cw)
+                        f += octile(nx, ny, gx, gy) * scale
+                    heapq.heappush(open_set, (f, tentative, neighbor))
+        if goal is None:
+            return found, None
+        path = {}
+        idx = to_local(goal)
+        if goal in found:
+            while idx != start:
+                path[to_global(idx)] = to_global(parents[idx])
+                idx = parents[idx]
+        return found, path
+
+    def _refine(self, u, v):
+        if v in self.inter.get(u, ()):
+            return [v]
+        found, parents = self._local(u, {v}, goal=v)
+        if v not in found:
+            return None
+        segment = []
+        while v != u:
+            segment.append(v)
+            v = parents[v]
+        return segment[::-1]
+
+    # Queries
+
+    def a_star(self, start, goal):
+        with self.lock:
+            return self._a_star(tuple(start), tuple(goal))
+
+    def _a_star(self, start, goal):
+        pf = self.path_finding
+        if not pf.passable(start) or not pf.passable(goal):
+            return []
+        start_cluster = self.cluster_of(*start)
+        goal_cluster = self.cluster_of(*goal)
+        if octile(*start, *goal) <= 2 * self.size or start_cluster == goal_cluster:
+            path = pf.a_star(start, goal)
+            self.expanded = pf.expanded
+            return path
+
+        source = pf.index(*start)
+        target = pf.index(*goal)
+        if pf.costs is not None and (pf.costs[source] == INF or pf.costs[target] == INF):
+            return []
+        start_edges, _ = self._local(source, self.portals(start_cluster))
+        goal_edges, _ = self._local(target, self.portals(goal_cluster))
+        if not start_edges or not goal_edges:
+            return self._fallback(start, goal)
+
+        w = pf.width
+        gx, gy = divmod(target, w)
+        scale = self.weight * pf.min_cost
+        g = {source: 0.0}
+        parents = {source: None}
+        open_set = [(0.0, 0.0, source)]
+        expanded = 0
+        while open_set:
+            _, current_g, current = heapq.heappop(open_set)
+            if current_g > g[current]:
+                continue
+            if current == target:
+                break
+            expanded += 1
+            if current == source:
+                neighbours = list(start_edges.items()) + list(self.inter.get(current, {}).items())
+            else:
+                cluster = self.cluster_of(*pf.cell(current))
+                neighbours = list(self._intra(cluster).get(current, {}).items()) + list(self.inter.get(current, {}).items())
+                if current in goal_edges:
+                    neighbours.append((target, goal_edges[current]))
+            for neighbor, cost in neighbours:
+                tentative = current_g + cost
+                if tentative < g.get(neighbor, INF):
+                    g[neighbor] = tentative
+                    parents[neighbor] = current
+                    nx, ny = divmod(neighbor, w)
+                    heapq.heappush(open_set, (tentative + scale * octile(nx, ny, gx, gy), tentative, neighbor))
+        self.expanded = expanded
+        if target not in parents:
+            return self._fallback(start, goal)
+
+        nodes = []
+        node = target
+        while node is not None:
+            nodes.append(node)
+            node = parents[node]
+        nodes.reverse()
+
+        path = [source]
+        for u, v in zip(nodes, nodes[1:]):
+            segment = self._refine(u, v)
+            if segment is None:
+                return self._fallback(start, goal)
+            path.extend(segment)
+        return [pf.cell(idx) for idx in path]
+
+    def _fallback(self, start, goal):
+        # The abstraction ignores corner-only crossings between clusters, so fall
+        # back to a flat search rather than report a reachable goal as unreachable.
+        path = self.path_finding.a_star(start, goal)
+        self.expanded = self.path_finding.expanded
+        return path
+
+    # Updates
+
+    def cells_changed(self, cells):
+        # Cells of a shared grid that its owner already changed.
+        with self.lock:
+            dirty = {self.cluster_of(x, y) for x, y in cells}
+            stale = set(dirty)
+            for cluster in dirty:
+                self._build_borders(cluster)
+                stale.update(self._neighbour_clusters(cluster))
+            for cluster in stale:
+                self.intra.pop(cluster, None)
+
+    def set_costs(self, costs, min_cost=1.0):
+        # Any portal distance may change with the costs, so the abstraction is rebuilt.
+        with self.lock:
+            self.path_finding.set_costs(costs, min_cost)
+            self._rebuild()
+
+    def rebuild(self):
+        # After the owner of a shared grid repainted all of it.
+        with self.lock:
+            self._rebuild()
@@ -0,0 +1,286 @@
+import heapq
+import math
+import threading
+import time
+from collections import OrderedDict
+from CostLayers import array_cost, path_minutes
+from GridPathFinding import GridPathFinding, SQRT2
+from HierarchicalPathFinding import HierarchicalPathFinding, octile
+from Obstacles import obstacle_changes
+
+INF = math.inf
+EPS = 1e-9
+
+class LPAStar:
+    # Lifelong Planning A* for one (start, goal) pair on a GridPathFinding grid.
+    # The first compute() is an ordinary A*; after cells change, update_cells()
+    # re-opens only the vertices whose edges changed and compute() repairs the
+    # previous search instead of starting over. Moves are weighted by the
+    # grid's cost multipliers, if it has any, as in GridPathFinding.
+    def __init__(self, path_finding, start, goal):
+        self.path_finding = path_finding
+        self.costs = path_finding.costs
+        self.scale = path_finding.min_cost
+        self.start = path_finding.index(*start)
+        self.goal = path_finding.index(*goal)
+        w = path_finding.width
+        self.goal_xy = divmod(self.goal, w)
+        self.g = {}
+        self.rhs = {self.start: 0.0}
+        self.open_set = []
+        self.open_keys = {}
+        self.expanded = 0
+        self._push(self.start)
+
+    def _h(self, idx):
+        x, y = divmod(idx, self.path_finding.width)
+        dx = abs(x - self.goal_xy[0])
+        dy = abs(y - self.goal_xy[1])
+        return (dx + dy + (SQRT2 - 2) * min(dx, dy)) * self.scale
+
+    def _edge(self, a, b, weight):
+        costs = self.costs
+        return weight if costs is None else weight * (costs[a] + costs[b]) * 0.5
+
+    def _key(self, idx):
+        k = min(self.g.get(idx, INF), self.rhs.get(idx, INF))
+        return (k + self._h(idx), k)
+
+    def _push(self, idx):
+        key = self._key(idx)
+        self.open_keys[idx] = key
+        heapq.heappush(self.open_set, (key, idx))
+
+    def _top(self):
+        while self.open_set:
+            key, idx = self.open_set[0]
+            if self.open_keys.get(idx) == key:
+                return key
+            heapq.heappop(self.open_set)
+        return (INF, INF)
+
+    def _update_vertex(self, idx):
+        grid = self.path_finding.grid
+        if idx != self.start:
+            best = INF
+            if not grid[idx]:
+                g = self.g
+                for offset, weight in self.path_finding.moves:
+                    pred = idx + offset
+                    if grid[pred]:
+                        continue
+                    cost = g.get(pred, INF) + self._edge(pred, idx, weight)
+                    if cost < best:
+                        best = cost
+            if best == INF:
+                self.rhs.pop(idx, None)
+            else:
+                self.rhs[idx] = best
+        self.open_keys.pop(idx, None)
+        if self.g.get(idx, INF) != self.rhs.get(idx, INF):
+            self._push(idx)
+
+    def update_cells(self, cells):
+        # Cells whose blocked flag changed; their own edges and their neighbours' edges changed.
+        affected = set()
+        for idx in cells:
+            affected.add(idx)
+            for offset, _ in self.path_finding.moves:
+                affected.add(idx + offset)
+        grid = self.path_finding.grid
+        for idx in affected:
+            if grid[idx] and idx not in self.g and idx not in self.rhs:
+                continue
+            self._update_vertex(idx)
+
+    def compute(self):
+        grid = self.path_finding.grid
+        moves = self.path_finding.moves
+        g, rhs = self.g, self.rhs
+        goal = self.goal
+        expanded = 0
+        while True:
+            # Keys within EPS count as equal: sums of sqrt(2) in a different order
+            # differ in the last bits, and stopping on that noise leaves stale g-values.
+            top, goal_key = self._top(), self._key(goal)
+            if not (top[0] < goal_key[0] - EPS or (top[0] <= goal_key[0] + EPS and top[1] < goal_key[1])
+                    or rhs.get(goal, INF) != g.get(goal, INF)):
+                break
+            if top[0] == INF:
+                break
+            key, idx = heapq.heappop(self.open_set)
+            del self.open_keys[idx]
+            expanded += 1
+            if g.get(idx, INF) > rhs.get(idx, INF):
+                g[idx] = rhs[idx]
+                for offset, _ in moves:
+                    succ = idx + offset
+                    if not grid[succ]:
+                        self._update_vertex(succ)
+            else:
+                g.pop(idx, None)
+                self._update_vertex(idx)
+                for offset, _ in moves:
+                    succ = idx + offset
+                    if not grid[succ]:
+                        self._update_vertex(succ)
+        self.expanded = expanded
+        return self.path()
+
+    def path(self):
+        g = self.g
+        if g.get(self.goal, INF) == INF:
+            return []
+        grid = self.path_finding.grid
+        moves = self.path_finding.moves
+        path = [self.goal]
+        idx = self.goal
+        while idx != self.start:
+            best, best_cost = None, INF
+            for offset, weight in moves:
+                pred = idx + offset
+                if grid[pred]:
+                    continue
+                cost = g.get(pred, INF) + self._edge(pred, idx, weight)
+                if cost < best_cost:
+                    best, best_cost = pred, cost
+            idx = best
+            path.append(idx)
+        return [self.path_finding.cell(idx) for idx in reversed(path)]
+
+class IncrementalRouter:
+    # Keeps one LPA* per (start, goal) over a shared grid. Obstacle changes are
+    # queued (e.g. from a DataStore listener) and applied on the next route(),
+    # so each repair costs roughly the size of the change.
+    #
+    # Once attached to a store, routes use the store's cost layers as they are
+    # when route() is called. A cost change, or a window opening or closing,
+    # swaps in the new costs and drops the planners; cost changes are rare next
+    # to obstacle edits, and every edge weight may have changed.
+    #
+    # At most `capacity` planners are kept, least recently routed first out,
+    # as RouteCache does with routes; each holds its search's g/rhs tables and
+    # is repaired on every obstacle change.
+    #
+    # With hierarchical_distance set, queries at least that far apart (octile
+    # cells) are answered by HPA* (HierarchicalPathFinding) on the same grid
+    # instead: no planner is kept for them, and their routes may be a little
+    # longer than the shortest. Only while every cell costs 1: over cost layers
+    # HPA* routes came out up to ~24% longer, which would skew the ETAs, so
+    # then every query gets an exact LPA*.
+    def __init__(self, n, obstacles, costs=None, min_cost=1.0, capacity=256, hierarchical_distance=None):
+        self.path_finding = GridPathFinding(n, obstacles, costs, min_cost)
+        self.capacity = capacity
+        self.hierarchical_distance = hierarchical_distance
+        self.hierarchical = None
+        if hierarchical_distance is not None:
+            self.hierarchical = HierarchicalPathFinding(n, (), path_finding=self.path_finding)
+        self.planners = OrderedDict()
+        self.changes = {}
+        self.lock = threading.Lock()
+        self.expanded = 0
+        self.store = None
+        self.cost_state = None
+
+    def obstacles_changed(self, added, removed):
+        with self.lock:
+            for x, y in added:
+                if 0 <= x < self.path_finding.n and 0 <= y < self.path_finding.n:
+                    self.changes[(x, y)] = True
+            for x, y in removed:
+                if 0 <= x < self.path_finding.n and 0 <= y < self.path_finding.n:
+                    self.changes[(x, y)] = False
+
+    def obstacles_reset(self, obstacles):
+        # Resynchronise with a full obstacle layer (or list of cells), e.g. after
+        # the store reloaded a snapshot: the grid is painted afresh and the
+        # planners dropped, as any cell may have changed.
+        grid = GridPathFinding(self.path_finding.n, obstacles).grid
+        with self.lock:
+            self.path_finding.grid[:] = grid
+            self.changes.clear()
+            self.planners.clear()
+            if self.hierarchical is not None:
+                self.hierarchical.rebuild()
+
+    def _apply_changes(self):
+        changed = []
+        for cell, blocked in self.changes.items():
+            idx = self.path_finding.index(*cell)
+            if self.path_finding.grid[idx] != blocked:
+                self.path_finding.grid[idx] = 1 if blocked else 0
+                changed.append(idx)
+        self.changes.clear()
+        if changed:
+            for planner in self.planners.values():
+                planner.update_cells(changed)
+            if self.hierarchical is not None:
+                self.hierarchical.cells_changed([self.path_finding.cell(idx) for idx in changed])
+        return changed
+
+    def _current_costs(self):
+        # New (state, costs, min_cost) from the store if its cost version or
+        # open windows differ from the ones in use, else None. Takes the store
+        # lock, so it must not run under self.lock: store listeners take
+        # self.lock while the store lock is held.
+        if self.store is None:
+            return None
+        now = time.time()
+        with self.store.lock:
+            state = (self.store.versions.get('costs/'), self.store.costs.windows(now))
+            if state == self.cost_state:
+                return None
+            return (state,) + self.store.costs.at(now)
+
+    def _set_costs(self, update):
+        state, costs, min_cost = update
+        if state == self.cost_state:
+            return
+        self.cost_state = state
+        self.planners.clear()
+        self.path_finding.set_costs(costs, min_cost)
+        if self.hierarchical is not None and costs is None:
+            self.hierarchical.rebuild()
+
+    def minutes(self, path):
+        # Travel minutes along path over the costs in use.
+        with self.lock:
+            costs = self.path_finding.costs
+            return path_minutes(path, array_cost(costs, self.path_finding.width) if costs is not None else None)
+
+    def route(self, start, goal):
+        start, goal = tuple(start), tuple(goal)
+        update = self._current_costs()
+        with self.lock:
+            if update:
+                self._set_costs(update)
+            self._apply_changes()
+            self.expanded = 0
+            if not self.path_finding.passable(start) or not self.path_finding.passable(goal):
+                return []
+            if self.hierarchical is not None and self.path_finding.costs is None \
+                    and octile(*start, *goal) >= self.hierarchical_distance:
+                path = self.hierarchical.a_star(start, goal)
+                self.expanded = self.hierarchical.expanded
+                return path
+            planner = self.planners.get((start, goal))
+            if planner is None:
+                planner = self.planners[(start, goal)] = LPAStar(self.path_finding, start, goal)
+                while len(self.planners) > self.capacity:
+                    self.planners.popitem(last=False)
+            else:
+                self.planners.move_to_end((start, goal))
+            path = planner.compute()
+            self.expanded = planner.expanded
+            return path
+
+    def attach(self, store):
+        self.store = store
+
+        def listener(op, args):
+            change = obstacle_changes(op, args, store.obstacles)
+            if change:
+                self.obstacles_changed(*change)
+            elif op == 'reload':
+                self.obstacles_reset(store.obstacles)
+        store.subscribe(listener)
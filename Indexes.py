@@ -0,0 +1,152 @@
+import hashlib
+import json
+from SpatialIndex import SpatialIndex
+
+ROLES = {'senders': 'distributor', 'receivers': 'camp'}
+
+class UserIndex:
+    # name -> location and resources/needs of every sender and receiver, and the
+    # people view built from them (people_data.json's join), kept in step with
+    # the DataStore by a listener instead of re-reading people_data.json or
+    # scanning the store's lists. Each change rebuilds only the record of the
+    # user it touched; the serialised view and its ETag are rebuilt once per
+    # change, on the next read. Locations are also kept in a SpatialIndex per
+    # type for nearest/radius queries. Reads happen under the store lock, which
+    # is also held while listeners run.
+    def __init__(self, store):
+        self.store = store
+        self.locations = {'senders': {}, 'receivers': {}}
+        self.resources = {'senders': {}, 'receivers': {}}
+        self.people = {'senders': {}, 'receivers': {}}
+        self.spatial = {'senders': SpatialIndex(), 'receivers': SpatialIndex()}
+        self.body = None
+        self.etag = None
+        with store.lock:
+            self._rebuild()
+            store.subscribe(self._listener)
+
+    def _rebuild(self):
+        for entity_type in ('senders', 'receivers'):
+            field = 'resources' if entity_type == 'senders' else 'needs'
+            self.locations[entity_type] = {e['name']: {'name': e['name'], 'x': e['x'], 'y': e['y']} for e in self.store.locations[entity_type]}
+            self.resources[entity_type] = {e['name']: {'name': e['name'], field: e[field]} for e in self.store.resources[entity_type]}
+            self.people[entity_type] = {}
+            for name in self.resources[entity_type]:
+                self._update(entity_type, name)
+            self.spatial[entity_type] = SpatialIndex()
+            for location in self.locations[entity_type].values():
+                self._place(entity_type, location)
+        self.body = None
+
+    def _update(self, entity_type, name):
+        user = self._user(entity_type, name)
+        if user is None:
+            self.people[entity_type].pop(name, None)
+        else:
+            self.people[entity_type][name] = user
+        self.body = None
+
+    def _place(self, entity_type, location):
+        # Coordinates arrive as sent by clients; ones that are not numbers are left out.
+        try:
+            x, y = float(location['x']), float(location['y'])
+        except (TypeError, ValueError):
+            self.spatial[entity_type].remove(location['name'])
+            return
+        self.spatial[entity_type].add(location['name'], x, y)
+
+    def _listener(self, op, args):
+        if op == 'set_sender_resources':
+            self.resources['senders'][args[0]] = {'name': args[0], 'resources': args[1]}
+            self._update('senders', args[0])
+        elif op == 'set_receiver_needs':
+            self.resources['receivers'][args[0]] = {'name': args[0], 'needs': args[1]}
+            self._update('receivers', args[0])
+        elif op == 'add_location':
+            entity_type, entity = args
+            self.locations[entity_type][entity['name']] = {'name': entity['name'], 'x': entity['x'], 'y': entity['y']}
+            self._place(entity_type, entity)
+            self._update(entity_type, entity['name'])
+        elif op == 'remove_location':
+            entity_type, name = args
+            self.locations[entity_type].pop(name, None)
+            self.resources[entity_type].pop(name, None)
+            self.spatial[entity_type].remove(name)
+            self._update(entity_type, name)
+        elif op == 'move_location':
+            entity_type, name, x, y = args
+            if name in self.locations[entity_type]:
+                self.locations[entity_type][name] = {'name': name, 'x': x, 'y': y}
+                self._place(entity_type, self.locations[entity_type][name])
+                self._update(entity_type, name)
+        elif op in ('add_name', 'remove_name'):
+            # Only bumps the user's version.
+            self._update(*args)
+        elif op == 'reload':
+            self._rebuild()
+
+    def _user(self, entity_type, name):
+        # One entry of the people view: only users with both a location and resources.
+        location = self.locations[entity_type].get(name)
+        resources = self.resources[entity_type].get(name)
+        if location is None or resources is None:
+            return None
+        return {**resources, **location, "role": ROLES[entity_type], "version": self.store.versions.get(f"{entity_type}/{name}")}
+
+    def get(self, name):
+        self.store.refresh()
+        with self.store.lock:
+            return self.people['senders'].get(name) or self.people['receivers'].get(name)
+
+    def _view(self):
+        return {entity_type: list(self.people[entity_type].values()) for entity_type in ('senders', 'receivers')}
+
+    def people_view(self):
+        # {"senders": [...], "receivers": [...]}, as served by /get_people_data.
+        self.store.refresh()
+        with self.store.lock:
+            return self._view()
+
+    def people_json(self):
+        # (JSON body of the people view, ETag). The ETag hashes the body, so it
+        # also matches across worker processes that serialised the same state.
+        self.store.refresh()
+        with self.store.lock:
+            if self.body is None:
+                self.body = json.dumps(self._view(), sort_keys=True)
+                self.etag = hashlib.sha1(self.body.encode()).hexdigest()
+            return self.body, self.etag
+
+    def location(self, entity_type, name):
+        self.store.refresh()
+        with self.store.lock:
+            location = self.locations[entity_type].get(name)
+        return (location['x'], location['y']) if location else None
+
+    def nearest(self, entity_type, x, y, k, exclude=None):
+        # The k users of entity_type closest to (x, y) by octile distance, as
+        # {"name", "x", "y", "distance"}.
+        self.store.refresh()
+        with self.store.lock:
+            return [{**self.locations[entity_type][name], "distance": distance}
+                    for distance, name in self.spatial[entity_type].nearest(x, y, k, exclude)]
+
+    def within(self, entity_type, x, y, radius, exclude=None):
+        self.store.refresh()
+        with self.store.lock:
+            return [{**self.locations[entity_type][name], "distance": distance}
+                    for distance, name in self.spatial[entity_type].within(x, y, radius, exclude)]
+
+class DeliveryIndex:
+    # (sender, receiver, resource) -> planned delivery. Runs append to
+    # deliveries.json, so the last one listed (the newest plan) wins.
+    def __init__(self, deliveries):
+        self.by_key = {}
+        self.add(deliveries)
+
+    def add(self, deliveries):
+        for delivery in deliveries:
+            self.by_key[(delivery['sender'], delivery['receiver'], delivery['resource'])] = delivery
+
+    def get(self, sender, receiver, resource):
+        return self.by_key.get((sender, receiver, resource))
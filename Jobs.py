@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from Metrics import metrics
+
+log = logging.getLogger(__name__)
+
+class Job:
+    # One queued piece of background work. work(job) runs on a worker thread
+    # and may call job.report() to publish progress.
+    def __init__(self, job_id, kind, work, key, not_before):
+        self.id = job_id
+        self.kind = kind
+        self.work = work
+        self.key = key
+        self.not_before = not_before
+        self.status = 'queued'
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.requests = 1
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def report(self, stage, done=None, total=None):
+        self.progress = {"stage": stage, "done": done, "total": total}
+
+    def to_json(self, result=True):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result if result else None,
+            "error": self.error,
+            "requests": self.requests,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class JobQueue:
+    # Worker pool for background jobs. Jobs with the same key are coalesced:
+    # submitting while one is still queued joins it (and pushes its start back
+    # by `delay`, so a burst of submits runs once after the burst), and at most
+    # one job per key runs at a time, so a submit during a run queues exactly
+    # one follow-up. The last `history` finished jobs stay queryable by id.
+    # Ids are random, so ids from different app processes never collide.
+    def __init__(self, workers=2, delay=0.0, history=100, on_finish=None):
+        self.condition = threading.Condition()
+        self.delay = delay
+        self.history = history
+        self.on_finish = on_finish
+        self.jobs = OrderedDict()
+        self.queue = []
+        self.running_keys = set()
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, kind, work, key=None, delay=None):
+        delay = self.delay if delay is None else delay
+        with self.condition:
+            not_before = time.time() + delay
+            if key is not None:
+                for job in self.queue:
+                    if job.key == key:
+                        job.requests += 1
+                        # An immediate submit (delay 0) starts the queued job now.
+                        job.not_before = max(job.not_before, not_before) if delay else not_before
+                        self.condition.notify()
+                        return job
+            job = Job(str(uuid.uuid4()), kind, work, key, not_before)
+            self.jobs[job.id] = job
+            self.queue.append(job)
+            self.condition.notify()
+            return job
+
+    def get(self, job_id):
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.condition:
+            return list(self.jobs.values())
+
+    def _next(self):
+        # (first runnable job or None, seconds until a queued job becomes runnable)
+        now = time.time()
+        wait = None
+        for job in self.queue:
+            if job.key is not None and job.key in self.running_keys:
+                continue
+            if job.not_before <= now:
+                return job, None
+            wait = job.not_before - now if wait is None else min(wait, job.not_before - now)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self.condition:
+                job, wait = self._next()
+                while job is None:
+                    self.condition.wait(wait)
+                    job, wait = self._next()
+                self.queue.remove(job)
+                if job.key is not None:
+                    self.running_keys.add(job.key)
+                job.status = 'running'
+                job.started_at = time.time()
+
+            try:
+                job.result = job.work(job)
+                job.status = 'done'
+            except Exception as e:
+                # Clients see the job's error; the traceback stays in the server log.
+                log.exception("%s job %s failed", job.kind, job.id)
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = 'failed'
+            job.finished_at = time.time()
+            metrics.observe('job_queue_seconds', job.started_at - job.not_before, kind=job.kind)
+            metrics.observe('job_seconds', job.finished_at - job.started_at, kind=job.kind, status=job.status)
+
+            with self.condition:
+                self.running_keys.discard(job.key)
+                self._trim()
+                self.condition.notify_all()
+            if self.on_finish:
+                self.on_finish(job)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ('done', 'failed')]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
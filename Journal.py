@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+
+class Journal:
+    # Append-only log of store mutations, one JSON record per line.
+    # fsync_batch: fsync after this many records (0 disables fsync on commit).
+    # fsync_interval: if set, a flusher thread also fsyncs pending records this often.
+    # Appends and truncation must happen under the store's cross-process lock;
+    # commit() (the fsync) is meant to be called after that lock is released so
+    # concurrent writers share one fsync.
+    def __init__(self, file_path, fsync_batch=1, fsync_interval=None, start_seq=0):
+        self.file_path = file_path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.pending = 0
+        self.records = 0
+        self.seq = start_seq
+        self.synced_seq = start_seq
+        self._repair()
+        self.file = None
+        self._open()
+        self._stop = threading.Event()
+        self._flusher = None
+        if fsync_interval:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def _repair(self):
+        # Cut off a torn tail left by a crash.
+        if not os.path.exists(self.file_path):
+            return
+        good_size = 0
+        with open(self.file_path, 'rb') as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    json.loads(line)
+                except ValueError:
+                    break
+                good_size += len(line)
+        if good_size != os.path.getsize(self.file_path):
+            with open(self.file_path, 'r+b') as file:
+                file.truncate(good_size)
+
+    def _open(self):
+        if self.file:
+            self.file.close()
+        self.file = open(self.file_path, 'a')
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.offset = 0
+        self.records = 0
+
+    def changed(self):
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return True
+        return stat.st_ino != self.inode or stat.st_size != self.offset
+
+    def read_new(self):
+        # Records appended since the last call, including those written by other
+        # processes. Returns (records, restarted); restarted means the file was
+        # replaced by a compaction and was read again from the beginning.
+        with self.lock:
+            restarted = False
+            try:
+                stat = os.stat(self.file_path)
+            except FileNotFoundError:
+                stat = None
+            if stat is None or stat.st_ino != self.inode:
+                self._open()
+                restarted = True
+            elif stat.st_size == self.offset:
+                return [], False
+            records = []
+            with open(self.file_path, 'rb') as file:
+                file.seek(self.offset)
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        break
+                    record = json.loads(line)
+                    records.append(record)
+                    self.offset += len(line)
+                    self.records += 1
+                    self.seq = max(self.seq, record['seq'])
+            return records, restarted
+
+    def append_many(self, entries):
+        with self.lock:
+            lines = []
+            for op, args in entries:
+                self.seq += 1
+                lines.append(json.dumps({"seq": self.seq, "op": op, "args": args}, separators=(',', ':')) + '\n')
+            data = ''.join(lines)
+            self.file.write(data)
+            self.file.flush()
+            self.offset += len(data.encode())
+            self.pending += len(lines)
+            self.records += len(lines)
+            return self.seq
+
+    def commit(self, seq):
+        if self.fsync_batch and self.pending >= self.fsync_batch:
+            self.sync_to(seq)
+
+    def sync_to(self, seq):
+        # Group commit: a writer whose record was covered by someone else's fsync returns immediately.
+        with self.sync_lock:
+            if self.synced_seq >= seq:
+                return
+            with self.lock:
+                self.file.flush()
+                target = self.seq
+                self.pending = 0
+                fileno = self.file.fileno()
+            os.fsync(fileno)
+            self.synced_seq = target
+
+    def sync(self):
+        self.sync_to(self.seq)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.fsync_interval):
+            self.sync()
+
+    def truncate(self, upto_seq):
+        # Drop records already covered by a snapshot; newer records are kept.
+        with self.sync_lock, self.lock:
+            self.file.flush()
+            tmp_path = self.file_path + '.tmp'
+            kept = []
+            with open(self.file_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                for line in src:
+                    if json.loads(line)['seq'] > upto_seq:
+                        dst.write(line)
+                        kept.append(line)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp_path, self.file_path)
+            self._open()
+            self.offset = sum(len(line) for line in kept)
+            self.records = len(kept)
+            self.pending = 0
+            self.synced_seq = self.seq
+
+    def close(self):
+        self._stop.set()
+        self.sync()
+        with self.lock:
+            self.file.close()
+
+def atomic_write(file_path, text):
+    # text may be str or bytes-like.
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w' if isinstance(text, str) else 'wb') as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, file_path)
+
+class Compactor:
+    # Background thread that snapshots the store once the journal grows past a threshold.
+    def __init__(self, store, snapshot_every=1000, check_interval=1.0):
+        self.store = store
+        self.snapshot_every = snapshot_every
+        self.check_interval = check_interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            if self.store.journal.records >= self.snapshot_every:
+                self.store.snapshot()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
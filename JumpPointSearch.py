@@ -0,0 +1,136 @@
+import heapq
+from GridPathFinding import GridPathFinding, SQRT2, F_SCALE
+
+class JumpPointSearch:
+    # Jump Point Search on the GridPathFinding grid. It uses the same move model
+    # as PathFinding.build_graph (8-connected, diagonal moves allowed past
+    # corners, costs 1 and sqrt(2)), so paths have the same length as a_star;
+    # only jump points are pushed on the open set and the straight or diagonal
+    # runs between them are filled in when the path is returned.
+    def __init__(self, n, obstacles, path_finding=None):
+        self.path_finding = path_finding or GridPathFinding(n, obstacles)
+        if self.path_finding.costs is not None:
+            raise ValueError("Jump Point Search needs uniform move costs")
+        self.n = n
+        self.expanded = 0
+        self.peak_open = 0
+
+    def _jump(self, idx, dx, dy, target):
+        grid = self.path_finding.grid
+        w = self.path_finding.width
+        step = dx * w + dy
+        while True:
+            idx += step
+            if grid[idx]:
+                return -1
+            if idx == target:
+                return idx
+            if dx and dy:
+                if (not grid[idx - dx * w + dy] and grid[idx - dx * w]) or (not grid[idx + dx * w - dy] and grid[idx - dy]):
+                    return idx
+                if self._jump(idx, dx, 0, target) != -1 or self._jump(idx, 0, dy, target) != -1:
+                    return idx
+            elif dx:
+                if (not grid[idx + dx * w + 1] and grid[idx + 1]) or (not grid[idx + dx * w - 1] and grid[idx - 1]):
+                    return idx
+            else:
+                if (not grid[idx + w + dy] and grid[idx + w]) or (not grid[idx - w + dy] and grid[idx - w]):
+                    return idx
+
+    def _directions(self, idx, parent):
+        if parent == -1:
+            return [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+        grid = self.path_finding.grid
+        w = self.path_finding.width
+        px, py = divmod(parent, w)
+        x, y = divmod(idx, w)
+        dx = (x > px) - (x < px)
+        dy = (y > py) - (y < py)
+        directions = []
+        if dx and dy:
+            directions.append((0, dy))
+            directions.append((dx, 0))
+            directions.append((dx, dy))
+            if grid[idx - dx * w]:
+                directions.append((-dx, dy))
+            if grid[idx - dy]:
+                directions.append((dx, -dy))
+        elif dx:
+            directions.append((dx, 0))
+            if grid[idx + 1]:
+                directions.append((dx, 1))
+            if grid[idx - 1]:
+                directions.append((dx, -1))
+        else:
+            directions.append((0, dy))
+            if grid[idx + w]:
+                directions.append((1, dy))
+            if grid[idx - w]:
+                directions.append((-1, dy))
+        return directions
+
+    def a_star(self, start, goal):
+        pf = self.path_finding
+        if not pf.passable(start) or not pf.passable(goal):
+            return []
+        source = pf.index(*start)
+        target = pf.index(*goal)
+        w = pf.width
+        gx, gy = divmod(target, w)
+        diagonal = SQRT2 - 2
+
+        g_score = {source: 0.0}
+        parent = {source: -1}
+        open_set = [(0, 0.0, source)]
+        expanded = 0
+        peak = 1
+
+        while open_set:
+            _, neg_g, current = heapq.heappop(open_set)
+            current_g = -neg_g
+            if current_g > g_score[current]:
+                continue
+            if current == target:
+                self.expanded = expanded
+                self.peak_open = peak
+                return self._path(current, parent)
+            expanded += 1
+            cx, cy = divmod(current, w)
+
+            for dx, dy in self._directions(current, parent[current]):
+                jump = self._jump(current, dx, dy, target)
+                if jump == -1:
+                    continue
+                jx, jy = divmod(jump, w)
+                steps = max(abs(jx - cx), abs(jy - cy))
+                tentative_g_score = current_g + steps * (SQRT2 if dx and dy else 1.0)
+                if tentative_g_score < g_score.get(jump, float('inf')):
+                    g_score[jump] = tentative_g_score
+                    parent[jump] = current
+                    hx = abs(jx - gx)
+                    hy = abs(jy - gy)
+                    h = hx + hy + diagonal * (hx if hx < hy else hy)
+                    heapq.heappush(open_set, (int((tentative_g_score + h) * F_SCALE), -tentative_g_score, jump))
+            if len(open_set) > peak:
+                peak = len(open_set)
+
+        self.expanded = expanded
+        self.peak_open = peak
+        return []
+
+    def _path(self, idx, parent):
+        w = self.path_finding.width
+        jump_points = []
+        while idx != -1:
+            jump_points.append(idx)
+            idx = parent[idx]
+        jump_points.reverse()
+        path = [self.path_finding.cell(jump_points[0])]
+        for a, b in zip(jump_points, jump_points[1:]):
+            ax, ay = divmod(a, w)
+            bx, by = divmod(b, w)
+            dx = (bx > ax) - (bx < ax)
+            dy = (by > ay) - (by < ay)
+            for i in range(1, max(abs(bx - ax), abs(by - ay)) + 1):
+                path.append((ax + dx * i - 1, ay + dy * i - 1))
+        return path
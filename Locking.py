@@ -0,0 +1,46 @@
+import fcntl
+import threading
+
+class VersionConflict(Exception):
+    def __init__(self, key, expected, actual):
+        super().__init__(f"{key} is at version {actual}, expected {expected}")
+        self.key = key
+        self.expected = expected
+        self.actual = actual
+
+class Versions:
+    def __init__(self, versions=None):
+        self.versions = dict(versions or {})
+
+    def get(self, key):
+        return self.versions.get(key, 0)
+
+    def check(self, key, expected):
+        if expected is not None and self.get(key) != expected:
+            raise VersionConflict(key, expected, self.get(key))
+
+    def bump(self, key):
+        self.versions[key] = self.get(key) + 1
+        return self.versions[key]
+
+class FileLock:
+    # Exclusive lock shared between threads and between worker processes.
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.thread_lock = threading.Lock()
+        self.file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            if self.file is None:
+                self.file = open(self.file_path, 'a')
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        self.thread_lock.release()
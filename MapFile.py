@@ -0,0 +1,198 @@
+import mmap
+import os
+import struct
+import sys
+from Journal import atomic_write
+
+# Binary map written next to locations.json (locations.map) so planners can
+# load the obstacle grid without parsing JSON:
+#   header       magic, format, n, obstacle version, size and mtime of the JSON
+#                it was written from, layer count
+#   layer table  per layer: name, typecode, offset, length
+#   layers       each starting on a page boundary; "obstacles" is bit-packed
+#                (typecode '?'), one row of ceil(n / 8) bytes per x, bit y % 8 of
+#                byte y // 8 set when (x, y) is blocked. Cost layers are n * n
+#                values of an array typecode in native byte order, index x * n + y.
+MAGIC = b'RLFMAP\x00\x01'
+FORMAT = 1
+HEADER = struct.Struct('<8sIIQqqII')
+LAYER = struct.Struct('<24s1s7xQQ')
+PAGE = mmap.PAGESIZE
+COST_TYPECODES = ('B', 'H', 'f', 'd')
+LITTLE_ENDIAN = 1 if sys.byteorder == 'little' else 0
+
+# Byte -> the 8 cells it packs, one byte each.
+_UNPACK = [bytes((value >> bit) & 1 for bit in range(8)) for value in range(256)]
+
+def row_bytes(n):
+    return (n + 7) // 8
+
+def _fill(bits, start, y0, y1):
+    # Sets bits y0..y1 of the row starting at byte start.
+    first, last = y0 >> 3, y1 >> 3
+    if first == last:
+        bits[start + first] |= ((1 << (y1 - y0 + 1)) - 1) << (y0 & 7)
+        return
+    bits[start + first] |= (0xFF << (y0 & 7)) & 0xFF
+    bits[start + first + 1:start + last] = b'\xff' * (last - first - 1)
+    bits[start + last] |= (1 << ((y1 & 7) + 1)) - 1
+
+def pack_obstacles(n, obstacles):
+    # Bit-packed rows for an ObstacleLayer (rectangles are filled a byte at a
+    # time) or any iterable of [x, y] cells. Cells outside the map are dropped.
+    stride = row_bytes(n)
+    bits = bytearray(stride * n)
+    cells = obstacles.cells if hasattr(obstacles, 'regions') else obstacles
+    for cell in cells:
+        x, y = cell[0], cell[1]
+        if 0 <= x < n and 0 <= y < n:
+            bits[x * stride + (y >> 3)] |= 1 << (y & 7)
+    for rects in getattr(obstacles, 'regions', {}).values():
+        for x0, y0, x1, y1 in rects:
+            x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, n - 1), min(y1, n - 1)
+            if x0 > x1 or y0 > y1:
+                continue
+            for x in range(x0, x1 + 1):
+                _fill(bits, x * stride, y0, y1)
+    return bits
+
+def write_map(file_path, n, obstacles, layers=None, version=0, source=None):
+    # layers is {name: n * n cost values}, as an array or memoryview with a
+    # typecode from COST_TYPECODES (e.g. another map's layer()). version and
+    # source (the JSON file the obstacles came from) let readers tell whether
+    # the map is still current; see MapFile.is_current().
+    sections = [('obstacles', '?', memoryview(pack_obstacles(n, obstacles)))]
+    for name, values in (layers or {}).items():
+        values = memoryview(values)
+        if name == 'obstacles' or not name or len(name.encode()) > 24:
+            raise ValueError(f"Invalid layer name: {name}")
+        if values.format not in COST_TYPECODES or len(values) != n * n:
+            raise ValueError(f"Layer {name} must hold {n * n} values with typecode in {COST_TYPECODES}")
+        sections.append((name, values.format, values))
+    stat = os.stat(source) if source else None
+    header = HEADER.pack(MAGIC, FORMAT, n, version, stat.st_size if stat else -1, stat.st_mtime_ns if stat else -1,
+                         len(sections), LITTLE_ENDIAN)
+    offset = -(-(HEADER.size + LAYER.size * len(sections)) // PAGE) * PAGE
+    table = []
+    for name, typecode, data in sections:
+        table.append((name, typecode, offset, data.nbytes))
+        offset += -(-data.nbytes // PAGE) * PAGE
+    out = bytearray(offset)
+    out[:HEADER.size] = header
+    for i, (name, typecode, start, length) in enumerate(table):
+        LAYER.pack_into(out, HEADER.size + i * LAYER.size, name.encode(), typecode.encode(), start, length)
+    for (_, _, data), (_, _, start, length) in zip(sections, table):
+        out[start:start + length] = data.cast('B')
+    atomic_write(file_path, out)
+
+class MapFile:
+    # Read-only view of a map written by write_map(), memory-mapped so that
+    # every process reading the same file shares its pages through the page
+    # cache. Behaves like an ObstacleLayer for reads (`cell in map`, iteration,
+    # paint()), so it can be passed as obstacles to GridPathFinding,
+    # ParallelRouter, JumpPointSearch and PathFinding. layer(name) is a
+    # zero-copy memoryview of a cost layer.
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, file_format, self.n, self.version, self.source_size, self.source_mtime_ns,
+             count, little_endian) = HEADER.unpack_from(self.mmap, 0)
+            if magic != MAGIC or file_format != FORMAT:
+                raise ValueError(f"{file_path} is not a map file")
+            if little_endian != LITTLE_ENDIAN:
+                raise ValueError(f"{file_path} was written with a different byte order")
+            self.layers = {}
+            for i in range(count):
+                name, typecode, offset, length = LAYER.unpack_from(self.mmap, HEADER.size + i * LAYER.size)
+                self.layers[name.rstrip(b'\x00').decode()] = (typecode.decode(), offset, length)
+        except Exception:
+            self.mmap.close()
+            raise
+        self.stride = row_bytes(self.n)
+        _, offset, length = self.layers['obstacles']
+        self.bits = memoryview(self.mmap)[offset:offset + length]
+        self.views = [self.bits]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        self.views = []
+        self.mmap.close()
+
+    def is_current(self, version, source=None):
+        # True when no obstacle changed since the map was written (version is
+        # the store's obstacle version) and source has not been rewritten.
+        if self.version != version:
+            return False
+        if source is None:
+            return True
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (self.source_size, self.source_mtime_ns)
+
+    def cost_layers(self):
+        return [name for name in self.layers if name != 'obstacles']
+
+    def layer(self, name):
+        typecode, offset, length = self.layers[name]
+        if name == 'obstacles':
+            return self.bits
+        view = memoryview(self.mmap)[offset:offset + length].cast(typecode)
+        self.views.append(view)
+        return view
+
+    def __contains__(self, cell):
+        x, y = cell[0], cell[1]
+        if not (0 <= x < self.n and 0 <= y < self.n):
+            return False
+        return bool(self.bits[x * self.stride + (y >> 3)] >> (y & 7) & 1)
+
+    def __iter__(self):
+        stride, bits = self.stride, self.bits
+        for x in range(self.n):
+            start = x * stride
+            for i, value in enumerate(bits[start:start + stride]):
+                if value:
+                    for bit in range(8):
+                        if value >> bit & 1:
+                            yield (x, i * 8 + bit)
+
+    def paint(self, path_finding):
+        # Unpacks the rows into path_finding's grid, a table lookup per byte
+        # and one slice assignment per row. Rows are copied, not merged, which
+        # is what a freshly built grid (all free inside the border) needs.
+        n = min(self.n, path_finding.n)
+        grid, stride, bits = path_finding.grid, self.stride, self.bits
+        empty = bytes(stride)
+        for x in range(n):
+            row = bits[x * stride:(x + 1) * stride]
+            if row != empty:
+                start = path_finding.index(x, 0)
+                grid[start:start + n] = b''.join(map(_UNPACK.__getitem__, row))[:n]
+
+if __name__ == "__main__":
+    # python MapFile.py [locations.json [locations.map]]: writes the binary map
+    # for a locations file, e.g. one that has not been snapshotted yet. It is
+    # stamped with the snapshot's obstacle version, so a store with journaled
+    # obstacle changes on top will not use it.
+    import json
+    from DataStore import SNAPSHOT_FILE, load_json
+    from Obstacles import ObstacleLayer
+    source = sys.argv[1] if len(sys.argv) > 1 else 'locations.json'
+    target = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(source)[0] + '.map'
+    with open(source) as file:
+        locations = json.load(file)
+    meta = load_json(os.path.join(os.path.dirname(source), SNAPSHOT_FILE), {"versions": {}})
+    write_map(target, locations['n'], ObstacleLayer(locations.get('obstacles', []), locations.get('obstacle_regions')),
+              version=meta.get('versions', {}).get('obstacles/', 0), source=source)
+    print(f"Wrote {target}")
@@ -0,0 +1,222 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Seconds; request latencies, store writes, planner phases.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Counts; node expansions, open set and heap sizes. Powers of 4 up to ~16.7M.
+SIZE_BUCKETS = tuple(4 ** i for i in range(13))
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Bucket i counts values <= buckets[i]; the last one is +Inf.
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    # Counters, gauges and histograms keyed by name and label values, rendered
+    # in the Prometheus text format by render(). Label values should come from
+    # small fixed sets (route rules, op names), never user input. Each process
+    # keeps its own registry, so with several web workers every worker is its
+    # own scrape target. collect(fn) registers a callback that render() runs
+    # first, for gauges that are cheaper to read on demand than to keep current.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.series = {}
+        self.collectors = []
+
+    def _get(self, name, kind, labels, buckets=None):
+        key = tuple(sorted((label, str(value)) for label, value in labels.items()))
+        series = self.series.get(name)
+        if series is None:
+            self.kinds[name] = kind
+            series = self.series[name] = {}
+        elif self.kinds[name] != kind:
+            raise ValueError(f"Metric {name} is a {self.kinds[name]}, not a {kind}")
+        if kind == 'histogram' and key not in series:
+            series[key] = Histogram(buckets)
+        return series, key
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series, key = self._get(name, 'counter', labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            series, key = self._get(name, 'gauge', labels)
+            series[key] = value
+
+    def set_total(self, name, value, **labels):
+        # Counter taken from a running total kept elsewhere, e.g. by a collector.
+        with self.lock:
+            series, key = self._get(name, 'counter', labels)
+            series[key] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        # buckets only matter the first time a series is seen.
+        with self.lock:
+            series, key = self._get(name, 'histogram', labels, buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        # Observes the block's wall time in seconds, whether or not it raises.
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def collect(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            collector(self)
+        lines = []
+        with self.lock:
+            for name in sorted(self.series):
+                kind = self.kinds[name]
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(self.series[name].items()):
+                    if kind != 'histogram':
+                        lines.append(f"{name}{_labels(key)} {_number(value)}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + ('+Inf',), value.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(key + (('le', _number(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(key)} {_number(value.sum)}")
+                    lines.append(f"{name}_count{_labels(key)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+def _labels(key):
+    if not key:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in key)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(key, escaped)) + "}"
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+# Innermost frames of threads that are blocked rather than working; their
+# samples are counted as idle instead of being attributed to a stack.
+IDLE_LEAVES = {('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'), ('selectors.py', 'select'),
+               ('socket.py', 'accept'), ('socket.py', 'readinto'), ('queue.py', 'get')}
+
+class Profiler:
+    # Sampling profiler that can be switched on and off in a running process.
+    # While running, a daemon thread reads every other thread's current stack
+    # (sys._current_frames) each `interval` seconds and counts the collapsed
+    # stack "file:function;file:function;...". Nothing runs while it is off,
+    # and the sampled threads are never interrupted, so the overhead is the
+    # sampler's own share of the GIL, roughly a stack walk per thread per sample.
+    def __init__(self, max_depth=64):
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = None
+        self.interval = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stacks = Counter()
+            self.samples = 0
+            self.idle = 0
+            self.started_at = None
+            self.elapsed = 0.0
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, interval=0.01):
+        with self.lock:
+            if self.thread is not None:
+                self.interval = interval
+                return
+            self.interval = interval
+            self.stop_event = threading.Event()
+            self.started_at = time.time()
+            self.thread = threading.Thread(target=self._run, args=(self.stop_event,), name='profiler', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+            if thread is None:
+                return
+            self.stop_event.set()
+            self.elapsed += time.time() - self.started_at
+            self.started_at = None
+        thread.join()
+
+    def _run(self, stop_event):
+        own = threading.get_ident()
+        while not stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = []
+            idle = 0
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                    idle += 1
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(stack)))
+            del frames
+            with self.lock:
+                self.stacks.update(stacks)
+                self.samples += len(stacks)
+                self.idle += idle
+
+    def collapsed(self):
+        # One "stack count" line per distinct stack, the input format of
+        # flamegraph.pl and speedscope.
+        with self.lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def to_json(self, limit=20):
+        # Hottest functions by samples where they were running (self) and
+        # where they were anywhere on the stack (total).
+        with self.lock:
+            stacks = list(self.stacks.items())
+            elapsed = self.elapsed + (time.time() - self.started_at if self.started_at else 0.0)
+            summary = {"running": self.running, "interval": self.interval, "seconds": elapsed,
+                       "samples": self.samples, "idle_samples": self.idle}
+        own, total = Counter(), Counter()
+        for stack, count in stacks:
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        summary["self"] = [{"function": name, "samples": count} for name, count in own.most_common(limit)]
+        summary["total"] = [{"function": name, "samples": count} for name, count in total.most_common(limit)]
+        return summary
+
+metrics = Metrics()
+profiler = Profiler()
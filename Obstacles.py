@@ -0,0 +1,173 @@
+import math
+
+REGION_BUCKET = 32
+
+def polygon_rects(points):
+    # Rasterises a polygon given as [[x, y], ...] cell coordinates into
+    # inclusive [x0, y0, x1, y1] rectangles: cells inside the polygon or on its
+    # edges, as one run of y per covered x, with equal runs on consecutive x
+    # merged into one rectangle.
+    points = [(float(x), float(y)) for x, y in points]
+    if not points:
+        return []
+    edges = list(zip(points, points[1:] + points[:1]))
+    columns = {}
+
+    def mark(x, y0, y1):
+        columns.setdefault(x, []).append((y0, y1))
+
+    for (ax, ay), (bx, by) in edges:
+        # Edge cells, stepping along both axes so steep edges stay connected.
+        if ax == bx:
+            if ax == int(ax):
+                mark(int(ax), math.ceil(min(ay, by)), math.floor(max(ay, by)))
+            continue
+        for x in range(math.ceil(min(ax, bx)), math.floor(max(ax, bx)) + 1):
+            y = round(ay + (x - ax) * (by - ay) / (bx - ax))
+            mark(x, y, y)
+        if ay != by:
+            for y in range(math.ceil(min(ay, by)), math.floor(max(ay, by)) + 1):
+                x = round(ax + (y - ay) * (bx - ax) / (by - ay))
+                mark(x, y, y)
+
+    min_x = math.ceil(min(x for x, _ in points))
+    max_x = math.floor(max(x for x, _ in points))
+    for x in range(min_x, max_x + 1):
+        # Interior: crossings of the column with the edges, half-open so a
+        # vertex shared by two edges is counted once.
+        crossings = sorted(ay + (x - ax) * (by - ay) / (bx - ax)
+                           for (ax, ay), (bx, by) in edges if min(ax, bx) <= x < max(ax, bx))
+        for y0, y1 in zip(crossings[0::2], crossings[1::2]):
+            if math.ceil(y0) <= math.floor(y1):
+                mark(x, math.ceil(y0), math.floor(y1))
+
+    rects = []
+    open_rects = {}
+    for x in sorted(columns):
+        runs = []
+        for y0, y1 in sorted(columns[x]):
+            if runs and y0 <= runs[-1][1] + 1:
+                runs[-1][1] = max(runs[-1][1], y1)
+            else:
+                runs.append([y0, y1])
+        current = {}
+        for y0, y1 in runs:
+            rect = open_rects.pop((y0, y1), None)
+            if rect is not None and rect[2] == x - 1:
+                rect[2] = x
+            else:
+                rect = [x, y0, x, y1]
+                rects.append(rect)
+            current[(y0, y1)] = rect
+        open_rects = current
+    return rects
+
+class ObstacleLayer:
+    # Blocked cells as a hashed set of single cells plus named regions of
+    # inclusive [x0, y0, x1, y1] rectangles (polygons are rasterised into
+    # rectangles by polygon_rects). Membership is a set lookup and a scan of
+    # the few rectangles bucketed around the cell; adding or removing a cell
+    # is O(1) and a region costs its number of rectangles, not its area.
+    def __init__(self, cells=(), regions=None):
+        self.cells = {(cell[0], cell[1]) for cell in cells}
+        self.regions = {}
+        self.buckets = {}
+        for name, rects in (regions or {}).items():
+            self.add_region(name, rects)
+
+    def copy(self):
+        return ObstacleLayer(self.cells, self.regions)
+
+    def add(self, cell):
+        self.cells.add((cell[0], cell[1]))
+
+    def discard(self, cell):
+        self.cells.discard((cell[0], cell[1]))
+
+    def _region_buckets(self, rect):
+        x0, y0, x1, y1 = rect
+        for bx in range(x0 // REGION_BUCKET, x1 // REGION_BUCKET + 1):
+            for by in range(y0 // REGION_BUCKET, y1 // REGION_BUCKET + 1):
+                yield (bx, by)
+
+    def add_region(self, name, rects):
+        # Replaces any region of the same name.
+        self.remove_region(name)
+        rects = [tuple(int(v) for v in rect) for rect in rects]
+        self.regions[name] = rects
+        for rect in rects:
+            for bucket in self._region_buckets(rect):
+                self.buckets.setdefault(bucket, {}).setdefault(name, []).append(rect)
+
+    def remove_region(self, name):
+        # Returns the removed region's rectangles ([] if there was none).
+        rects = self.regions.pop(name, [])
+        for rect in rects:
+            for bucket in self._region_buckets(rect):
+                names = self.buckets.get(bucket)
+                if names is not None and names.pop(name, None) is not None and not names:
+                    del self.buckets[bucket]
+        return rects
+
+    def __contains__(self, cell):
+        x, y = cell[0], cell[1]
+        if (x, y) in self.cells:
+            return True
+        for rects in self.buckets.get((x // REGION_BUCKET, y // REGION_BUCKET), {}).values():
+            for x0, y0, x1, y1 in rects:
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    return True
+        return False
+
+    def __iter__(self):
+        # Every blocked cell once.
+        yield from self.cells
+        seen = set()
+        for rects in self.regions.values():
+            for x0, y0, x1, y1 in rects:
+                for x in range(x0, x1 + 1):
+                    for y in range(y0, y1 + 1):
+                        if (x, y) not in self.cells and (x, y) not in seen:
+                            seen.add((x, y))
+                            yield (x, y)
+
+    def paint(self, path_finding):
+        # Marks every blocked cell inside path_finding's n x n map in its grid,
+        # a slice assignment per rectangle column.
+        n, grid = path_finding.n, path_finding.grid
+        for x, y in self.cells:
+            if 0 <= x < n and 0 <= y < n:
+                grid[path_finding.index(x, y)] = 1
+        for rects in self.regions.values():
+            for x0, y0, x1, y1 in rects:
+                x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, n - 1), min(y1, n - 1)
+                if x0 > x1 or y0 > y1:
+                    continue
+                run = b'\x01' * (y1 - y0 + 1)
+                for x in range(x0, x1 + 1):
+                    start = path_finding.index(x, y0)
+                    grid[start:start + len(run)] = run
+
+    def to_json(self):
+        # (cell list, regions) as stored in locations.json.
+        return [list(cell) for cell in sorted(self.cells)], {name: [list(rect) for rect in rects] for name, rects in self.regions.items()}
+
+def rect_cells(rects):
+    for x0, y0, x1, y1 in rects:
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                yield (x, y)
+
+def obstacle_changes(op, args, layer):
+    # (cells that became blocked, cells that became free) for a DataStore
+    # obstacle op, given the layer after it was applied; None for other ops.
+    # Cells still covered by another cell or region do not count as freed.
+    if op == 'add_obstacle':
+        return [tuple(args[0])], []
+    if op == 'remove_obstacle':
+        return [], [tuple(args[0])] if tuple(args[0]) not in layer else []
+    if op == 'add_obstacle_region':
+        return list(rect_cells(args[1])), []
+    if op == 'remove_obstacle_region':
+        return [], [cell for cell in rect_cells(args[1]) if cell not in layer]
+    return None
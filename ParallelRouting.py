@@ -0,0 +1,147 @@
+import multiprocessing
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from GridPathFinding import GridPathFinding
+
+# Per worker process: the shared grid (and cost array) of the router whose
+# tasks it ran last, and a private GridPathFinding over a copy of them.
+_worker = None
+
+def process_pool(workers):
+    # A pool of forked workers for ParallelRouters to share. The workers are
+    # started here, so a long-running threaded process (the web app) should
+    # call this before starting any thread: forking while another thread holds
+    # a lock can deadlock the child. fork, where available: spawn and
+    # forkserver would re-import the main module (e.g. the whole web app) in
+    # every worker. Workers only touch the grids.
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    # Workers share this process's shared memory tracker, which would
+    # otherwise start per worker and report every router's blocks as leaked.
+    resource_tracker.ensure_running()
+    pool = ProcessPoolExecutor(workers, mp_context=context)
+    pool.submit(int).result()
+    return pool
+
+def _detach():
+    for key in ('shm', 'costs_shm'):
+        if _worker[key] is not None:
+            _worker[key].close()
+
+def _path_finding(grid):
+    # grid is (name, n, costs name or None, min_cost) from the router.
+    # Attaches to a router's blocks the first time one of its tasks runs here
+    # and copies the shared grid (a few hundred KB) once, as a router's grid
+    # never changes; searching a private bytearray is faster than a memoryview.
+    global _worker
+    name, n, costs_name, min_cost = grid
+    if _worker is None or _worker['name'] != name:
+        if _worker is not None:
+            _detach()
+        path_finding = GridPathFinding(n, ())
+        shm = shared_memory.SharedMemory(name=name)
+        path_finding.grid[:] = shm.buf[:len(path_finding.grid)]
+        costs_shm = None
+        if costs_name:
+            costs_shm = shared_memory.SharedMemory(name=costs_name)
+            path_finding.set_costs(array('f', bytes(costs_shm.buf[:len(path_finding.grid) * 4])), min_cost)
+        _worker = {'name': name, 'shm': shm, 'costs_shm': costs_shm, 'path_finding': path_finding}
+    return _worker['path_finding']
+
+# Chunks return their results with the worker's search stats, which the
+# router adds to its own so take_stats() covers every process.
+
+def _multi_target_chunk(grid, searches, lengths=False):
+    path_finding = _path_finding(grid)
+    return [path_finding.multi_target(start, goals, lengths) for start, goals in searches], path_finding.take_stats()
+
+def _a_star_chunk(grid, pairs):
+    path_finding = _path_finding(grid)
+    return [path_finding.a_star(start, goal) for start, goal in pairs], path_finding.take_stats()
+
+class ParallelRouter:
+    # Runs GridPathFinding searches on a pool of worker processes. The grid is
+    # one shared memory block that workers attach to by name, so the map is
+    # never pickled; tasks only carry endpoints and the block names. The grid
+    # is fixed for the router's lifetime. Batches are cut into chunks in input
+    # order and the results reassembled in that order, so output does not
+    # depend on which worker finished first. Small batches run in-process.
+    # costs and min_cost are GridPathFinding's; the cost array goes to the
+    # workers through a second shared block, read once per worker.
+    #
+    # pool is a process_pool() to run on, which close() leaves running;
+    # without one the router starts and stops its own.
+    def __init__(self, n, obstacles, workers=None, chunks_per_worker=4, min_parallel=8, costs=None, min_cost=1.0,
+                 pool=None):
+        self.path_finding = GridPathFinding(n, obstacles, costs, min_cost)
+        self.n = n
+        self.workers = workers or os.cpu_count() or 1
+        self.chunks_per_worker = chunks_per_worker
+        self.min_parallel = min_parallel
+        size = len(self.path_finding.grid)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.shm.buf[:size] = self.path_finding.grid
+        self.costs_shm = None
+        if costs is not None:
+            costs = array('f', costs)
+            self.costs_shm = shared_memory.SharedMemory(create=True, size=len(costs) * costs.itemsize)
+            self.costs_shm.buf[:len(costs) * costs.itemsize] = costs.tobytes()
+        self.grid = (self.shm.name, n, self.costs_shm.name if self.costs_shm else None, min_cost)
+        self.own_pool = pool is None
+        self.pool = process_pool(self.workers) if pool is None and self.workers > 1 else pool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.own_pool and self.pool is not None:
+            self.pool.shutdown()
+        for shm in (self.shm, self.costs_shm):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    def passable(self, node):
+        return self.path_finding.passable(node)
+
+    def take_stats(self):
+        return self.path_finding.take_stats()
+
+    def a_star(self, start, goal):
+        return self.path_finding.a_star(start, goal)
+
+    def multi_target(self, start, goals, lengths=False):
+        return self.path_finding.multi_target(start, goals, lengths)
+
+    def _map(self, chunk_work, items, local_work, progress, *args):
+        # args are passed on to chunk_work and local_work after the items.
+        if self.pool is None or self.workers == 1 or len(items) < self.min_parallel:
+            return local_work(items, progress, *args)
+        chunk_size = max(1, -(-len(items) // (self.workers * self.chunks_per_worker)))
+        futures = [self.pool.submit(chunk_work, self.grid, items[i:i + chunk_size], *args)
+                   for i in range(0, len(items), chunk_size)]
+        results = []
+        for future in futures:
+            chunk, stats = future.result()
+            results.extend(chunk)
+            self.path_finding.add_stats(*stats)
+            if progress:
+                progress(len(results), len(items))
+        return results
+
+    def multi_target_many(self, searches, progress=None, lengths=False):
+        return self._map(_multi_target_chunk, list(searches), self.path_finding.multi_target_many, progress, lengths)
+
+    def a_star_many(self, pairs, progress=None):
+        def local(pairs, progress):
+            paths = []
+            for start, goal in pairs:
+                paths.append(self.path_finding.a_star(start, goal))
+                if progress:
+                    progress(len(paths), len(pairs))
+            return paths
+        return self._map(_a_star_chunk, list(pairs), local, progress)
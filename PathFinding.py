@@ -2,38 +2,85 @@ import heapq
 import math
 import time
 import json
+import os
+import uuid
 from collections import defaultdict
+from datetime import datetime
+from DataStore import get_store
+from Allocation import Allocation
+from CostLayers import array_cost, path_minutes
+from GridPathFinding import GridPathFinding, path_cost
+from JumpPointSearch import JumpPointSearch
+from MapFile import MapFile
+from Metrics import metrics, SIZE_BUCKETS
+from Obstacles import ObstacleLayer
+from ParallelRouting import ParallelRouter
+from RouteCache import get_route_cache
+from VehicleRouting import TIME_BUDGET, VEHICLE_CAPACITY, get_distance_cache, plan_tours
 
 class PathFinding:
-    def __init__(self, n, obstacles):
+    # algorithm="jps" answers a_star() with Jump Point Search instead of
+    # expanding every cell; paths have the same length, and no graph is built.
+    # obstacles is an ObstacleLayer, a MapFile or a list of [x, y] cells.
+    # costs and min_cost weight the moves as in GridPathFinding.set_costs.
+    def __init__(self, n, obstacles, algorithm="a_star", costs=None, min_cost=1.0):
+        if algorithm not in ("a_star", "jps"):
+            raise ValueError(f"Unknown path finding algorithm: {algorithm}")
+        if algorithm == "jps" and costs is not None:
+            raise ValueError("Jump Point Search needs uniform move costs")
         self.n = n
-        self.obstacles = obstacles
-        self.graph = self.build_graph()
+        self.width = n + 2
+        self.obstacles = obstacles if isinstance(obstacles, (ObstacleLayer, MapFile)) else ObstacleLayer(obstacles)
+        self.algorithm = algorithm
+        self.costs = costs
+        self.min_cost = min_cost
+        self.expanded = 0
+        if algorithm == "jps":
+            self.graph = None
+            self.jps = JumpPointSearch(n, self.obstacles)
+        else:
+            self.graph = self.build_graph()
 
     def build_graph(self):
+        # Edge weights are the move length, times the mean of the two cells'
+        # costs when there are costs; closed cells (cost inf) get no edges.
         graph = {}
         directions = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+        cost = array_cost(self.costs, self.width) if self.costs is not None else None
         for i in range(self.n):
             for j in range(self.n):
-                if (i, j) in self.obstacles:
+                if (i, j) in self.obstacles or (cost and cost(i, j) == math.inf):
                     continue
                 graph[(i, j)] = []
                 for di, dj in directions:
                     ni, nj = i + di, j + dj
                     if 0 <= ni < self.n and 0 <= nj < self.n and (ni, nj) not in self.obstacles:
-                        graph[(i, j)].append(((ni, nj), math.sqrt(di**2 + dj**2)))
+                        weight = math.sqrt(di**2 + dj**2)
+                        if cost:
+                            if cost(ni, nj) == math.inf:
+                                continue
+                            weight *= (cost(i, j) + cost(ni, nj)) * 0.5
+                        graph[(i, j)].append(((ni, nj), weight))
         return graph
 
     def a_star(self, start, goal):
+        if self.algorithm == "jps":
+            path = self.jps.a_star(tuple(start), tuple(goal))
+            self.expanded = self.jps.expanded
+            return path
+
         def heuristic(a, b):
-            return math.sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2)
+            return math.sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) * self.min_cost
 
+        if start not in self.graph or goal not in self.graph:
+            return []
         open_set = [(0, start)]
         g_score = {node: float('inf') for node in self.graph}
         g_score[start] = 0
         f_score = {node: float('inf') for node in self.graph}
         f_score[start] = heuristic(start, goal)
         previous_nodes = {node: None for node in self.graph}
+        self.expanded = 0
 
         while open_set:
             _, current = heapq.heappop(open_set)
@@ -45,6 +92,7 @@ class PathFinding:
                     current = previous_nodes[current]
                 path.append(start)
                 return path[::-1]
+            self.expanded += 1
 
             for neighbor, weight in self.graph[current]:
                 tentative_g_score = g_score[current] + weight
@@ -70,124 +118,350 @@ class Receiver:
         self.y = y
         self.needs = needs  # Dictionary of resource names to quantities
 
-def load_data(locations_file, resources_file):
-    with open(locations_file, 'r') as file:
-        locations = json.load(file)
-    with open(resources_file, 'r') as file:
-        resources = json.load(file)
-    return locations, resources
-
-def save_resources(resources_file, resources):
-    with open(resources_file, 'w') as file:
-        json.dump(resources, file, indent=4)
-
 def save_deliveries(deliveries_file, deliveries):
     with open(deliveries_file, 'w') as file:
         json.dump(deliveries, file, indent=4)
 
-def match_senders_receivers(senders, receivers):
-    resource_senders = defaultdict(list)
-    resource_receivers = defaultdict(list)
-
-    # Create priority queues for each resource type
-    for sender in senders:
-        for resource, quantity in sender.resources.items():
-            heapq.heappush(resource_senders[resource], (-quantity, sender))
-
-    for receiver in receivers:
-        for resource, quantity in receiver.needs.items():
-            heapq.heappush(resource_receivers[resource], (-quantity, receiver))
-
-    matches = []
-    for resource in resource_receivers:
-        while resource_receivers[resource]:
-            needed_quantity, receiver = heapq.heappop(resource_receivers[resource])
-            needed_quantity = -needed_quantity
-
-            if resource not in resource_senders or not resource_senders[resource]:
-                print(f"Receiver {receiver.name} cannot get {resource}")
-                continue
-
-            available_quantity, sender = heapq.heappop(resource_senders[resource])
-            available_quantity = -available_quantity
-
-            if available_quantity >= needed_quantity:
-                matches.append((sender, receiver, {resource: needed_quantity}))
-                sender.resources[resource] -= needed_quantity
-                receiver.needs[resource] -= needed_quantity
-
-                if receiver.needs[resource] == 0:
-                    del receiver.needs[resource]
-
-                if sender.resources[resource] > 0:
-                    heapq.heappush(resource_senders[resource], (-sender.resources[resource], sender))
-            else:
-                print(f"Receiver {receiver.name} cannot get enough {resource}")
-                receiver.needs[resource] -= available_quantity
-                matches.append((sender, receiver, {resource: available_quantity}))
-                sender.resources[resource] = 0
-
+def match_senders_receivers(senders, receivers, costs=None, method="auto", max_distance=None, stats=None):
+    # Allocates each resource type with Allocation (min-cost flow, or greedy for
+    # very large instances). costs prices (sender xy, receiver xy) pairs, e.g.
+    # route_costs(path_finding); octile distance by default. max_distance drops
+    # pairs further apart than that before any of them is priced. Needs that
+    # cannot be met are left in receiver.needs. stats, if given, is updated
+    # with Allocation.stats.
+    allocation = Allocation(costs, method, max_distance=max_distance)
+    matches = allocation.allocate(senders, receivers)
+    if stats is not None:
+        stats.update(allocation.stats)
     return matches
 
-if __name__ == "__main__":
-    locations_file = 'locations.json'
-    resources_file = 'resources.json'
-    deliveries_file = 'deliveries.json'
-
-    locations, resources = load_data(locations_file, resources_file)
-
-    n = locations['n']
-    obstacles = locations['obstacles']
-    senders_data = locations['senders']
-    receivers_data = locations['receivers']
-
-    senders = [Sender(s['name'], s['x'], s['y'], next(item['resources'] for item in resources['senders'] if item['name'] == s['name'])) for s in senders_data]
-    receivers = [Receiver(r['name'], r['x'], r['y'], next(item['needs'] for item in resources['receivers'] if item['name'] == r['name'])) for r in receivers_data]
-
-    path_finding = PathFinding(n, obstacles)
-
-    # Ensure senders and receivers are not on obstacle locations
-    for sender in senders:
-        assert (sender.x, sender.y) not in obstacles, f"Sender at {(sender.x, sender.y)} is in obstacles"
-    for receiver in receivers:
-        assert (receiver.x, receiver.y) not in obstacles, f"Receiver at {(receiver.x, receiver.y)} is in obstacles"
-
-    # Timing the matching algorithm
+def grid_costs(path_finding):
+    # (costs, width) of the grid a GridPathFinding, ParallelRouter,
+    # JumpPointSearch or PathFinding searches; costs is None when uniform.
+    grid = getattr(path_finding, 'path_finding', path_finding)
+    return getattr(grid, 'costs', None), grid.width
+
+def route_costs(path_finding, cache=None):
+    # Pair pricing for match_senders_receivers from routed path costs (the
+    # weighted cost when path_finding has cost layers); unreachable pairs
+    # cost math.inf.
+    costs, width = grid_costs(path_finding)
+
+    def price(pairs):
+        return [path_cost(path, costs, width) if path else math.inf for path in route_pairs(path_finding, pairs, cache)]
+    return price
+
+def route_pairs(path_finding, pairs, cache=None, progress=None):
+    # Route every (start, goal) pair with one multi-target search per distinct
+    # endpoint on the smaller side instead of one A* per pair. Moves are
+    # symmetric, so paths searched from goals are reversed.
+    # Routes found in cache are reused and new ones are added to it.
+    # path_finding may be a ParallelRouter to spread the searches over
+    # processes. progress(done, total) is called as searches finish.
+    cached = {}
+    if cache is not None:
+        for pair in pairs:
+            if pair not in cached:
+                path = cache.get(*pair)
+                if path is not None:
+                    cached[pair] = path
+    uncached = [pair for pair in pairs if pair not in cached]
+
+    starts = {start for start, _ in uncached}
+    goals = {goal for _, goal in uncached}
+    from_starts = len(starts) <= len(goals)
+
+    targets = defaultdict(set)
+    for start, goal in uncached:
+        if from_starts:
+            targets[start].add(goal)
+        else:
+            targets[goal].add(start)
+
+    searches = [(source, sorted(ends)) for source, ends in targets.items()]
+    fields = dict(zip(targets, path_finding.multi_target_many(searches, progress)))
+
+    paths = []
+    for start, goal in pairs:
+        if (start, goal) in cached:
+            paths.append(cached[(start, goal)])
+            continue
+        if from_starts:
+            path = fields[start][goal]
+        else:
+            path = fields[goal][start][::-1]
+        if cache is not None:
+            cache.put(start, goal, path)
+            cached[(start, goal)] = path
+        paths.append(path)
+    return paths
+
+def plan(store=None, deliveries_file='deliveries.json', path_finding=None, cache=None, progress=None, workers=1,
+         departure=None, capacity=VEHICLE_CAPACITY, time_budget=TIME_BUDGET, pool=None):
+    # One matching and routing run over the store's current state. Matched
+    # quantities are subtracted from the store and the new deliveries appended
+    # to deliveries_file. progress(stage, done, total) reports each stage.
+    # With workers > 1 (and no path_finding given) searches run on a
+    # ParallelRouter for the duration of the run, on pool (a long-lived
+    # ParallelRouting.process_pool) if given. Routes are priced with the
+    # store's cost layers as they are at departure (epoch seconds, default
+    # now); a path_finding passed in is used with its own costs. While a
+    # windowed cost region is open, routes bypass the route cache, whose
+    # routes hold for the costs without windows. Each sender's matches are
+    # delivered on tours of vehicles carrying capacity units, planned within
+    # time_budget seconds (see VehicleRouting); with capacity None every match
+    # is its own trip. Returns a summary of the run; "planned" holds the
+    # deliveries it appended.
+    def report(stage, done=None, total=None):
+        if progress:
+            progress(stage, done, total)
+
+    report("loading")
+    loading_started = time.perf_counter()
+    departure = time.time() if departure is None else departure
+    store = store or get_store()
+    store.refresh()
+    with store.lock:
+        locations = json.loads(json.dumps(store.locations))
+        # The binary map from the last snapshot, when no obstacle changed since,
+        # is read straight from the page cache instead of copying the layer.
+        map_file = store.current_map()
+        obstacles = map_file or store.obstacles.copy()
+        resources = {entity_type: {e['name']: e for e in json.loads(json.dumps(store.resources[entity_type]))}
+                     for entity_type in ('senders', 'receivers')}
+        costs, min_cost = store.costs.at(departure)
+        windowed = bool(store.costs.windows(departure))
+    metrics.inc('planner_obstacle_loads_total', source='map' if map_file else 'layer')
+
+    senders = [Sender(s['name'], s['x'], s['y'], resources['senders'][s['name']]['resources'])
+               for s in locations['senders'] if s['name'] in resources['senders']]
+    receivers = [Receiver(r['name'], r['x'], r['y'], resources['receivers'][r['name']]['needs'])
+                 for r in locations['receivers'] if r['name'] in resources['receivers']]
+
+    # Users on an obstacle, a closed cell or off the map can't be reached;
+    # they sit this run out and the summary lists them under "blocked".
+    n, width = locations['n'], locations['n'] + 2
+
+    def reachable(person):
+        x, y = person.x, person.y
+        if not (0 <= x < n and 0 <= y < n) or (x, y) in obstacles:
+            return False
+        return costs is None or costs[(x + 1) * width + y + 1] != math.inf
+    blocked = {"senders": [s.name for s in senders if not reachable(s)],
+               "receivers": [r for r in receivers if not reachable(r)]}
+    senders = [s for s in senders if reachable(s)]
+    receivers = [r for r in receivers if reachable(r)]
+
+    if windowed and path_finding is None:
+        cache = distances = None
+    else:
+        cache = cache if cache is not None else get_route_cache()
+        distances = get_distance_cache(store)
+    options = (capacity, time_budget, distances)
+    try:
+        if path_finding is None and workers > 1:
+            with ParallelRouter(locations['n'], obstacles, workers, costs=costs, min_cost=min_cost, pool=pool) as router:
+                metrics.observe('planner_phase_seconds', time.perf_counter() - loading_started, phase='loading')
+                return _plan(store, senders, receivers, blocked, router, cache, deliveries_file, report, departure, *options)
+        path_finding = path_finding or GridPathFinding(locations['n'], obstacles, costs, min_cost)
+        metrics.observe('planner_phase_seconds', time.perf_counter() - loading_started, phase='loading')
+        return _plan(store, senders, receivers, blocked, path_finding, cache, deliveries_file, report, departure, *options)
+    finally:
+        if map_file:
+            map_file.close()
+
+def record_searches(path_finding, phase):
+    # Search counts from path_finding.take_stats() (GridPathFinding or
+    # ParallelRouter) as planner metrics for one phase.
+    if not hasattr(path_finding, 'take_stats'):
+        return
+    searches, expanded, peak = path_finding.take_stats()
+    metrics.inc('planner_searches_total', searches, phase=phase)
+    metrics.inc('planner_expanded_nodes_total', expanded, phase=phase)
+    if searches:
+        metrics.observe('planner_expanded_nodes', expanded, SIZE_BUCKETS, phase=phase)
+        metrics.observe('planner_open_set_peak', peak, SIZE_BUCKETS, phase=phase)
+
+def _plan(store, senders, receivers, blocked, path_finding, cache, deliveries_file, report, departure, capacity,
+          time_budget, distances):
+    report("matching")
+    if hasattr(path_finding, 'take_stats'):
+        # Searches made before this run (a path_finding passed in) don't count.
+        path_finding.take_stats()
     start_time = time.time()
-    matches = match_senders_receivers(senders, receivers)
-    end_time = time.time()
-    print(f"Matching algorithm time: {end_time - start_time} seconds")
-
+    allocation = {}
+    matches = match_senders_receivers(senders, receivers, costs=route_costs(path_finding, cache), stats=allocation)
+    matching_time = time.time() - start_time
+    unmet = [r.name for r in receivers + blocked['receivers'] if any(quantity > 0 for quantity in r.needs.values())]
+    metrics.observe('planner_phase_seconds', matching_time, phase='matching')
+    record_searches(path_finding, 'matching')
+    metrics.inc('allocation_edges_total', allocation['edges'])
+    metrics.inc('allocation_searches_total', allocation['searches'])
+    metrics.inc('allocation_settled_nodes_total', allocation['settled'])
+    metrics.observe('allocation_heap_peak', allocation['peak_heap'], SIZE_BUCKETS)
+
+    if capacity is None:
+        summary = _direct_trips(store, matches, unmet, path_finding, cache, deliveries_file, report, departure,
+                                matching_time)
+    else:
+        summary = _tours(store, matches, unmet, path_finding, cache, distances, deliveries_file, report, departure,
+                         matching_time, capacity, time_budget)
+    summary["blocked"] = {"senders": blocked['senders'], "receivers": [r.name for r in blocked['receivers']]}
+    return summary
+
+def _route(path_finding, cache, pairs, report):
+    # Routes pairs for the routing stage; returns (paths, seconds, cached routes).
+    report("routing", 0, None)
+    start_time = time.time()
+    hits = cache.hits if cache else 0
+    paths = route_pairs(path_finding, pairs, cache, progress=lambda done, total: report("routing", done, total))
+    routing_time = time.time() - start_time
+    cached_routes = cache.hits - hits if cache else 0
+    if cache:
+        cache.save()
+    metrics.observe('planner_phase_seconds', routing_time, phase='routing')
+    record_searches(path_finding, 'routing')
+    metrics.inc('planner_cached_routes_total', cached_routes)
+    return paths, routing_time, cached_routes
+
+def _delivery(sender, receiver, resource, quantity, minutes, distance, departure, **extra):
+    # One deliveries.json entry. time is travel minutes over the cost layers
+    # from departure, distance the plain path length; both None if unreachable.
+    eta = datetime.utcfromtimestamp(departure + minutes * 60).isoformat() if minutes is not None else None
+    return {
+        'sender': sender,
+        'receiver': receiver,
+        'time': minutes,
+        'distance': distance,
+        'departure': datetime.utcfromtimestamp(departure).isoformat(),
+        'eta': eta,
+        'resource': resource,
+        'quantity': quantity,
+        **extra
+    }
+
+def _save(store, deliveries, used, deliveries_file, saving_started):
+    # Earlier runs' deliveries stay: their quantities are already gone from the store.
+    try:
+        with open(deliveries_file) as file:
+            saved = json.load(file)
+    except (OSError, ValueError):
+        saved = []
+    save_deliveries(deliveries_file, saved + deliveries)
+    store.consume_resources(used)
+    metrics.observe('planner_phase_seconds', time.perf_counter() - saving_started, phase='saving')
+    metrics.inc('planner_deliveries_total', len(deliveries))
+    metrics.inc('planner_runs_total')
+
+def _direct_trips(store, matches, unmet, path_finding, cache, deliveries_file, report, departure, matching_time):
+    # One trip per match, straight from the sender to the receiver.
+    paths, routing_time, cached_routes = _route(path_finding, cache, [((s.x, s.y), (r.x, r.y)) for s, r, _ in matches],
+                                                report)
+
+    report("saving")
+    saving_started = time.perf_counter()
     deliveries = []
-
-    for sender, receiver, matched_resources in matches:
-        print(f"Matched resources from {sender.name} to {receiver.name}: {matched_resources}")
-        start = (sender.x, sender.y)
-        goal = (receiver.x, receiver.y)
-        
-        # Timing A* algorithm
-        start_time = time.time()
-        a_star_path = path_finding.a_star(start, goal)
-        end_time = time.time()
-        delivery_time = len(a_star_path)
-        print(f"A* path from {sender.name} to {receiver.name}: {a_star_path}")
-        print(f"A* algorithm time: {end_time - start_time} seconds")
-
+    used = []
+    costs, width = grid_costs(path_finding)
+    cost = array_cost(costs, width) if costs is not None else None
+    for (sender, receiver, matched_resources), a_star_path in zip(matches, paths):
+        minutes = path_minutes(a_star_path, cost) if a_star_path else None
+        distance = path_cost(a_star_path) if a_star_path else None
         for resource, quantity in matched_resources.items():
-            deliveries.append({
-                'sender': sender.name,
-                'receiver': receiver.name,
-                'time': delivery_time,
-                'resource': resource,
-                'quantity': quantity
-            })
-
-    # Save deliveries to the database
-    save_deliveries(deliveries_file, deliveries)
-
-    # Update resources in the database
-    updated_senders = [{'name': s.name, 'resources': s.resources} for s in senders]
-    updated_receivers = [{'name': r.name, 'needs': r.needs} for r in receivers]
-    resources['senders'] = updated_senders
-    resources['receivers'] = updated_receivers
-    save_resources(resources_file, resources)
\ No newline at end of file
+            deliveries.append(_delivery(sender.name, receiver.name, resource, quantity, minutes, distance, departure))
+            used.append(('senders', sender.name, resource, quantity))
+            used.append(('receivers', receiver.name, resource, quantity))
+    _save(store, deliveries, used, deliveries_file, saving_started)
+
+    return {
+        "matches": [{"sender": s.name, "receiver": r.name, "resources": m, "path": p} for (s, r, m), p in zip(matches, paths)],
+        "deliveries": len(deliveries),
+        "planned": deliveries,
+        "unmet": unmet,
+        "matching_time": matching_time,
+        "routing_time": routing_time,
+        "cached_routes": cached_routes,
+    }
+
+def _tours(store, matches, unmet, path_finding, cache, distances, deliveries_file, report, departure, matching_time,
+           capacity, time_budget):
+    # Consolidates each sender's matches into capacitated multi-stop tours
+    # (VehicleRouting.plan_tours), then routes every leg. A stop's time, eta
+    # and distance are counted from departure along its tour.
+    report("tours", 0, None)
+    start_time = time.time()
+    tours = plan_tours(path_finding, matches, capacity, time_budget, distances,
+                       progress=lambda done, total: report("tours", done, total))
+    tours_time = time.time() - start_time
+    metrics.observe('planner_phase_seconds', tours_time, phase='tours')
+    record_searches(path_finding, 'tours')
+    metrics.inc('planner_tours_total', len(tours))
+    for tour in tours:
+        metrics.observe('planner_tour_stops', len(tour.stops), SIZE_BUCKETS)
+
+    legs = []
+    for tour in tours:
+        cells = [(tour.sender.x, tour.sender.y)] + [(stop.x, stop.y) for stop in tour.stops] + [(tour.sender.x, tour.sender.y)]
+        legs.extend(zip(cells, cells[1:]))
+    paths, routing_time, cached_routes = _route(path_finding, cache, legs, report)
+
+    report("saving")
+    saving_started = time.perf_counter()
+    deliveries = []
+    used = []
+    summaries = []
+    costs, width = grid_costs(path_finding)
+    cost = array_cost(costs, width) if costs is not None else None
+    paths = iter(paths)
+    for tour in tours:
+        tour_id = str(uuid.uuid4())
+        minutes = distance = 0.0
+        route = [(tour.sender.x, tour.sender.y)]
+        visits = []
+        for number, stop in enumerate(tour.stops + [None], 1):
+            leg = next(paths)
+            if minutes is not None and leg:
+                minutes += path_minutes(leg, cost)
+                distance += path_cost(leg)
+                route.extend(leg[1:])
+            else:
+                minutes = distance = None
+            if stop is None:
+                break
+            visits.append({"receiver": stop.receiver, "resources": stop.load, "time": minutes})
+            for resource, quantity in stop.load.items():
+                deliveries.append(_delivery(tour.sender.name, stop.receiver, resource, quantity, minutes, distance,
+                                            departure, tour=tour_id, stop=number))
+                used.append(('senders', tour.sender.name, resource, quantity))
+                used.append(('receivers', stop.receiver, resource, quantity))
+        summaries.append({"id": tour_id, "sender": tour.sender.name, "load": tour.load, "stops": visits,
+                          "time": minutes, "distance": distance, "path": route if minutes is not None else []})
+    _save(store, deliveries, used, deliveries_file, saving_started)
+
+    return {
+        "matches": [{"sender": s.name, "receiver": r.name, "resources": m} for s, r, m in matches],
+        "tours": summaries,
+        "deliveries": len(deliveries),
+        "planned": deliveries,
+        "unmet": unmet,
+        "matching_time": matching_time,
+        "tours_time": tours_time,
+        "routing_time": routing_time,
+        "cached_routes": cached_routes,
+    }
+
+if __name__ == "__main__":
+    summary = plan(workers=os.cpu_count() or 1)
+    print(f"Matching algorithm time: {summary['matching_time']} seconds")
+    if summary['unmet']:
+        print(f"{len(summary['unmet'])} receivers have unmet needs: {', '.join(summary['unmet'])}")
+    for role, names in summary['blocked'].items():
+        if names:
+            print(f"{len(names)} {role} are unreachable (blocked cells): {', '.join(names)}")
+    print(f"Tour planning time for {len(summary['tours'])} tours: {summary['tours_time']} seconds")
+    print(f"Routing time for {len(summary['matches'])} matches: {summary['routing_time']} seconds ({summary['cached_routes']} cached)")
+    for match in summary['matches']:
+        print(f"Matched resources from {match['sender']} to {match['receiver']}: {match['resources']}")
+    for tour in summary['tours']:
+        stops = ", ".join(f"{stop['receiver']} {stop['resources']}" for stop in tour['stops'])
+        print(f"Tour from {tour['sender']} carrying {tour['load']} in {tour['time']} minutes: {stops}")
@@ -0,0 +1,172 @@
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from DataStore import get_store
+from GridPathFinding import SQRT2, path_cost
+from Journal import atomic_write
+
+ROUTE_CACHE_FILE = 'route_cache.json'
+
+def octile(a, b):
+    dx = abs(a[0] - b[0])
+    dy = abs(a[1] - b[1])
+    return dx + dy + (SQRT2 - 2) * min(dx, dy)
+
+class CachedRoute:
+    __slots__ = ('path', 'cost', 'bbox')
+
+    def __init__(self, path):
+        self.path = path
+        self.cost = path_cost(path) if path else math.inf
+        if path:
+            xs = [x for x, _ in path]
+            ys = [y for _, y in path]
+            self.bbox = (min(xs), min(ys), max(xs), max(ys))
+        else:
+            self.bbox = None
+
+class RouteCache:
+    # LRU cache of routes keyed by (start, goal), valid for one version of the
+    # obstacle set. When obstacles change, only routes the change can affect are
+    # dropped and the rest are carried over to the new version:
+    #   added cell   -> routes whose bounding box contains it and that pass through it
+    #   removed cell -> routes that a detour through that cell could shorten
+    #                   (octile(start, c) + octile(c, goal) < cost), and unreachable ones
+    # Routes are also valid for one version of the cost layers (without their
+    # windows); a cost change clears the cache, and so does a removal while the
+    # costs are not uniform, since the octile bounds assume unit costs.
+    def __init__(self, file_path=ROUTE_CACHE_FILE, capacity=10000, obstacle_version=0, costs_version=0):
+        self.file_path = file_path
+        self.capacity = capacity
+        self.version = obstacle_version
+        self.costs_version = costs_version
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, 'r') as file:
+            data = json.load(file)
+        if data.get('version') != self.version or data.get('costs_version', 0) != self.costs_version:
+            return
+        for sx, sy, gx, gy, path in data['routes'][-self.capacity:]:
+            self.entries[((sx, sy), (gx, gy))] = CachedRoute([tuple(cell) for cell in path])
+
+    def save(self):
+        with self.lock:
+            routes = [[start[0], start[1], goal[0], goal[1], entry.path] for (start, goal), entry in self.entries.items()]
+            data = {"version": self.version, "costs_version": self.costs_version, "routes": routes}
+        atomic_write(self.file_path, json.dumps(data, separators=(',', ':')))
+
+    def get(self, start, goal):
+        key = (tuple(start), tuple(goal))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.path
+
+    def put(self, start, goal, path):
+        key = (tuple(start), tuple(goal))
+        with self.lock:
+            self.entries[key] = CachedRoute(path)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def obstacles_changed(self, added, removed, version):
+        added = [tuple(cell) for cell in added]
+        removed = [tuple(cell) for cell in removed]
+        with self.lock:
+            stale = []
+            for key, entry in self.entries.items():
+                start, goal = key
+                if entry.bbox is not None:
+                    min_x, min_y, max_x, max_y = entry.bbox
+                    hit = [c for c in added if min_x <= c[0] <= max_x and min_y <= c[1] <= max_y]
+                    if hit and any(c in entry.path for c in hit):
+                        stale.append(key)
+                        continue
+                if any(octile(start, c) + octile(c, goal) < entry.cost for c in removed):
+                    stale.append(key)
+            for key in stale:
+                del self.entries[key]
+            self.version = version
+
+    def regions_changed(self, added, removed, version):
+        # Rectangle version of obstacles_changed. A path that got shorter by
+        # going through a freed rectangle stays within its cost's slack of the
+        # start-goal box: every cell outside that box by t adds at least
+        # 2 * (sqrt(2) - 1) * t to the octile bound.
+        with self.lock:
+            stale = []
+            for key, entry in self.entries.items():
+                start, goal = key
+                if entry.bbox is not None:
+                    min_x, min_y, max_x, max_y = entry.bbox
+                    hit = [r for r in added if r[0] <= max_x and min_x <= r[2] and r[1] <= max_y and min_y <= r[3]]
+                    if hit and any(x0 <= x <= x1 and y0 <= y <= y1 for x, y in entry.path for x0, y0, x1, y1 in hit):
+                        stale.append(key)
+                        continue
+                if removed and entry.cost != math.inf:
+                    margin = (entry.cost - octile(start, goal)) / (2 * (SQRT2 - 1))
+                    min_x, max_x = min(start[0], goal[0]) - margin, max(start[0], goal[0]) + margin
+                    min_y, max_y = min(start[1], goal[1]) - margin, max(start[1], goal[1]) + margin
+                    if any(r[0] <= max_x and min_x <= r[2] and r[1] <= max_y and min_y <= r[3] for r in removed):
+                        stale.append(key)
+                elif removed:
+                    stale.append(key)
+            for key in stale:
+                del self.entries[key]
+            self.version = version
+
+    def clear(self, version, costs_version=None):
+        with self.lock:
+            self.entries.clear()
+            self.version = version
+            if costs_version is not None:
+                self.costs_version = costs_version
+
+    def attach(self, store):
+        def listener(op, args):
+            version = store.versions.get('obstacles/')
+            costs_version = store.versions.get('costs/')
+            if op in ('set_cost_region', 'remove_cost_region') or \
+                    op == 'reload' and (version, costs_version) != (self.version, self.costs_version):
+                self.clear(version, costs_version)
+            elif op == 'add_obstacle':
+                self.obstacles_changed([args[0]], [], version)
+            elif op == 'add_obstacle_region':
+                self.regions_changed(args[1], [], version)
+            elif op in ('remove_obstacle', 'remove_obstacle_region') and store.costs.base is not None:
+                self.clear(version)
+            elif op == 'remove_obstacle':
+                self.obstacles_changed([], [args[0]], version)
+            elif op == 'remove_obstacle_region':
+                self.regions_changed([], args[1], version)
+        store.subscribe(listener)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_route_cache(file_path=ROUTE_CACHE_FILE, store=None, capacity=10000):
+    # One cache per file, tracking the obstacle and cost versions of the given store.
+    store = store or get_store()
+    store.refresh()
+    key = os.path.abspath(file_path)
+    with _caches_lock:
+        if key not in _caches:
+            with store.lock:
+                cache = RouteCache(file_path, capacity, store.versions.get('obstacles/'), store.versions.get('costs/'))
+                cache.attach(store)
+            _caches[key] = cache
+        return _caches[key]
@@ -0,0 +1,112 @@
+import heapq
+import math
+
+SQRT2 = math.sqrt(2)
+
+def octile(ax, ay, bx, by):
+    # Length of the shortest 8-connected path on an empty grid, so never more
+    # than the routed distance.
+    dx = abs(ax - bx)
+    dy = abs(ay - by)
+    return dx + dy + (SQRT2 - 2) * min(dx, dy)
+
+class SpatialIndex:
+    # Points bucketed on a uniform grid of bucket x bucket cells, for k-nearest
+    # and radius queries by octile distance. add/move/remove touch one bucket,
+    # so the index can follow location edits one at a time.
+    def __init__(self, bucket=16):
+        self.bucket = bucket
+        self.points = {}
+        self.buckets = {}
+        self.bounds = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, key):
+        return key in self.points
+
+    def _cell(self, x, y):
+        return (int(x // self.bucket), int(y // self.bucket))
+
+    def add(self, key, x, y):
+        # Adds key at (x, y), or moves it there.
+        if key in self.points:
+            self.remove(key)
+        cell = self._cell(x, y)
+        self.points[key] = (x, y)
+        self.buckets.setdefault(cell, set()).add(key)
+        if self.bounds is None:
+            self.bounds = [cell[0], cell[1], cell[0], cell[1]]
+        else:
+            # Grow-only; bounds only cap how far a ring search looks.
+            self.bounds = [min(self.bounds[0], cell[0]), min(self.bounds[1], cell[1]),
+                           max(self.bounds[2], cell[0]), max(self.bounds[3], cell[1])]
+
+    def remove(self, key):
+        point = self.points.pop(key, None)
+        if point is None:
+            return
+        cell = self._cell(*point)
+        keys = self.buckets[cell]
+        keys.discard(key)
+        if not keys:
+            del self.buckets[cell]
+        if not self.points:
+            self.bounds = None
+
+    def get(self, key):
+        return self.points.get(key)
+
+    def _ring(self, cx, cy, ring):
+        for bx in range(cx - ring, cx + ring + 1):
+            for by in (range(cy - ring, cy + ring + 1) if bx in (cx - ring, cx + ring) else (cy - ring, cy + ring)):
+                yield from self.buckets.get((bx, by), ())
+
+    def _max_ring(self, cx, cy):
+        if self.bounds is None:
+            return -1
+        min_x, min_y, max_x, max_y = self.bounds
+        return max(cx - min_x, max_x - cx, cy - min_y, max_y - cy)
+
+    def nearest(self, x, y, k, exclude=None):
+        # Up to k (distance, key) pairs closest to (x, y), nearest first; ties
+        # go to the smaller key. exclude is a key to leave out (e.g. the user
+        # asking).
+        if k <= 0:
+            return []
+        cx, cy = self._cell(x, y)
+        limit = self._max_ring(cx, cy)
+        found = []
+        ring = 0
+        while ring <= limit:
+            for key in self._ring(cx, cy, ring):
+                if key != exclude:
+                    px, py = self.points[key]
+                    found.append((octile(x, y, px, py), key))
+            # Anything in a ring further out is at least ring * bucket away.
+            if len(found) >= k and heapq.nsmallest(k, found)[-1][0] <= ring * self.bucket:
+                break
+            ring += 1
+        return heapq.nsmallest(k, found)
+
+    def within(self, x, y, radius, exclude=None):
+        # (distance, key) pairs with octile distance <= radius, nearest first.
+        # Octile distance is at least the Chebyshev distance, so only buckets
+        # overlapping the square of half-width radius are scanned.
+        if self.bounds is None:
+            return []
+        (min_x, min_y), (max_x, max_y) = self._cell(x - radius, y - radius), self._cell(x + radius, y + radius)
+        min_x, min_y = max(min_x, self.bounds[0]), max(min_y, self.bounds[1])
+        max_x, max_y = min(max_x, self.bounds[2]), min(max_y, self.bounds[3])
+        found = []
+        for bx in range(min_x, max_x + 1):
+            for by in range(min_y, max_y + 1):
+                for key in self.buckets.get((bx, by), ()):
+                    if key != exclude:
+                        px, py = self.points[key]
+                        distance = octile(x, y, px, py)
+                        if distance <= radius:
+                            found.append((distance, key))
+        found.sort()
+        return found
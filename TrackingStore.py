@@ -0,0 +1,218 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from Locking import VersionConflict
+from Metrics import metrics
+
+TRACKING_DB = 'tracking.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    sender TEXT,
+    receiver TEXT,
+    status TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS packages_sender ON packages (sender);
+CREATE INDEX IF NOT EXISTS packages_receiver ON packages (receiver);
+CREATE INDEX IF NOT EXISTS packages_status ON packages (status);
+CREATE TABLE IF NOT EXISTS package_receivers (
+    receiver TEXT NOT NULL,
+    package_seq INTEGER NOT NULL,
+    PRIMARY KEY (receiver, package_seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS package_status_history (
+    package_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    changed_at TEXT NOT NULL,
+    PRIMARY KEY (package_id, version)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sender TEXT NOT NULL,
+    receiver TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+CREATE TABLE IF NOT EXISTS inbox (
+    user TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (user, message_id)
+) WITHOUT ROWID;
+"""
+
+def timestamp(moment=None):
+    # Fixed-width ISO timestamps, so they sort as text.
+    return (moment or datetime.utcnow()).isoformat(timespec='microseconds')
+
+class TrackingStore:
+    # Packages and chat messages in SQLite (WAL mode), so they survive restarts
+    # and are shared by worker processes, with memory use independent of their
+    # number. Packages are JSON documents with their id, sender, receiver,
+    # status and version in indexed columns; every status a package takes is
+    # appended to package_status_history. A package going to several receivers
+    # has a package_receivers row for each, which receiver filters read. Each
+    # message has one inbox row per participant, so a user's messages are a
+    # range scan in id order.
+    # Connections are per thread; writes run in BEGIN IMMEDIATE transactions.
+    def __init__(self, db_file=TRACKING_DB):
+        self.db_file = db_file
+        self.local = threading.local()
+        connection = self._connection()
+        indexed = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'package_receivers'").fetchone()
+        connection.executescript(SCHEMA)
+        if not indexed:
+            # Databases from before package_receivers: index their packages' receiver column.
+            connection.execute('INSERT OR IGNORE INTO package_receivers (receiver, package_seq) '
+                               'SELECT receiver, seq FROM packages WHERE receiver IS NOT NULL')
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def _write(self, operation, work):
+        with metrics.timer('tracking_query_seconds', operation=operation):
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(connection)
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+            return result
+
+    # Messages
+
+    def add_messages(self, entries):
+        # Stamps each entry with its id (the paging cursor) and timestamp. Both
+        # are assigned inside the write transaction, so they increase together.
+        def work(connection):
+            for entry in entries:
+                entry.pop('id', None)
+                entry['timestamp'] = timestamp()
+                data = json.dumps({key: value for key, value in entry.items() if key != 'timestamp'})
+                cursor = connection.execute('INSERT INTO messages (sender, receiver, timestamp, data) VALUES (?, ?, ?, ?)',
+                                            (entry['sender'], entry['receiver'], entry['timestamp'], data))
+                entry['id'] = cursor.lastrowid
+                for user in {entry['sender'], entry['receiver']}:
+                    connection.execute('INSERT INTO inbox (user, message_id) VALUES (?, ?)', (user, entry['id']))
+        self._write('add_messages', work)
+        return entries
+
+    def message_page(self, user, after=None, since=None, limit=100):
+        # Up to limit of the user's messages with id > after and timestamp >=
+        # since (a naive UTC datetime), oldest first; returns (messages, has_more).
+        with metrics.timer('tracking_query_seconds', operation='message_page'):
+            connection = self._connection()
+            after = after or 0
+            if since is not None:
+                row = connection.execute('SELECT MIN(id) FROM messages WHERE timestamp >= ?', (timestamp(since),)).fetchone()
+                if row[0] is None:
+                    return [], False
+                after = max(after, row[0] - 1)
+            rows = connection.execute(
+                'SELECT m.id, m.timestamp, m.data FROM inbox i JOIN messages m ON m.id = i.message_id '
+                'WHERE i.user = ? AND i.message_id > ? ORDER BY i.message_id LIMIT ?',
+                (user, after, limit + 1)).fetchall()
+        messages = [{**json.loads(data), "id": message_id, "timestamp": moment} for message_id, moment, data in rows[:limit]]
+        return messages, len(rows) > limit
+
+    # Packages
+
+    def add_packages(self, packages):
+        # Packages need an 'id', 'status' and 'version'; the sender and the
+        # receivers ('receiver' and/or a 'receivers' list, as /send_message
+        # gives) are taken from the package or its package_info. The receiver
+        # column holds the first receiver.
+        changed_at = timestamp()
+
+        def work(connection):
+            for package in packages:
+                info = package.get('package_info') if isinstance(package.get('package_info'), dict) else {}
+                sender = package.get('sender', info.get('sender'))
+                receivers = _receivers(package) or _receivers(info)
+                cursor = connection.execute(
+                    'INSERT INTO packages (id, sender, receiver, status, version, data) VALUES (?, ?, ?, ?, ?, ?)',
+                    (package['id'], _text(sender), receivers[0] if receivers else None, package['status'],
+                     package['version'], json.dumps(package)))
+                connection.executemany('INSERT OR IGNORE INTO package_receivers (receiver, package_seq) VALUES (?, ?)',
+                                       [(receiver, cursor.lastrowid) for receiver in receivers])
+                connection.execute('INSERT INTO package_status_history (package_id, version, status, changed_at) VALUES (?, ?, ?, ?)',
+                                   (package['id'], package['version'], package['status'], changed_at))
+        self._write('add_packages', work)
+        return packages
+
+    def get_package(self, package_id):
+        with metrics.timer('tracking_query_seconds', operation='get_package'):
+            row = self._connection().execute('SELECT data FROM packages WHERE id = ?', (package_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_packages(self, sender=None, receiver=None, status=None, after=None, limit=1000):
+        # Packages in creation order, optionally filtered; returns (packages, cursor, has_more).
+        clauses = ['seq > ?']
+        params = [after or 0]
+        for column, value in (('sender', sender), ('status', status)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        if receiver is not None:
+            clauses.append('seq IN (SELECT package_seq FROM package_receivers WHERE receiver = ? AND package_seq > ?)')
+            params += [receiver, after or 0]
+        with metrics.timer('tracking_query_seconds', operation='list_packages'):
+            rows = self._connection().execute(
+                f"SELECT seq, data FROM packages WHERE {' AND '.join(clauses)} ORDER BY seq LIMIT ?",
+                params + [limit + 1]).fetchall()
+        rows, has_more = rows[:limit], len(rows) > limit
+        cursor = rows[-1][0] if rows else after
+        return [json.loads(data) for _, data in rows], cursor, has_more
+
+    def update_package_status(self, package_id, status, expected_version=None):
+        # Returns the updated package, or None if there is no such package;
+        # raises VersionConflict when expected_version is stale.
+        def work(connection):
+            row = connection.execute('SELECT data, version FROM packages WHERE id = ?', (package_id,)).fetchone()
+            if row is None:
+                return None
+            package = json.loads(row[0])
+            if expected_version is not None and row[1] != expected_version:
+                raise VersionConflict(package_id, expected_version, row[1])
+            changed_at = timestamp()
+            package['status'] = status
+            package['updated_at'] = changed_at
+            package['version'] = row[1] + 1
+            connection.execute('UPDATE packages SET status = ?, version = ?, data = ? WHERE id = ?',
+                               (status, package['version'], json.dumps(package), package_id))
+            connection.execute('INSERT INTO package_status_history (package_id, version, status, changed_at) VALUES (?, ?, ?, ?)',
+                               (package_id, package['version'], status, changed_at))
+            return package
+        return self._write('update_package_status', work)
+
+    def package_history(self, package_id):
+        with metrics.timer('tracking_query_seconds', operation='package_history'):
+            rows = self._connection().execute(
+                'SELECT version, status, changed_at FROM package_status_history WHERE package_id = ? ORDER BY version',
+                (package_id,)).fetchall()
+        return [{"version": version, "status": status, "changed_at": changed_at} for version, status, changed_at in rows]
+
+def _text(value):
+    return value if value is None or isinstance(value, str) else json.dumps(value)
+
+def _receivers(entry):
+    # The entry's 'receiver' and 'receivers' as distinct text values, in order.
+    found = [entry['receiver']] if entry.get('receiver') is not None else []
+    if isinstance(entry.get('receivers'), list):
+        found += [receiver for receiver in entry['receivers'] if receiver is not None]
+    return list(dict.fromkeys(_text(receiver) for receiver in found))
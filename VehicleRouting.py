@@ -0,0 +1,374 @@
+import heapq
+import math
+import threading
+import time
+from DataStore import get_store, entity_key
+from RouteCache import octile
+
+# Units (summed over resources) one vehicle carries on a tour.
+VEHICLE_CAPACITY = 100
+# Seconds of local search per plan run, shared among senders by stop count.
+TIME_BUDGET = 2.0
+# Nearest stops considered for savings merges and local search moves.
+NEIGHBOURS = 12
+EPS = 1e-9
+
+class Stop:
+    # One visit on a tour: receiver at (x, y) gets load ({resource: quantity}).
+    def __init__(self, receiver, x, y, load):
+        self.receiver = receiver
+        self.x = x
+        self.y = y
+        self.load = load
+        self.size = sum(load.values())
+
+class Tour:
+    # A vehicle leaving sender, visiting stops in order and driving back.
+    # cost is in path cost units (the search's weighted cost), math.inf when
+    # a stop cannot be reached.
+    def __init__(self, sender, stops, cost):
+        self.sender = sender
+        self.stops = stops
+        self.cost = cost
+        self.load = sum(stop.size for stop in stops)
+
+def split_load(load, capacity):
+    # {resource: quantity} as loads of at most capacity units, so a receiver
+    # needing more than one vehicle carries gets several visits.
+    loads = []
+    current, room = {}, capacity
+    for resource, quantity in sorted(load.items()):
+        while quantity > 0:
+            take = min(quantity, room)
+            current[resource] = current.get(resource, 0) + take
+            quantity -= take
+            room -= take
+            if room <= 0:
+                loads.append(current)
+                current, room = {}, capacity
+    if current:
+        loads.append(current)
+    return loads
+
+def _key(a, b):
+    return (a, b) if a <= b else (b, a)
+
+class DistanceCache:
+    # Routed costs between cells, kept across plan runs while the obstacles
+    # and cost layers stay the same (attach() clears it on any change to
+    # them). Moves are symmetric, so each pair is stored once. matrix() only
+    # searches for the pairs it has not seen; past capacity pairs the cache
+    # starts over.
+    def __init__(self, capacity=2000000):
+        self.capacity = capacity
+        self.costs = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        with self.lock:
+            self.costs.clear()
+
+    def matrix(self, path_finding, cells, neighbours=None, progress=None):
+        # Costs between every two of cells, cells[0] being the depot, as a
+        # list of rows. With neighbours, only the depot's costs and each
+        # cell's costs to its `neighbours` nearest cells (by octile distance)
+        # are routed, which keeps every sweep local when there are hundreds of
+        # stops; the other pairs are estimated as their octile distance times
+        # the median routed/octile ratio of the routed pairs. Missing costs
+        # take one multi-target sweep (costs only, no paths) per cell.
+        cells = [tuple(cell) for cell in cells]
+        distinct = list(dict.fromkeys(cells))
+        if len(distinct) < len(cells):
+            rows = self.matrix(path_finding, distinct, neighbours, progress)
+            index = {cell: i for i, cell in enumerate(distinct)}
+            return [[rows[index[a]][index[b]] for b in cells] for a in cells]
+        size = len(cells)
+        if neighbours is None or size - 2 <= neighbours:
+            routed = {(i, j) for i in range(size) for j in range(i + 1, size)}
+        else:
+            routed = {(0, j) for j in range(1, size)}
+            for i in range(1, size):
+                near = heapq.nsmallest(neighbours, (j for j in range(1, size) if j != i),
+                                       key=lambda j: octile(cells[i], cells[j]))
+                routed.update((min(i, j), max(i, j)) for j in near)
+        rows = [[0.0] * size for _ in range(size)]
+        missing = {}
+        with self.lock:
+            for i, j in routed:
+                cost = self.costs.get(_key(cells[i], cells[j]))
+                if cost is None:
+                    missing.setdefault(cells[i], set()).add(cells[j])
+                else:
+                    rows[i][j] = rows[j][i] = cost
+            self.hits += len(routed) - sum(len(goals) for goals in missing.values())
+            self.misses += sum(len(goals) for goals in missing.values())
+        if missing:
+            searches = [(a, sorted(goals)) for a, goals in missing.items()]
+            found = {}
+            for (a, _), lengths in zip(searches, path_finding.multi_target_many(searches, progress, lengths=True)):
+                for b, cost in lengths.items():
+                    found[_key(a, b)] = cost
+            for i, j in routed:
+                cost = found.get(_key(cells[i], cells[j]))
+                if cost is not None:
+                    rows[i][j] = rows[j][i] = cost
+            with self.lock:
+                if len(self.costs) + len(found) > self.capacity:
+                    self.costs.clear()
+                self.costs.update(found)
+        if len(routed) < size * (size - 1) // 2:
+            ratios = sorted(rows[i][j] / octile(cells[i], cells[j]) for i, j in routed if rows[i][j] < math.inf)
+            ratio = max(1.0, ratios[len(ratios) // 2]) if ratios else 1.0
+            for i in range(1, size):
+                for j in range(i + 1, size):
+                    if (i, j) not in routed:
+                        rows[i][j] = rows[j][i] = octile(cells[i], cells[j]) * ratio
+        return rows
+
+    def attach(self, store):
+        def listener(op, args):
+            if op == 'reload' or entity_key(op, args) in ('obstacles/', 'costs/'):
+                self.clear()
+        store.subscribe(listener)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_distance_cache(store=None):
+    # One cache per store, cleared whenever its obstacles or costs change.
+    store = store or get_store()
+    with _caches_lock:
+        if id(store) not in _caches:
+            cache = DistanceCache()
+            cache.attach(store)
+            _caches[id(store)] = cache
+        return _caches[id(store)]
+
+def tour_cost(d, tour):
+    # d is a cost matrix with the depot at index 0.
+    cost = 0.0
+    previous = 0
+    for stop in tour:
+        cost += d[previous][stop]
+        previous = stop
+    return cost + d[previous][0]
+
+def savings_tours(d, sizes, capacity, near):
+    # Clarke-Wright: start from one tour per stop and merge the two tours
+    # ending in i and j, in order of the distance saved by driving i -> j
+    # instead of back to the depot and out again, while the load fits. Only
+    # pairs where j is among i's nearest stops are considered.
+    stops = range(1, len(d))
+    pairs = {_key(i, j) for i in stops for j in near[i]}
+    savings = sorted(((d[0][i] + d[0][j] - d[i][j], i, j) for i, j in pairs), reverse=True)
+    tour_of = list(range(len(d)))
+    tours = {i: [i] for i in stops}
+    loads = {i: sizes[i] for i in stops}
+    for saving, i, j in savings:
+        if saving <= EPS:
+            break
+        a, b = tour_of[i], tour_of[j]
+        if a == b or loads[a] + loads[b] > capacity:
+            continue
+        first, second = tours[a], tours[b]
+        if first[-1] != i:
+            if first[0] != i:
+                continue
+            first.reverse()
+        if second[0] != j:
+            if second[-1] != j:
+                continue
+            second.reverse()
+        first.extend(second)
+        loads[a] += loads[b]
+        for stop in second:
+            tour_of[stop] = a
+        del tours[b], loads[b]
+    return list(tours.values())
+
+class LocalSearch:
+    # Improves tours (lists of stop indices into d) with 2-opt within a tour,
+    # and relocate and swap moves towards each stop's nearest stops, taking
+    # improving moves until none is left or time.perf_counter() passes
+    # deadline. Loads never exceed capacity.
+    def __init__(self, d, sizes, capacity, tours, near, deadline):
+        self.d = d
+        self.sizes = sizes
+        self.capacity = capacity
+        self.near = near
+        self.deadline = deadline
+        self.tours = [list(tour) for tour in tours]
+        self.loads = [sum(sizes[stop] for stop in tour) for tour in tours]
+        self.where = [0] * len(d)
+        self.pos = [0] * len(d)
+        for r in range(len(self.tours)):
+            self._index(r)
+
+    def _index(self, r):
+        for p, stop in enumerate(self.tours[r]):
+            self.where[stop] = r
+            self.pos[stop] = p
+
+    def expired(self):
+        return time.perf_counter() >= self.deadline
+
+    def _prev(self, stop):
+        p = self.pos[stop]
+        return self.tours[self.where[stop]][p - 1] if p else 0
+
+    def _next(self, stop):
+        tour = self.tours[self.where[stop]]
+        p = self.pos[stop] + 1
+        return tour[p] if p < len(tour) else 0
+
+    def run(self):
+        improved = True
+        while improved and not self.expired():
+            improved = False
+            for r in range(len(self.tours)):
+                improved = self.two_opt(r) or improved
+            improved = self.relocate() or improved
+            improved = self.swap() or improved
+        return [tour for tour in self.tours if tour]
+
+    def two_opt(self, r):
+        # Reverses a stretch of the tour when that shortens it; the depot is
+        # part of the sequence, so either end of the tour can move.
+        d = self.d
+        tour = self.tours[r]
+        seq = [0] + tour + [0]
+        size = len(seq)
+        improved = False
+        again = size > 4
+        while again and not self.expired():
+            again = False
+            for a in range(size - 3):
+                u, u2 = seq[a], seq[a + 1]
+                du, base = d[u], d[u][u2]
+                for b in range(a + 2, size - 1):
+                    v, v2 = seq[b], seq[b + 1]
+                    if du[v] + d[u2][v2] - base - d[v][v2] < -EPS:
+                        seq[a + 1:b + 1] = seq[b:a:-1]
+                        u2 = seq[a + 1]
+                        base = du[u2]
+                        improved = again = True
+        if improved:
+            tour[:] = seq[1:-1]
+            self._index(r)
+        return improved
+
+    def relocate(self):
+        # Moves a stop next to one of its nearest stops, in any tour with room.
+        d, sizes, near = self.d, self.sizes, self.near
+        improved = False
+        for stop in range(1, len(d)):
+            if self.expired():
+                break
+            r = self.where[stop]
+            p, q = self._prev(stop), self._next(stop)
+            removal = d[p][stop] + d[stop][q] - d[p][q]
+            best = None
+            for other in near[stop]:
+                s = self.where[other]
+                if s != r and self.loads[s] + sizes[stop] > self.capacity:
+                    continue
+                for a, b in ((other, self._next(other)), (self._prev(other), other)):
+                    if a == stop or b == stop:
+                        continue
+                    delta = d[a][stop] + d[stop][b] - d[a][b] - removal
+                    if delta < -EPS and (best is None or delta < best[0]):
+                        best = (delta, a, b)
+            if best is None:
+                continue
+            _, a, b = best
+            del self.tours[r][self.pos[stop]]
+            self.loads[r] -= sizes[stop]
+            self._index(r)
+            s = self.where[a] if a else self.where[b]
+            self.tours[s].insert(self.pos[a] + 1 if a else 0, stop)
+            self.loads[s] += sizes[stop]
+            self._index(s)
+            improved = True
+        return improved
+
+    def swap(self):
+        # Exchanges two stops of different tours when both loads still fit.
+        d, sizes, near = self.d, self.sizes, self.near
+        improved = False
+        for stop in range(1, len(d)):
+            if self.expired():
+                break
+            for other in near[stop]:
+                r, s = self.where[stop], self.where[other]
+                if r == s or self.loads[r] - sizes[stop] + sizes[other] > self.capacity or \
+                        self.loads[s] - sizes[other] + sizes[stop] > self.capacity:
+                    continue
+                p, q = self._prev(stop), self._next(stop)
+                po, qo = self._prev(other), self._next(other)
+                delta = (d[p][other] + d[other][q] - d[p][stop] - d[stop][q]
+                         + d[po][stop] + d[stop][qo] - d[po][other] - d[other][qo])
+                if delta < -EPS:
+                    i, j = self.pos[stop], self.pos[other]
+                    self.tours[r][i], self.tours[s][j] = other, stop
+                    self.where[stop], self.where[other] = s, r
+                    self.pos[stop], self.pos[other] = j, i
+                    self.loads[r] += sizes[other] - sizes[stop]
+                    self.loads[s] += sizes[stop] - sizes[other]
+                    improved = True
+        return improved
+
+def solve(d, sizes, capacity, deadline, neighbours=NEIGHBOURS):
+    # Tours over stops 1..len(d) - 1 of cost matrix d (index 0 the depot),
+    # as lists of stop indices. Stops the depot cannot reach get a tour each.
+    reachable = [i for i in range(1, len(d)) if d[0][i] < math.inf]
+    unreachable = [[i] for i in range(1, len(d)) if d[0][i] == math.inf]
+    if not reachable:
+        return unreachable
+    index = [0] + reachable
+    if len(reachable) < len(d) - 1:
+        d = [[d[a][b] for b in index] for a in index]
+        sizes = [sizes[a] for a in index]
+    stops = range(1, len(d))
+    near = [[]] + [heapq.nsmallest(neighbours, (j for j in stops if j != i), key=d[i].__getitem__) for i in stops]
+    tours = LocalSearch(d, sizes, capacity, savings_tours(d, sizes, capacity, near), near, deadline).run()
+    return [[index[stop] for stop in tour] for tour in tours] + unreachable
+
+def plan_tours(path_finding, matches, capacity=VEHICLE_CAPACITY, time_budget=TIME_BUDGET, distances=None,
+               progress=None, neighbours=NEIGHBOURS):
+    # Capacitated multi-stop tours per sender for matches, the
+    # (sender, receiver, {resource: quantity}) triples of
+    # match_senders_receivers. Costs between a sender and its stops come
+    # from distances (a DistanceCache; a fresh one by default), routed with
+    # path_finding for each stop's `neighbours` nearest stops and estimated
+    # for the rest (tour costs may include estimates). time_budget seconds of
+    # local search are shared among the senders by stop count; building the
+    # matrices is not counted.
+    # progress(done, total) is called per sender. Returns a list of Tours.
+    if capacity <= 0:
+        raise ValueError("Vehicle capacity must be positive")
+    distances = distances if distances is not None else DistanceCache()
+    # Allocation matches each resource type separately; a receiver gets all
+    # of a sender's resource types on one visit where they fit.
+    loads = {}
+    for sender, receiver, resources in matches:
+        entry = loads.setdefault(sender.name, (sender, {}))[1].setdefault(receiver.name, (receiver, {}))[1]
+        for resource, quantity in resources.items():
+            entry[resource] = entry.get(resource, 0) + quantity
+    by_sender = []
+    for sender, receivers in loads.values():
+        stops = [Stop(receiver.name, receiver.x, receiver.y, load)
+                 for receiver, resources in receivers.values() for load in split_load(resources, capacity)]
+        by_sender.append((sender, stops))
+    total = sum(len(stops) for _, stops in by_sender)
+    tours = []
+    for done, (sender, stops) in enumerate(by_sender, 1):
+        d = distances.matrix(path_finding, [(sender.x, sender.y)] + [(stop.x, stop.y) for stop in stops], neighbours)
+        deadline = time.perf_counter() + time_budget * len(stops) / total
+        sizes = [0] + [stop.size for stop in stops]
+        for tour in solve(d, sizes, capacity, deadline, neighbours):
+            tours.append(Tour(sender, [stops[i - 1] for i in tour], tour_cost(d, tour)))
+        if progress:
+            progress(done, len(by_sender))
+    return tours
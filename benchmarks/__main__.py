@@ -0,0 +1,82 @@
+import argparse
+import json
+import sys
+from benchmarks import scenarios, suites
+
+# Reproducible benchmark run over one seeded scenario, written as JSON:
+#   python -m benchmarks --preset city --output results.json
+#   python -m benchmarks --preset city --compare results.json
+# Scenario options override the preset's; --suites picks from grid, routing,
+# jps, parallel, matching, tours and endpoints (the last needs Flask).
+
+def compare(old, new):
+    old_flat = suites.flatten(old['results'])
+    new_flat = suites.flatten(new['results'])
+    print(f"{'metric':<45} {'old':>12} {'new':>12} {'new/old':>8}")
+    for name in sorted(old_flat.keys() & new_flat.keys()):
+        if not name.endswith(('.median', '.p95', '_per_second')):
+            continue
+        a, b = old_flat[name], new_flat[name]
+        ratio = f"{b / a:.2f}" if a else "-"
+        print(f"{name:<45} {a:>12.4g} {b:>12.4g} {ratio:>8}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Run the benchmark suites on a seeded scenario.')
+    parser.add_argument('--preset', choices=sorted(scenarios.PRESETS), default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n', type=int)
+    parser.add_argument('--density', type=float)
+    parser.add_argument('--shape', choices=scenarios.SHAPES)
+    parser.add_argument('--senders', type=int)
+    parser.add_argument('--receivers', type=int)
+    parser.add_argument('--resource-types', type=int)
+    parser.add_argument('--suites', default='grid,routing,matching', help='Comma separated: ' + ', '.join(suites.SUITES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--pairs', type=int, default=200, help='Routes per routing run.')
+    parser.add_argument('--workers', type=int, help='Processes for parallel routing (default: all cores).')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent clients for the endpoint suite.')
+    parser.add_argument('--requests', type=int, default=400, help='Requests for the endpoint suite.')
+    parser.add_argument('--output', help='Write results here instead of stdout.')
+    parser.add_argument('--compare', help='Earlier results file to compare against.')
+    args = parser.parse_args(argv)
+
+    names = args.suites.split(',')
+    unknown = [name for name in names if name not in suites.SUITES]
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(unknown)}")
+
+    overrides = {key: value for key, value in (('n', args.n), ('density', args.density), ('shape', args.shape),
+                                               ('senders', args.senders), ('receivers', args.receivers),
+                                               ('resource_types', args.resource_types)) if value is not None}
+    scenario = scenarios.preset(args.preset, args.seed, **overrides)
+    results = {}
+    for name in names:
+        print(f"running {name}...", file=sys.stderr)
+        if name == 'grid':
+            results[name] = suites.grid(scenario, args.repeat)
+        elif name == 'routing':
+            results[name] = suites.routing(scenario, args.repeat, args.pairs, args.workers, args.seed)
+        elif name == 'jps':
+            results[name] = suites.jps(scenario, args.repeat, args.pairs, args.seed)
+        elif name == 'parallel':
+            results[name] = suites.parallel(scenario, args.repeat, args.pairs, args.workers, args.seed)
+        elif name == 'matching':
+            results[name] = suites.matching(scenario, args.repeat)
+        elif name == 'tours':
+            results[name] = suites.tours(scenario, args.repeat)
+        else:
+            results[name] = suites.endpoints(scenario, args.clients, args.requests, args.seed)
+
+    report = {"environment": suites.environment(), "preset": args.preset, "scenario": scenario['params'], "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    elif not args.compare:
+        print(text)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+
+if __name__ == '__main__':
+    main()
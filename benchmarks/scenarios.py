@@ -0,0 +1,122 @@
+import json
+import math
+import os
+import random
+from MapFile import write_map
+from Obstacles import ObstacleLayer, polygon_rects
+
+# Seeded synthetic disaster scenarios: an n x n map with obstacles of a given
+# density and shape, and senders/receivers with resources/needs. The same
+# parameters always give the same scenario.
+#   random  scattered single cells (rubble)
+#   blobs   polygon regions (flooded areas)
+#   walls   long thin rectangles with gaps (collapsed roads, rivers)
+
+SHAPES = ('random', 'blobs', 'walls')
+RESOURCE_NAMES = ['water', 'food', 'medicine', 'blankets', 'tents', 'fuel', 'batteries', 'clothing']
+
+PRESETS = {
+    'small': dict(n=100, density=0.1, shape='random', senders=10, receivers=20, resource_types=2),
+    'city': dict(n=300, density=0.2, shape='walls', senders=100, receivers=300, resource_types=4),
+    'flood': dict(n=500, density=0.25, shape='blobs', senders=300, receivers=1000, resource_types=5),
+}
+
+def _random_cells(rng, n, density):
+    return ObstacleLayer((x, y) for x in range(n) for y in range(n) if rng.random() < density)
+
+def _blobs(rng, n, density):
+    layer = ObstacleLayer()
+    target = density * n * n
+    covered = 0
+    while covered < target:
+        cx, cy = rng.uniform(0, n), rng.uniform(0, n)
+        radius = rng.uniform(n / 40, n / 10)
+        polygon = []
+        for i in range(8):
+            angle = 2 * math.pi * i / 8
+            r = radius * rng.uniform(0.6, 1.0)
+            polygon.append([round(cx + r * math.cos(angle)), round(cy + r * math.sin(angle))])
+        rects = polygon_rects(polygon)
+        layer.add_region(f"blob{len(layer.regions)}", rects)
+        covered += sum((x1 - x0 + 1) * (y1 - y0 + 1) for x0, y0, x1, y1 in rects)
+    return layer
+
+def _walls(rng, n, density):
+    layer = ObstacleLayer()
+    target = density * n * n
+    covered = 0
+    while covered < target:
+        length = rng.randrange(n // 4, n)
+        width = rng.randrange(1, 3)
+        at, start = rng.randrange(n), rng.randrange(n - length + 1)
+        # Two gaps per wall keep most of the map connected.
+        cuts = sorted(rng.sample(range(start, start + length), 2))
+        rects = []
+        for y0, y1 in ((start, cuts[0] - 1), (cuts[0] + 2, cuts[1] - 1), (cuts[1] + 2, start + length - 1)):
+            if y0 <= y1:
+                rects.append([at, y0, at + width - 1, y1] if rng.random() < 0.5 else [y0, at, y1, at + width - 1])
+        layer.add_region(f"wall{len(layer.regions)}", rects)
+        covered += sum((x1 - x0 + 1) * (y1 - y0 + 1) for x0, y0, x1, y1 in rects)
+    return layer
+
+OBSTACLES = {'random': _random_cells, 'blobs': _blobs, 'walls': _walls}
+
+def generate(seed=0, n=200, density=0.1, shape='random', senders=20, receivers=40, resource_types=3, max_quantity=10):
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown obstacle shape: {shape}")
+    params = dict(seed=seed, n=n, density=density, shape=shape, senders=senders, receivers=receivers,
+                  resource_types=resource_types, max_quantity=max_quantity)
+    rng = random.Random(seed)
+    obstacles = OBSTACLES[shape](rng, n, density)
+    resources = RESOURCE_NAMES[:resource_types] + [f"resource{i}" for i in range(len(RESOURCE_NAMES), resource_types)]
+
+    taken = set()
+
+    def place():
+        while True:
+            cell = (rng.randrange(n), rng.randrange(n))
+            if cell not in obstacles and cell not in taken:
+                taken.add(cell)
+                return cell
+
+    def amounts():
+        chosen = rng.sample(resources, rng.randrange(1, len(resources) + 1))
+        return {resource: rng.randrange(1, max_quantity + 1) for resource in sorted(chosen)}
+
+    sender_list = []
+    for i in range(senders):
+        x, y = place()
+        sender_list.append({"name": f"Sender{i}", "x": x, "y": y, "resources": amounts()})
+    receiver_list = []
+    for i in range(receivers):
+        x, y = place()
+        receiver_list.append({"name": f"Receiver{i}", "x": x, "y": y, "needs": amounts()})
+    return {"params": params, "n": n, "obstacles": obstacles, "senders": sender_list, "receivers": receiver_list}
+
+def preset(name, seed=0, **overrides):
+    return generate(seed=seed, **{**PRESETS[name], **overrides})
+
+def write(scenario, directory):
+    # The scenario as a data directory (locations.json and its binary
+    # locations.map, resources.json, names.json) that DataStore and the web
+    # app can be started on.
+    cells, regions = scenario['obstacles'].to_json()
+    locations = {
+        "n": scenario['n'],
+        "obstacles": cells,
+        "obstacle_regions": regions,
+        "senders": [{"name": s['name'], "x": s['x'], "y": s['y']} for s in scenario['senders']],
+        "receivers": [{"name": r['name'], "x": r['x'], "y": r['y']} for r in scenario['receivers']],
+    }
+    resources = {
+        "senders": [{"name": s['name'], "resources": s['resources']} for s in scenario['senders']],
+        "receivers": [{"name": r['name'], "needs": r['needs']} for r in scenario['receivers']],
+    }
+    names = {"senders": [s['name'] for s in scenario['senders']], "receivers": [r['name'] for r in scenario['receivers']]}
+    for file_name, data in (('locations.json', locations), ('resources.json', resources), ('names.json', names)):
+        with open(os.path.join(directory, file_name), 'w') as file:
+            json.dump(data, file)
+    with open(os.path.join(directory, 'deliveries.json'), 'w') as file:
+        json.dump([], file)
+    locations_file = os.path.join(directory, 'locations.json')
+    write_map(os.path.join(directory, 'locations.map'), scenario['n'], scenario['obstacles'], source=locations_file)
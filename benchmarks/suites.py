@@ -0,0 +1,337 @@
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from Allocation import Allocation, octile_costs
+from CostLayers import CostField, parse_region
+from GridPathFinding import GridPathFinding, path_cost
+from HierarchicalPathFinding import HierarchicalPathFinding
+from JumpPointSearch import JumpPointSearch
+from MapFile import MapFile, write_map
+from Obstacles import ObstacleLayer
+from ParallelRouting import ParallelRouter, process_pool
+from PathFinding import PathFinding, Receiver, Sender, route_costs, route_pairs
+from VehicleRouting import VEHICLE_CAPACITY, DistanceCache, plan_tours
+from benchmarks.scenarios import generate, write
+
+# Each suite takes a scenario (benchmarks.scenarios.generate) and returns
+# {metric: value}; timings are summaries of `repeat` runs from timings().
+
+def timings(samples):
+    samples = sorted(samples)
+
+    def quantile(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {
+        "runs": len(samples),
+        "mean": sum(samples) / len(samples),
+        "min": samples[0],
+        "median": quantile(0.5),
+        "p95": quantile(0.95),
+        "max": samples[-1],
+    }
+
+def measure(work, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = work()
+        samples.append(time.perf_counter() - start)
+    return timings(samples), result
+
+def _pairs(scenario, count, seed):
+    rng = random.Random(seed)
+    senders = [(s['x'], s['y']) for s in scenario['senders']]
+    receivers = [(r['x'], r['y']) for r in scenario['receivers']]
+    return [(rng.choice(senders), rng.choice(receivers)) for _ in range(count)]
+
+def _people(scenario):
+    senders = [Sender(s['name'], s['x'], s['y'], dict(s['resources'])) for s in scenario['senders']]
+    receivers = [Receiver(r['name'], r['x'], r['y'], dict(r['needs'])) for r in scenario['receivers']]
+    return senders, receivers
+
+def grid(scenario, repeat=3):
+    n, obstacles = scenario['n'], scenario['obstacles']
+    cells = [list(cell) for cell in obstacles]
+    results = {"blocked_cells": len(cells)}
+    text = json.dumps(cells)
+    results["json_load"], _ = measure(lambda: ObstacleLayer(json.loads(text)), repeat)
+    results["layer_load"], _ = measure(lambda: ObstacleLayer(cells), repeat)
+    results["grid_from_layer"], expected = measure(lambda: GridPathFinding(n, obstacles), repeat)
+    results["grid_from_cells"], _ = measure(lambda: GridPathFinding(n, cells), repeat)
+    path = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'locations.map')
+    results["map_write"], _ = measure(lambda: write_map(path, n, obstacles), repeat)
+    results["map_bytes"] = os.path.getsize(path)
+    results["map_open"], _ = measure(lambda: MapFile(path).close(), repeat)
+    with MapFile(path) as map_file:
+        results["grid_from_map"], painted = measure(lambda: GridPathFinding(n, map_file), repeat)
+    if painted.grid != expected.grid:
+        raise AssertionError("grid painted from the map differs from the layer")
+    if n <= 200:
+        # The dict graph is quadratic in memory; only built for small maps.
+        results["graph"], _ = measure(lambda: PathFinding(n, obstacles), 1)
+    return results
+
+def terrain(n, seed, regions=40):
+    # Seeded cost regions: rectangles of mud, rivers and congestion.
+    rng = random.Random(seed)
+    field = CostField(n)
+    for i in range(regions):
+        x, y = rng.randrange(n), rng.randrange(n)
+        w, h = rng.randrange(1, max(2, n // 5)), rng.randrange(1, max(2, n // 5))
+        layer = rng.choice(('terrain', 'congestion'))
+        field.set_region(layer, str(i), parse_region({"rects": [[x, y, x + w, y + h]], "cost": rng.choice((0.8, 1.5, 3, 6))}))
+    return field
+
+def routing(scenario, repeat=1, pairs=200, workers=None, seed=0):
+    n, obstacles = scenario['n'], scenario['obstacles']
+    queries = _pairs(scenario, pairs, seed)
+    grid_pf = GridPathFinding(n, obstacles)
+    jps = JumpPointSearch(n, obstacles, path_finding=GridPathFinding(n, obstacles))
+    results = {"pairs": len(queries)}
+
+    results["a_star"], expected = measure(lambda: [grid_pf.a_star(s, g) for s, g in queries], repeat)
+    results["jps"], paths = measure(lambda: [jps.a_star(s, g) for s, g in queries], repeat)
+    _check(expected, paths, "jps")
+    results["batched"], paths = measure(lambda: route_pairs(grid_pf, queries), repeat)
+    _check(expected, paths, "batched")
+    workers = workers or os.cpu_count() or 1
+    if workers > 1:
+        with ParallelRouter(n, obstacles, workers) as router:
+            router.a_star_many(queries[:workers])
+            results["parallel"], paths = measure(lambda: route_pairs(router, queries), repeat)
+        results["parallel"]["workers"] = workers
+        _check(expected, paths, "parallel")
+    # HPA* routes are approximate: "excess" is their total cost over the shortest.
+    hierarchical = HierarchicalPathFinding(n, obstacles)
+    results["hierarchical"], paths = measure(lambda: [hierarchical.a_star(s, g) for s, g in queries], repeat)
+    results["hierarchical"]["excess"] = _excess(expected, paths)
+    field = terrain(n, seed)
+    results["cost_update"], _ = measure(
+        lambda: field.set_region('terrain', '0', parse_region({"rects": [[0, 0, n // 4, n // 4]], "cost": 2})), repeat)
+    costs, min_cost = field.at(0)
+    weighted = GridPathFinding(n, obstacles, costs, min_cost)
+    results["weighted"], expected = measure(lambda: [weighted.a_star(s, g) for s, g in queries], repeat)
+    hierarchical = HierarchicalPathFinding(n, obstacles, costs=costs, min_cost=min_cost)
+    results["hierarchical_weighted"], paths = measure(lambda: [hierarchical.a_star(s, g) for s, g in queries], repeat)
+    results["hierarchical_weighted"]["excess"] = _excess(expected, paths, costs, n + 2)
+    for name in ("a_star", "jps", "batched", "parallel", "hierarchical", "weighted", "hierarchical_weighted"):
+        if name in results:
+            results[name]["routes_per_second"] = len(queries) / results[name]["median"]
+    results["unreachable"] = sum(1 for path in expected if not path)
+    return results
+
+def _excess(expected, paths, costs=None, width=None):
+    shortest = sum(path_cost(path, costs, width) for path in expected if path)
+    found = sum(path_cost(path, costs, width) for path in paths if path)
+    return found / shortest - 1 if shortest else 0.0
+
+def jps(scenario, repeat=1, pairs=200, seed=0, densities=(0.0, 0.01, 0.05, 0.1, 0.2, 0.3)):
+    # A* against Jump Point Search on the scenario regenerated at each
+    # obstacle density, from empty to cluttered: query time and nodes
+    # expanded. Both must find routes of equal length.
+    results = {}
+    for density in densities:
+        variant = generate(**{**scenario['params'], 'density': density})
+        n, obstacles = variant['n'], variant['obstacles']
+        queries = _pairs(variant, pairs, seed)
+        grid_pf = GridPathFinding(n, obstacles)
+        jump = JumpPointSearch(n, obstacles, path_finding=GridPathFinding(n, obstacles))
+        row = {}
+        for name, engine in (("a_star", grid_pf), ("jps", jump)):
+            def run():
+                paths, expanded = [], 0
+                for start, goal in queries:
+                    paths.append(engine.a_star(start, goal))
+                    expanded += engine.expanded
+                return paths, expanded
+            row[name], (paths, expanded) = measure(run, repeat)
+            row[name]["expanded"] = expanded
+            if name == "a_star":
+                expected = paths
+        _check(expected, paths, "jps")
+        row["reduction"] = row["a_star"]["expanded"] / row["jps"]["expanded"] if row["jps"]["expanded"] else 0.0
+        results[f"density_{density:g}"] = row
+    return results
+
+def parallel(scenario, repeat=1, pairs=200, workers=None, seed=0):
+    # ParallelRouter throughput with 1, 2, 4, ... up to `workers` processes
+    # (default: all cores) on one shared pool, against the serial
+    # GridPathFinding. Every run must return the serial routes in order.
+    n, obstacles = scenario['n'], scenario['obstacles']
+    queries = _pairs(scenario, pairs, seed)
+    serial = GridPathFinding(n, obstacles)
+    results = {"pairs": len(queries)}
+    results["serial"], expected = measure(lambda: [serial.a_star(s, g) for s, g in queries], repeat)
+    most = workers or os.cpu_count() or 1
+    pool = process_pool(most) if most > 1 else None
+    try:
+        count = 1
+        while True:
+            with ParallelRouter(n, obstacles, count, min_parallel=0, pool=pool if count > 1 else None) as router:
+                router.a_star_many(queries[:count])
+                timing, paths = measure(lambda: router.a_star_many(queries), repeat)
+            _check(expected, paths, f"{count} workers")
+            timing["speedup"] = results["serial"]["median"] / timing["median"]
+            results[f"workers_{count}"] = timing
+            if count >= most:
+                break
+            count = min(count * 2, most)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    for name, timing in results.items():
+        if isinstance(timing, dict):
+            timing["routes_per_second"] = len(queries) / timing["median"]
+    return results
+
+def _check(expected, paths, name):
+    for a, b in zip(expected, paths):
+        if bool(a) != bool(b) or (a and abs(path_cost(a) - path_cost(b)) > 1e-6):
+            raise AssertionError(f"{name} routes differ from A*")
+
+def matching(scenario, repeat=1, routed=True):
+    results = {}
+    methods = [("flow", None), ("greedy", None)]
+    if routed:
+        path_finding = GridPathFinding(scenario['n'], scenario['obstacles'])
+        methods.append(("flow_routed", route_costs(path_finding)))
+    for name, costs in methods:
+        def run():
+            senders, receivers = _people(scenario)
+            method = "greedy" if name == "greedy" else "flow"
+            matches = Allocation(costs, method).allocate(senders, receivers)
+            return matches, receivers
+        results[name], (matches, receivers) = measure(run, repeat)
+        pairs = [((s.x, s.y), (r.x, r.y)) for s, r, _ in matches]
+        results[name]["matches"] = len(matches)
+        results[name]["octile_cost"] = sum(c * sum(m.values()) for c, (_, _, m) in zip(octile_costs(pairs), matches))
+        results[name]["unmet"] = sum(sum(r.needs.values()) for r in receivers)
+    return results
+
+def tours(scenario, repeat=1, capacity=VEHICLE_CAPACITY, time_budget=1.0):
+    # Routed matching, then capacitated tours per sender. "matrix" is the
+    # first run on an empty distance cache, "cached" the later runs reusing it.
+    path_finding = GridPathFinding(scenario['n'], scenario['obstacles'])
+    senders, receivers = _people(scenario)
+    matches = Allocation(route_costs(path_finding), "flow").allocate(senders, receivers)
+    distances = DistanceCache()
+    results = {"matches": len(matches), "capacity": capacity, "time_budget": time_budget}
+    results["matrix"], planned = measure(lambda: plan_tours(path_finding, matches, capacity, time_budget, distances), 1)
+    results["matrix_routed"] = distances.misses
+    results["cached"], planned = measure(lambda: plan_tours(path_finding, matches, capacity, time_budget, distances),
+                                         repeat)
+    results["tours"] = len(planned)
+    results["stops"] = sum(len(tour.stops) for tour in planned)
+    results["tour_cost"] = sum(tour.cost for tour in planned if math.isfinite(tour.cost))
+    # One round trip per match, as plan(capacity=None) would drive them.
+    pairs = [((s.x, s.y), (r.x, r.y)) for s, r, _ in matches]
+    results["direct_cost"] = sum(2 * path_cost(path) for path in route_pairs(path_finding, pairs) if path)
+    return results
+
+ENDPOINTS = ['people', 'user', 'add_resources', 'send_message', 'messages', 'nearest']
+
+def endpoints(scenario, clients=8, requests=400, seed=0):
+    # Starts the web app on a copy of the scenario in a temporary directory
+    # and has `clients` threads send `requests` requests in total, a seeded
+    # mix of reads and writes. Needs Flask; imports tracking_package, so it
+    # runs once per process.
+    directory = tempfile.mkdtemp(prefix='bench-')
+    write(scenario, directory)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        from werkzeug.serving import make_server
+        import tracking_package
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, tracking_package.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            return _load(f"http://127.0.0.1:{server.server_port}", scenario, clients, requests, seed)
+        finally:
+            server.shutdown()
+    finally:
+        os.chdir(cwd)
+
+def _request(base, kind, rng, scenario):
+    sender = rng.choice(scenario['senders'])
+    receiver = rng.choice(scenario['receivers'])
+    if kind == 'people':
+        return urllib.request.Request(f"{base}/get_people_data")
+    if kind == 'user':
+        return urllib.request.Request(f"{base}/get_user/{sender['name']}")
+    if kind == 'nearest':
+        return urllib.request.Request(f"{base}/nearest?role=distributor&name={receiver['name']}&k=5")
+    if kind == 'messages':
+        return urllib.request.Request(f"{base}/get_messages?user={receiver['name']}&limit=50")
+    if kind == 'add_resources':
+        body = {"sender": sender['name'], "name": rng.choice(list(sender['resources'])), "amount": rng.randrange(1, 20)}
+    else:
+        body = {"sender": sender['name'], "receivers": [receiver['name']], "message": "Supplies on the way"}
+    return urllib.request.Request(f"{base}/{kind}", data=json.dumps(body).encode(),
+                                  headers={"Content-Type": "application/json"}, method='POST')
+
+def _load(base, scenario, clients, requests, seed):
+    rng = random.Random(seed)
+    plan = [(kind, random.Random(rng.random())) for kind in (rng.choice(ENDPOINTS) for _ in range(requests))]
+    samples = {kind: [] for kind in ENDPOINTS}
+    errors = {kind: 0 for kind in ENDPOINTS}
+    lock = threading.Lock()
+
+    def send(item):
+        kind, item_rng = item
+        request = _request(base, kind, item_rng, scenario)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+            failed = False
+        except OSError:
+            failed = True
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples[kind].append(elapsed)
+            errors[kind] += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(send, plan))
+    elapsed = time.perf_counter() - start
+    results = {"clients": clients, "requests": requests, "seconds": elapsed, "requests_per_second": requests / elapsed}
+    for kind in ENDPOINTS:
+        if samples[kind]:
+            results[kind] = {**timings(samples[kind]), "errors": errors[kind]}
+    return results
+
+SUITES = {'grid': grid, 'routing': routing, 'jps': jps, 'parallel': parallel, 'matching': matching, 'tours': tours,
+          'endpoints': endpoints}
+
+def environment():
+    try:
+        import subprocess
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": sys.version.split()[0], "platform": sys.platform, "cpus": os.cpu_count(),
+            "time": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+
+def flatten(results, prefix=''):
+    # {"routing.a_star.median": 0.12, ...} for comparing two result files.
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            flat[name] = value
+    return flat
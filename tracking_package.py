@@ -1,31 +1,118 @@
-from flask import Flask, request, jsonify
-from datetime import datetime
+from flask import Flask, Response, request, jsonify, g
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
 import uuid
 import json
+import math
 import os
-import subprocess
+import threading
+import time
+from CostLayers import parse_region, region_json
+from DataStore import get_store, entity_key
+from GridPathFinding import path_cost
+from EventBus import EventBus
+from Indexes import UserIndex, DeliveryIndex
+from Locking import FileLock, VersionConflict
+from Obstacles import polygon_rects
+from Jobs import JobQueue
+from PathFinding import plan
+from TrackingStore import TrackingStore
+from RouteCache import get_route_cache
+from IncrementalPlanner import IncrementalRouter
+from ParallelRouting import process_pool
+from Metrics import metrics, profiler, SIZE_BUCKETS
 
 app = Flask(__name__)
 
-chats = []
-rescue_packages = []
-users = []
+# Processes for the planner's route searches, kept for the life of the app and
+# started here, before the store, job queue or any other thread: forking from
+# a threaded process can deadlock the child. The rest of the machine is left
+# to the request threads.
+PLAN_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+plan_pool = process_pool(PLAN_WORKERS) if PLAN_WORKERS > 1 else None
+
+tracking = TrackingStore()
 
 # Load data from JSON files
 def load_json(file_path):
     if os.path.exists(file_path):
-        with open(file_path, 'r') as file:
+        with metrics.timer('json_load_seconds', file=os.path.basename(file_path)), open(file_path, 'r') as file:
             return json.load(file)
     return []
 
-def save_json(file_path, data):
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=4)
-
-locations = load_json('locations.json')
-resources = load_json('resources.json')
-deliveries = load_json('deliveries.json')
-names = load_json('names.json')
+store = get_store()
+users = UserIndex(store)
+events = EventBus()
+route_cache = get_route_cache(store=store)
+router = None
+router_lock = threading.Lock()
+# /get_route queries at least this many cells apart (octile) use HPA* on the
+# router's grid instead of keeping an LPA* per pair, while no cost layers are
+# active (see IncrementalRouter); None routes all with LPA*.
+HIERARCHICAL_DISTANCE = 256
+deliveries = DeliveryIndex(load_json('deliveries.json'))
+
+# Resource changes schedule a replan; changes arriving within PLAN_DELAY
+# seconds of each other, or while a plan is running, share one run.
+PLAN_DELAY = 2.0
+plan_lock = FileLock('plan.lock')
+
+def publish_job(job):
+    events.publish('job', job.to_json(result=False))
+
+jobs = JobQueue(workers=2, delay=PLAN_DELAY, on_finish=publish_job)
+
+def run_plan(job):
+    # plan_lock keeps runs from other worker processes from allocating the same resources twice.
+    global plan_pool
+    with plan_lock:
+        try:
+            summary = plan(store, 'deliveries.json', cache=route_cache, progress=job.report,
+                           workers=PLAN_WORKERS if plan_pool else 1, pool=plan_pool)
+        except BrokenProcessPool:
+            # A worker died. Later runs search in-process rather than fork
+            # replacements from this threaded process.
+            plan_pool = None
+            raise
+    # Only this run's deliveries are new to the index; the job result leaves them out.
+    deliveries.add(summary.pop('planned'))
+    return summary
+
+def schedule_plan(delay=None):
+    return jobs.submit('plan', run_plan, key='plan', delay=delay)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Labelled by the route rule ("/get_user/<user_name>"), not the URL, so the
+    # number of series stays fixed. Streamed responses (/events) are timed
+    # until the stream starts.
+    started = g.pop('request_started', None)
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('http_requests_total', method=request.method, route=route, status=response.status_code)
+    if started is not None:
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started, method=request.method, route=route)
+    return response
+
+def collect_gauges(registry):
+    registry.set('route_cache_entries', len(route_cache.entries))
+    registry.set_total('route_cache_hits_total', route_cache.hits)
+    registry.set_total('route_cache_misses_total', route_cache.misses)
+    registry.set('store_applied_seq', store.applied_seq)
+    registry.set_total('events_published_total', events.last_id)
+    with jobs.condition:
+        registry.set('jobs_queued', len(jobs.queue))
+        registry.set('jobs_running', len(jobs.running_keys))
+    registry.set('profiler_running', int(profiler.running))
+
+metrics.collect(collect_gauges)
+
+def valid_amount(amount):
+    # Resource amounts are whole units; anything else would break every later plan.
+    return isinstance(amount, int) and not isinstance(amount, bool) and amount >= 0
 
 # ...existing code...
 @app.route('/request_resources', methods=['POST'])
@@ -35,16 +122,22 @@ def request_resources():
     name = data.get('name')
     amount = data.get('amount')
 
-    if not all([sender, name, amount]):
+    if not all([sender, name]) or amount is None:
         return jsonify({"error": "Missing sender, name, or amount"}), 400
+    if not valid_amount(amount):
+        return jsonify({"error": "amount must be a non-negative integer"}), 400
 
-    receiver_needs = [{"name": sender, "needs": {name: amount}}]
-    result = subprocess.run(['python3', 'UpdateResources.py', '--receiver_needs', json.dumps(receiver_needs)], capture_output=True, text=True)
-
-    if result.returncode != 0:
-        return jsonify({"error": "Failed to update resources", "details": result.stderr}), 500
+    try:
+        version = store.set_resource('receivers', sender, name, amount, data.get('version'))
+    except KeyError:
+        return jsonify({"error": f"Unknown receiver '{sender}'"}), 400
+    except VersionConflict as e:
+        return jsonify({"error": "Version conflict", "version": e.actual}), 409
+    except (OSError, ValueError) as e:
+        return jsonify({"error": "Failed to update resources", "details": str(e)}), 500
 
-    return jsonify({"message": "Resources requested successfully"}), 200
+    job = schedule_plan()
+    return jsonify({"message": "Resources requested successfully", "version": version, "job": job.id}), 200
 
 @app.route('/add_resources', methods=['POST'])
 def add_resources():
@@ -53,33 +146,40 @@ def add_resources():
     name = data.get('name')
     amount = data.get('amount')
 
-    if not all([sender, name, amount]):
+    if not all([sender, name]) or amount is None:
         return jsonify({"error": "Missing sender, name, or amount"}), 400
+    if not valid_amount(amount):
+        return jsonify({"error": "amount must be a non-negative integer"}), 400
 
-    sender_resources = [{"name": sender, "resources": {name: amount}}]
-    result = subprocess.run(['python3', 'UpdateResources.py', '--sender_resources', json.dumps(sender_resources)], capture_output=True, text=True)
-
-    if result.returncode != 0:
-        return jsonify({"error": "Failed to update resources", "details": result.stderr}), 500
-
-    return jsonify({"message": "Resources added successfully"}), 200
+    try:
+        version = store.set_resource('senders', sender, name, amount, data.get('version'))
+    except KeyError:
+        return jsonify({"error": f"Unknown sender '{sender}'"}), 400
+    except VersionConflict as e:
+        return jsonify({"error": "Version conflict", "version": e.actual}), 409
+    except (OSError, ValueError) as e:
+        return jsonify({"error": "Failed to update resources", "details": str(e)}), 500
 
-# ...existing code...
-if __name__ == '__main__':
-    app.run(debug=True)
+    job = schedule_plan()
+    return jsonify({"message": "Resources added successfully", "version": version, "job": job.id}), 200
 
-@app.route('/get_users', methods=['POST'])
+@app.route('/get_users', methods=['GET', 'POST'])
+@app.route('/get_people_data', methods=['GET'])
 def get_users():
-    # Call merge_json.py
-    result = subprocess.run(['python3', 'merge_json.py'], capture_output=True, text=True)
-    
-    if result.returncode != 0:
-        return jsonify({"error": "Failed to merge data", "details": result.stderr}), 500
+    # Served from the incrementally maintained view; pollers that send back the
+    # ETag get a 304 until something changes.
+    body, etag = users.people_json()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, status=200, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-    # Load the merged data from people_data.json
-    people_data = load_json('people_data.json')
-    
-    return jsonify(people_data), 200
+def valid_coordinate(value):
+    # Grid cells are whole numbers; 0 is a valid row or column.
+    return isinstance(value, int) and not isinstance(value, bool)
 
 @app.route('/add_name', methods=['POST'])
 def add_user():
@@ -89,29 +189,22 @@ def add_user():
     user_y = data.get('y')
     user_role = data.get('role')
 
-    if not user_name or not user_x or not user_y or not user_role:
+    if user_name is None or user_role is None or not valid_coordinate(user_x) or not valid_coordinate(user_y):
         return jsonify({"error": "Invalid or missing user data"}), 400
 
-    # Call UpdateLocations.py to add the user
+    user = {"name": user_name, "x": user_x, "y": user_y}
     if (user_role == 'camp'):
-        result = subprocess.run(['python3', 'UpdateLocations.py', '--add_receivers', json.dumps([{"name": user_name, "x": user_x, "y": user_y}])], capture_output=True, text=True)
+        result = store.update_locations([], [], [user], [], [], [], [], [])
     else:
-        result = subprocess.run(['python3', 'UpdateLocations.py', '--add_senders', json.dumps([{"name": user_name, "x": user_x, "y": user_y}])], capture_output=True, text=True)
-    if "has already been taken" in result.stdout:
+        result = store.update_locations([user], [], [], [], [], [], [], [])
+    if result and "has already been taken" in result:
         return jsonify({"error": f"User name '{user_name}' has already been taken"}), 400
 
     return jsonify({"message": "User added successfully", "user": user_name}), 200
 
 @app.route('/get_user/<user_name>', methods=['GET'])
 def get_user_by_name(user_name):
-    # Load the merged data from people_data.json
-    people_data = load_json('people_data.json')
-    
-    # Search for the user in senders and receivers
-    user = next((user for user in people_data['senders'] if user['name'] == user_name), None)
-    if not user:
-        user = next((user for user in people_data['receivers'] if user['name'] == user_name), None)
-    
+    user = users.get(user_name)
     if not user:
         return jsonify({"error": "User not found"}), 404
 
@@ -125,17 +218,36 @@ def add_package():
     if not package_info or not isinstance(package_info, dict):
         return jsonify({"error": "Invalid or missing package data"}), 400
 
-    package_id = str(uuid.uuid4())
-    package_info['id'] = package_id
+    tracking.add_packages([new_package(package_info)])
+    events.publish('package', package_info)
+
+    return jsonify({"message": "Package added successfully", "package": package_info}), 200
+
+def new_package(package_info):
+    package_info['id'] = str(uuid.uuid4())
     package_info['status'] = "Pending"
     package_info['created_at'] = datetime.utcnow().isoformat()
-    rescue_packages.append(package_info)
+    package_info['version'] = 1
+    return package_info
 
-    return jsonify({"message": "Package added successfully", "package": package_info}), 200
+PACKAGES_PAGE_LIMIT = 1000
 
 @app.route('/get_packages', methods=['GET'])
 def get_packages():
-    return jsonify({"packages": rescue_packages}), 200
+    # Optional sender/receiver/status filters. Pages hold up to limit packages
+    # in creation order; pass the returned cursor back as after= for the next.
+    try:
+        after = request.args.get('after')
+        after = int(after) if after else None
+        limit = int(request.args.get('limit', PACKAGES_PAGE_LIMIT))
+    except ValueError:
+        return jsonify({"error": "Invalid after or limit parameter"}), 400
+    if limit < 1:
+        return jsonify({"error": "Invalid after or limit parameter"}), 400
+
+    packages, cursor, has_more = tracking.list_packages(request.args.get('sender'), request.args.get('receiver'),
+                                                        request.args.get('status'), after, min(limit, PACKAGES_PAGE_LIMIT))
+    return jsonify({"packages": packages, "cursor": cursor, "has_more": has_more}), 200
 
 @app.route('/send_message', methods=['POST'])
 def send_message():
@@ -156,23 +268,33 @@ def send_message():
         chat_entry = {
             "sender": sender,
             "receiver": receiver,
-            "message": message,
-            "timestamp": datetime.utcnow().isoformat()
+            "message": message
         }
-        chats.append(chat_entry)
         chat_entries.append(chat_entry)
+    # Stamps each entry with its id (the paging cursor) and timestamp.
+    tracking.add_messages(chat_entries)
+    for chat_entry in chat_entries:
+        events.publish('message', chat_entry, users=(sender, chat_entry['receiver']))
 
     if package_info:
         estimated_delivery_time = calculate_path_time(package_info, receivers)
+        estimated_arrival = None
+        if estimated_delivery_time is not None:
+            estimated_arrival = datetime.utcfromtimestamp(time.time() + estimated_delivery_time * 60).isoformat()
         package_entry = {
+            "id": str(uuid.uuid4()),
             "package_info": package_info,
             "status": "In Transit",
             "estimated_delivery_time": estimated_delivery_time,
+            "estimated_arrival": estimated_arrival,
+            "created_at": datetime.utcnow().isoformat(),
             "updated_at": datetime.utcnow().isoformat(),
             "sender": sender,
-            "receivers": receivers
+            "receivers": receivers,
+            "version": 1
         }
-        rescue_packages.append(package_entry)
+        tracking.add_packages([package_entry])
+        events.publish('package', package_entry)
 
     return jsonify({
         "message": "Messages sent successfully", 
@@ -181,39 +303,364 @@ def send_message():
     }), 200
 
 def calculate_path_time(package_info, receivers):
+    # Travel minutes: the planned delivery's, or over a cached route between
+    # the two locations with the cost layers as they are now.
     try:
-        for delivery in deliveries:
-            if delivery['sender'] == package_info['sender'] and delivery['receiver'] == package_info['receiver'] and delivery['resource'] == package_info['resource']:
-                return delivery.get('time', None)
+        delivery = deliveries.get(package_info['sender'], package_info['receiver'], package_info['resource'])
+        if delivery:
+            return delivery.get('time', None)
+        # No planned delivery yet: use a cached route between the two locations if there is one.
+        start = users.location('senders', package_info['sender'])
+        goal = users.location('receivers', package_info['receiver'])
+        path = route_cache.get(start, goal) if start and goal else None
+        if not path:
+            return None
+        with store.lock:
+            minutes = store.costs.path_minutes(path, time.time())
+        return minutes if minutes != math.inf else None
     except KeyError:
         return None
 
+def publish_people(op, args):
+    # Runs after UserIndex's own listener, so users.people already holds the new record.
+    if op == 'reload':
+        events.publish('people', {"reset": True})
+        return
+    key = entity_key(op, args)
+    if key in ('obstacles/', 'costs/'):
+        return
+    entity_type, name = key.split('/', 1)
+    events.publish('people', {"type": entity_type, "name": name, "user": users.people[entity_type].get(name)})
+
+store.subscribe(publish_people)
+
+# topics= value -> event name
+EVENT_TOPICS = {'people': 'people', 'packages': 'package', 'messages': 'message', 'jobs': 'job'}
+
+@app.route('/events', methods=['GET'])
+def stream_events():
+    # Server-sent events: people, package and message changes and finished jobs as they happen.
+    # topics= picks a comma separated subset; message events are only sent to
+    # a stream opened with user= set to their sender or receiver. Reconnecting
+    # clients resume from Last-Event-ID, or get a "reset" event (refetch full
+    # state) if they fell too far behind.
+    topics = request.args.get('topics', ','.join(EVENT_TOPICS)).split(',')
+    if any(topic not in EVENT_TOPICS for topic in topics):
+        return jsonify({"error": f"Unknown topic; expected some of {', '.join(EVENT_TOPICS)}"}), 400
+    topics = {EVENT_TOPICS[topic] for topic in topics}
+    user = request.args.get('user')
+    after = request.headers.get('Last-Event-ID')
+    try:
+        after = int(after) if after else None
+    except ValueError:
+        after = None
+    stream = events.stream(topics, user, after, on_idle=store.refresh)
+    return Response(stream, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def get_router():
+    # Built on first use and kept in sync with obstacle edits, so repeated route
+    # queries repair the previous search instead of starting over.
+    global router
+    with router_lock:
+        if router is None:
+            store.refresh()
+            with store.lock:
+                router = IncrementalRouter(store.locations['n'], store.obstacles,
+                                           hierarchical_distance=HIERARCHICAL_DISTANCE)
+                router.attach(store)
+        return router
+
+@app.route('/get_route', methods=['GET'])
+def get_route():
+    sender = request.args.get('sender')
+    receiver = request.args.get('receiver')
+
+    if not sender or not receiver:
+        return jsonify({"error": "Missing sender or receiver parameter"}), 400
+
+    start = users.location('senders', sender)
+    goal = users.location('receivers', receiver)
+    if not start or not goal:
+        return jsonify({"error": "User not found"}), 404
+
+    incremental = get_router()
+    with metrics.timer('route_seconds'):
+        path = incremental.route(start, goal)
+    metrics.observe('route_expanded_nodes', incremental.expanded, SIZE_BUCKETS)
+    if not path:
+        return jsonify({"path": path, "time": None, "eta": None}), 200
+    minutes = incremental.minutes(path)
+    eta = datetime.utcfromtimestamp(time.time() + minutes * 60).isoformat()
+    return jsonify({"path": path, "time": minutes, "distance": path_cost(path), "eta": eta}), 200
+
+@app.route('/obstacles', methods=['GET'])
+def get_obstacles():
+    store.refresh()
+    with store.lock:
+        cells, regions = store.obstacles.to_json()
+        version = store.versions.get('obstacles/')
+    return jsonify({"cells": cells, "regions": regions, "version": version}), 200
+
+def region_rects(region):
+    # A region is {"name", "polygon": [[x, y], ...]} or {"name", "rects": [[x0, y0, x1, y1], ...]}.
+    if 'polygon' in region:
+        polygon = region['polygon']
+        if not isinstance(polygon, list) or len(polygon) < 3 or \
+                not all(isinstance(p, list) and len(p) == 2 and all(isinstance(v, (int, float)) for v in p) for p in polygon):
+            return None
+        return polygon_rects(polygon)
+    rects = region.get('rects')
+    if not isinstance(rects, list) or \
+            not all(isinstance(r, list) and len(r) == 4 and all(isinstance(v, int) for v in r) and r[0] <= r[2] and r[1] <= r[3] for r in rects):
+        return None
+    return rects
+
+@app.route('/obstacles/add_regions', methods=['POST'])
+def add_obstacle_regions():
+    # Blocks whole areas (flooded zones, collapsed roads) in one update; a
+    # region replaces any earlier one with the same name.
+    regions = (request.json or {}).get('regions')
+    if not isinstance(regions, list) or not regions:
+        return jsonify({"error": "regions must be a non-empty list"}), 400
+    rects = {}
+    for index, region in enumerate(regions):
+        name = region.get('name') if isinstance(region, dict) else None
+        found = region_rects(region) if isinstance(name, str) and name else None
+        if found is None:
+            return jsonify({"error": f"Region {index} needs a name and a polygon of [x, y] points or rects of [x0, y0, x1, y1]"}), 400
+        rects[name] = found
+    try:
+        store.add_obstacle_regions(rects)
+    except OSError as e:
+        return jsonify({"error": "Failed to update obstacles", "details": str(e)}), 500
+    return jsonify({"message": "Obstacle regions added successfully", "regions": {name: len(r) for name, r in rects.items()}}), 200
+
+@app.route('/obstacles/remove_regions', methods=['POST'])
+def remove_obstacle_regions():
+    names = (request.json or {}).get('names')
+    if not isinstance(names, list) or not names:
+        return jsonify({"error": "names must be a non-empty list"}), 400
+    try:
+        missing = store.remove_obstacle_regions(names)
+    except OSError as e:
+        return jsonify({"error": "Failed to update obstacles", "details": str(e)}), 500
+    return jsonify({"message": "Obstacle regions removed successfully", "missing": missing}), 200
+
+@app.route('/costs', methods=['GET'])
+def get_costs():
+    # Cost regions by layer and name; "open" lists the windowed ones in effect now.
+    store.refresh()
+    with store.lock:
+        regions = store.costs.to_json()
+        windows = store.costs.windows(time.time())
+        version = store.versions.get('costs/')
+    return jsonify({"regions": regions, "open": [list(key) for key in windows], "version": version}), 200
+
+def epoch_seconds(value):
+    # ISO timestamp (UTC unless it has an offset), epoch seconds or None.
+    if value is None or isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if not isinstance(value, str):
+        raise ValueError(value)
+    moment = datetime.fromisoformat(value)
+    return (moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)).timestamp()
+
+@app.route('/costs/set_regions', methods=['POST'])
+def set_cost_regions():
+    # Sets many cost regions in one update: {"regions": [{"layer", "name",
+    # "rects" or "polygon", "cost": multiplier or null to close the area,
+    # "start", "end": optional window}]}. Only the cells the regions cover are
+    # recomputed; a region replaces any earlier one with the same layer and name.
+    regions = (request.json or {}).get('regions')
+    if not isinstance(regions, list) or not regions:
+        return jsonify({"error": "regions must be a non-empty list"}), 400
+    items = []
+    for index, region in enumerate(regions):
+        keys = (region.get('layer'), region.get('name')) if isinstance(region, dict) else (None, None)
+        rects = region_rects(region) if all(isinstance(key, str) and key for key in keys) else None
+        if rects is None:
+            return jsonify({"error": f"Region {index} needs a layer, a name and a polygon of [x, y] points or rects of [x0, y0, x1, y1]"}), 400
+        try:
+            start, end = epoch_seconds(region.get('start')), epoch_seconds(region.get('end'))
+            items.append((keys[0], keys[1], parse_region({"rects": rects, "cost": region.get('cost'), "start": start, "end": end})))
+        except ValueError as e:
+            return jsonify({"error": f"Region {index}: {e}"}), 400
+    try:
+        store.set_cost_regions([(layer, name, region_json(region)) for layer, name, region in items])
+    except OSError as e:
+        return jsonify({"error": "Failed to update costs", "details": str(e)}), 500
+    return jsonify({"message": "Cost regions set successfully", "regions": len(items)}), 200
+
+@app.route('/costs/remove_regions', methods=['POST'])
+def remove_cost_regions():
+    # {"regions": [{"layer", "name"}, ...]}; returns the ones that did not exist.
+    regions = (request.json or {}).get('regions')
+    if not isinstance(regions, list) or not regions or \
+            not all(isinstance(region, dict) and isinstance(region.get('layer'), str) and isinstance(region.get('name'), str) for region in regions):
+        return jsonify({"error": "regions must be a non-empty list of {layer, name}"}), 400
+    try:
+        missing = store.remove_cost_regions([(region['layer'], region['name']) for region in regions])
+    except OSError as e:
+        return jsonify({"error": "Failed to update costs", "details": str(e)}), 500
+    return jsonify({"message": "Cost regions removed successfully", "missing": [{"layer": layer, "name": name} for layer, name in missing]}), 200
+
+NEAREST_LIMIT = 5
+NEAREST_MAX_LIMIT = 100
+
+def query_point():
+    # role= picks the users searched (distributor or camp, default distributor);
+    # the search is around x=/y= or around the user given as name=, who is left
+    # out of the results. Returns (entity_type, x, y, exclude) or an error response.
+    entity_type = {'distributor': 'senders', 'camp': 'receivers'}.get(request.args.get('role', 'distributor'))
+    if entity_type is None:
+        return None, (jsonify({"error": "role must be distributor or camp"}), 400)
+    name = request.args.get('name')
+    if name:
+        point = users.location('senders', name) or users.location('receivers', name)
+        if not point:
+            return None, (jsonify({"error": "User not found"}), 404)
+        try:
+            return (entity_type, float(point[0]), float(point[1]), name), None
+        except (TypeError, ValueError):
+            return None, (jsonify({"error": "User has no valid location"}), 400)
+    try:
+        return (entity_type, float(request.args['x']), float(request.args['y']), None), None
+    except (KeyError, ValueError):
+        return None, (jsonify({"error": "Missing or invalid x, y or name parameter"}), 400)
+
+@app.route('/nearest', methods=['GET'])
+def nearest_users():
+    # The k closest users by straight-line grid distance (octile), nearest first.
+    query, error = query_point()
+    if error:
+        return error
+    try:
+        k = int(request.args.get('k', NEAREST_LIMIT))
+    except ValueError:
+        return jsonify({"error": "Invalid k parameter"}), 400
+    if k < 1:
+        return jsonify({"error": "Invalid k parameter"}), 400
+    entity_type, x, y, exclude = query
+    return jsonify({"users": users.nearest(entity_type, x, y, min(k, NEAREST_MAX_LIMIT), exclude)}), 200
+
+@app.route('/within', methods=['GET'])
+def users_within():
+    # Every user at most radius= away (octile), nearest first.
+    query, error = query_point()
+    if error:
+        return error
+    try:
+        radius = float(request.args['radius'])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Missing or invalid radius parameter"}), 400
+    if radius < 0:
+        return jsonify({"error": "Missing or invalid radius parameter"}), 400
+    entity_type, x, y, exclude = query
+    return jsonify({"users": users.within(entity_type, x, y, radius, exclude)}), 200
+
+@app.route('/plan', methods=['POST'])
+def start_plan():
+    # Match and route in the background right away; poll /jobs/<id> for progress.
+    job = schedule_plan(delay=0)
+    return jsonify({"job": job.to_json(result=False)}), 202
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({"jobs": [job.to_json(result=False) for job in jobs.list()]}), 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"job": job.to_json()}), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Prometheus text exposition of this worker process's metrics.
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+PROFILER_INTERVAL = 0.01
+
+@app.route('/profiler', methods=['GET', 'POST'])
+def control_profiler():
+    # POST {"enabled": true|false, "interval": seconds, "reset": true} switches
+    # the sampling profiler on or off. GET returns the hottest functions, or
+    # with ?format=collapsed the raw stacks for flamegraph.pl / speedscope.
+    if request.method == 'POST':
+        data = request.json or {}
+        interval = data.get('interval', PROFILER_INTERVAL)
+        if not isinstance(interval, (int, float)) or isinstance(interval, bool) or not 0.001 <= interval <= 1:
+            return jsonify({"error": "interval must be between 0.001 and 1 seconds"}), 400
+        if data.get('reset'):
+            profiler.reset()
+        if 'enabled' in data:
+            if data['enabled']:
+                profiler.start(interval)
+            else:
+                profiler.stop()
+    if request.args.get('format') == 'collapsed':
+        return Response(profiler.collapsed(), mimetype='text/plain')
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return jsonify({"profiler": profiler.to_json(limit)}), 200
+
+MESSAGES_PAGE_LIMIT = 100
+MESSAGES_MAX_LIMIT = 1000
+
 @app.route('/get_messages', methods=['GET'])
 def get_messages():
+    # Pages through a user's messages oldest first. Pass the returned cursor
+    # back as after= to fetch only newer messages; since= (ISO timestamp) skips
+    # older ones.
     user = request.args.get('user')
 
     if not user:
         return jsonify({"error": "Missing user parameter"}), 400
 
-    user_chats = [chat for chat in chats if chat['sender'] == user or chat['receiver'] == user]
-    return jsonify({"messages": user_chats}), 200
+    try:
+        after = request.args.get('after')
+        after = int(after) if after else None
+        limit = int(request.args.get('limit', MESSAGES_PAGE_LIMIT))
+        since = request.args.get('since')
+        if since:
+            since = datetime.fromisoformat(since)
+            if since.tzinfo:
+                since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    except ValueError:
+        return jsonify({"error": "Invalid after, since or limit parameter"}), 400
+    if limit < 1:
+        return jsonify({"error": "Invalid after, since or limit parameter"}), 400
+
+    messages, has_more = tracking.message_page(user, after, since or None, min(limit, MESSAGES_MAX_LIMIT))
+    cursor = messages[-1]['id'] if messages else after
+    return jsonify({"messages": messages, "cursor": cursor, "has_more": has_more}), 200
 
 @app.route('/update_package_status', methods=['POST'])
 def update_package_status():
-    data = request.json
+    data = request.json or {}
     package_info = data.get('package_info')
     status = data.get('status')
 
     if not all([package_info, status]):
         return jsonify({"error": "Missing package_info or status"}), 400
+    if not isinstance(package_info, dict) or not isinstance(status, str):
+        return jsonify({"error": "package_info must be an object and status a string"}), 400
 
-    for package in rescue_packages:
-        if package['id'] == package_info.get('id'):
-            package['status'] = status
-            package['updated_at'] = datetime.utcnow().isoformat()
-            return jsonify({"message": "Package status updated successfully", "package_info": package_info, "status": status}), 200
+    package_id = package_info.get('id')
+    if not isinstance(package_id, str):
+        return jsonify({"error": "package_info.id must be a string"}), 400
+    try:
+        package = tracking.update_package_status(package_id, status, package_info.get('version'))
+    except VersionConflict as e:
+        return jsonify({"error": "Version conflict", "version": e.actual}), 409
+    if not package:
+        return jsonify({"error": "Package not found"}), 404
+    events.publish('package', package)
 
-    return jsonify({"error": "Package not found"}), 404
+    return jsonify({"message": "Package status updated successfully", "package_info": package_info, "status": status, "version": package['version']}), 200
 
 @app.route('/get_package_status', methods=['GET'])
 def get_package_status():
@@ -222,11 +669,134 @@ def get_package_status():
     if not package_id:
         return jsonify({"error": "Missing package_id parameter"}), 400
 
-    package = next((p for p in rescue_packages if p['id'] == package_id), None)
+    package = tracking.get_package(package_id)
     if not package:
         return jsonify({"error": "Package not found"}), 404
 
+    if request.args.get('history') in ('1', 'true'):
+        return jsonify({"package": package, "history": tracking.package_history(package_id)}), 200
     return jsonify({"package": package}), 200
 
+# Bulk endpoints. The body is a JSON array, {"items": [...]}, or NDJSON (one
+# item per line, Content-Type application/x-ndjson). Items take the same fields
+# as the single-item endpoint. Store writes are applied as one journal append
+# and one fsync; items that fail are reported by index in "errors" and do not
+# stop the rest of the batch.
+
+def read_items():
+    # Returns (items, errors); unparseable NDJSON lines become None items with an error.
+    errors = []
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                errors.append({"index": len(items), "error": f"Invalid JSON: {e}"})
+                items.append(None)
+        return items, errors
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('items')
+    if not isinstance(data, list):
+        return None, errors
+    return data, errors
+
+def bulk_response(count, errors, **extra):
+    errors.sort(key=lambda error: error['index'])
+    return jsonify({"applied": count - len(errors), "errors": errors, **extra}), 200
+
+@app.route('/bulk/add_name', methods=['POST'])
+def bulk_add_users():
+    items, errors = read_items()
+    if items is None:
+        return jsonify({"error": "Expected a JSON array, {\"items\": [...]} or NDJSON"}), 400
+
+    indexes = []
+    new_users = []
+    for index, data in enumerate(items):
+        if data is None:
+            continue
+        if not isinstance(data, dict) or any(data.get(field) is None for field in ('name', 'role')) \
+                or not valid_coordinate(data.get('x')) or not valid_coordinate(data.get('y')):
+            errors.append({"index": index, "error": "Invalid or missing user data"})
+            continue
+        entity_type = 'receivers' if data['role'] == 'camp' else 'senders'
+        indexes.append(index)
+        new_users.append((entity_type, {"name": data['name'], "x": data['x'], "y": data['y']}))
+
+    try:
+        results = store.add_users(new_users)
+    except OSError as e:
+        return jsonify({"error": "Failed to add users", "details": str(e)}), 500
+    for index, result in zip(indexes, results):
+        if result:
+            errors.append({"index": index, "error": f"User name '{items[index]['name']}' has already been taken"})
+    return bulk_response(len(items), errors)
+
+def bulk_set_resources(entity_type):
+    items, errors = read_items()
+    if items is None:
+        return jsonify({"error": "Expected a JSON array, {\"items\": [...]} or NDJSON"}), 400
+
+    indexes = []
+    updates = []
+    for index, data in enumerate(items):
+        if data is None:
+            continue
+        if not isinstance(data, dict) or any(data.get(field) is None for field in ('sender', 'name', 'amount')):
+            errors.append({"index": index, "error": "Missing sender, name, or amount"})
+            continue
+        if not valid_amount(data['amount']):
+            errors.append({"index": index, "error": "amount must be a non-negative integer"})
+            continue
+        indexes.append(index)
+        updates.append((entity_type, data['sender'], data['name'], data['amount'], data.get('version')))
+
+    try:
+        results = store.set_resources(updates)
+    except (OSError, ValueError) as e:
+        return jsonify({"error": "Failed to update resources", "details": str(e)}), 500
+    role = 'sender' if entity_type == 'senders' else 'receiver'
+    for index, result in zip(indexes, results):
+        if isinstance(result, KeyError):
+            errors.append({"index": index, "error": f"Unknown {role} '{items[index]['sender']}'"})
+        elif isinstance(result, VersionConflict):
+            errors.append({"index": index, "error": "Version conflict", "version": result.actual})
+    if any(not isinstance(result, Exception) for result in results):
+        return bulk_response(len(items), errors, job=schedule_plan().id)
+    return bulk_response(len(items), errors)
+
+@app.route('/bulk/add_resources', methods=['POST'])
+def bulk_add_resources():
+    return bulk_set_resources('senders')
+
+@app.route('/bulk/request_resources', methods=['POST'])
+def bulk_request_resources():
+    return bulk_set_resources('receivers')
+
+@app.route('/bulk/add_package', methods=['POST'])
+def bulk_add_packages():
+    items, errors = read_items()
+    if items is None:
+        return jsonify({"error": "Expected a JSON array, {\"items\": [...]} or NDJSON"}), 400
+
+    packages = []
+    for index, data in enumerate(items):
+        if data is None:
+            continue
+        package_info = data.get('package_info') if isinstance(data, dict) else None
+        if not package_info or not isinstance(package_info, dict):
+            errors.append({"index": index, "error": "Invalid or missing package data"})
+            continue
+        packages.append(new_package(package_info))
+    # One transaction for the whole batch.
+    tracking.add_packages(packages)
+    for package in packages:
+        events.publish('package', package)
+    return bulk_response(len(items), errors, packages=packages)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file